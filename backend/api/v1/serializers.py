@@ -151,7 +151,15 @@ class TemplateSerializerMinified(serializers.ModelSerializer):
 
     class Meta:
         model = Template
-        exclude = ("template",)
+        exclude = (
+            "template",
+            "prepared_template",
+            "tags",
+            "draft_docx",
+            "draft_pdf",
+            "draft_version",
+            "search_vector",
+        )
         read_only_fields = (
             "name",
             "category",
@@ -191,7 +199,15 @@ class TemplateSerializerPlain(TemplateSerializerMinified):
 
     class Meta(TemplateSerializerMinified.Meta):
         model = Template
-        exclude = ("template",)
+        exclude = (
+            "template",
+            "prepared_template",
+            "tags",
+            "draft_docx",
+            "draft_pdf",
+            "draft_version",
+            "search_vector",
+        )
         # fields = "__all__"
         read_only_fields = ("is_favorited", "groups")
 
@@ -209,7 +225,15 @@ class TemplateSerializer(TemplateSerializerMinified):
 
     class Meta(TemplateSerializerMinified.Meta):
         model = Template
-        exclude = ("template",)
+        exclude = (
+            "template",
+            "prepared_template",
+            "tags",
+            "draft_docx",
+            "draft_pdf",
+            "draft_version",
+            "search_vector",
+        )
         read_only_fields = (
             "is_favorited",
             "grouped_fields",
@@ -290,6 +314,8 @@ class TemplateWriteSerializer(serializers.ModelSerializer):
                 data["group"] = group_models[group_id]
             template_fields.append(TemplateField(template=template, **data))
         TemplateField.objects.bulk_create(template_fields)
+        # bulk_create не отправляет сигналы post_save полей
+        Template.objects.filter(pk=template.pk).update_search_vector()
         return template
 
     def to_representation(self, instance):
@@ -0,0 +1,205 @@
+"""
+Условные запросы (ETag / Last-Modified) для шаблонов и документов.
+
+Валидаторы вычисляются одним-двумя запросами к БД из дат изменения
+шаблона (Template.updated, обновляется и при изменении полей и групп
+шаблона, см. documents.signals) и документа (Document.updated), а для
+ответов с признаком is_favorited - и из избранного пользователя. При
+совпадении валидаторов (If-None-Match / If-Modified-Since) ответ 304
+формируется без сериализации и рендеринга файлов.
+"""
+import hashlib
+from datetime import datetime
+from functools import partial, wraps
+from typing import Callable, Optional
+
+from django.db import models
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from documents.models import (
+    Document,
+    FavTemplate,
+    Template,
+    favorited_annotation,
+)
+
+
+def make_etag(*parts) -> str:
+    """ETag из значений, определяющих содержимое ответа."""
+    return hashlib.md5(
+        "|".join(str(part) for part in parts).encode()
+    ).hexdigest()
+
+
+def per_request(func: Callable) -> Callable:
+    """
+    Значение вычисляется один раз для запроса: общее для функций ETag и
+    Last-Modified.
+    """
+
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        values = getattr(request, "_conditional_values", None)
+        if values is None:
+            values = request._conditional_values = {}
+        if func not in values:
+            values[func] = func(request, *args, **kwargs)
+        return values[func]
+
+    return wrapper
+
+
+def conditional_get(
+    etag_func: Callable, last_modified_func: Optional[Callable] = None
+):
+    """
+    Декоратор метода представления: ответ 304 при совпадении валидаторов
+    (django.views.decorators.http.condition). Клиент проверяет
+    актуальность ответа при каждом запросе (Cache-Control: no-cache),
+    ответы зависят от пользователя (private).
+    """
+
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            view = condition(etag_func, last_modified_func)(
+                partial(view_method, self)
+            )
+            response = view(request, *args, **kwargs)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def template_list_etag(request, *args, **kwargs) -> str:
+    """
+    Каталог шаблонов: шаблоны, избранное пользователя, параметры. Одним
+    запросом: избранное пользователя присоединяется к шаблонам каталога.
+    """
+    user = request.user
+    templates = Template.objects.all()
+    if not user.is_superuser:
+        templates = templates.filter(deleted=False)
+    aggregates = {
+        "count": models.Count("id"),
+        "updated": models.Max("updated"),
+    }
+    if user.is_authenticated:
+        # не более одной записи избранного на шаблон (unique_user_template):
+        # соединение не размножает строки шаблонов
+        templates = templates.alias(
+            user_favorites=models.FilteredRelation(
+                "favorite_templates",
+                condition=models.Q(favorite_templates__user=user),
+            )
+        )
+        # id избранного возрастают: замена записи меняет максимум
+        aggregates.update(
+            favorites=models.Count("user_favorites"),
+            last_favorite=models.Max("user_favorites"),
+        )
+    state = templates.aggregate(**aggregates)
+    return make_etag(
+        request.get_full_path(),
+        user.pk,
+        state["count"],
+        state["updated"],
+        state.get("favorites"),
+        state.get("last_favorite"),
+    )
+
+
+def template_etag(request, pk=None, **kwargs) -> Optional[str]:
+    """Шаблон: дата изменения и признак избранного."""
+    user = request.user
+    # удаленные шаблоны доступны только суперпользователю (как в
+    # TemplateViewSet.get_queryset): для остальных - ответ 404, а не 304
+    templates = Template.objects.filter(pk=pk)
+    if not user.is_superuser:
+        templates = templates.filter(deleted=False)
+    state = (
+        templates.with_is_favorited(user)
+        .values_list("updated", "is_favorited")
+        .first()
+    )
+    if state is None:
+        return None
+    return make_etag(user.pk, *state)
+
+
+@per_request
+def template_updated(
+    request, pk=None, template_id=None, **kwargs
+) -> Optional[datetime]:
+    """Дата изменения шаблона (template_id или pk в адресе)."""
+    if template_id is None:
+        template_id = pk
+    return (
+        Template.objects.filter(pk=template_id)
+        .values_list("updated", flat=True)
+        .first()
+    )
+
+
+def template_fields_etag(request, *args, **kwargs) -> Optional[str]:
+    """Поля шаблона (и черновик шаблона): дата изменения и адрес."""
+    updated = template_updated(request, *args, **kwargs)
+    if updated is None:
+        return None
+    return make_etag(request.get_full_path(), updated)
+
+
+def document_etag(request, pk=None, **kwargs) -> Optional[str]:
+    """
+    Документ пользователя: даты изменения документа и шаблона, признаки
+    избранного документа и шаблона.
+    """
+    user = request.user
+    state = (
+        Document.objects.filter(owner=user, pk=pk)
+        .with_is_favorited(user)
+        .annotate(
+            template_is_favorited=favorited_annotation(
+                FavTemplate.objects.all(), user, "template"
+            ),
+        )
+        .values_list(
+            "updated",
+            "is_favorited",
+            "template__updated",
+            "template_is_favorited",
+        )
+        .first()
+    )
+    if state is None:
+        return None
+    return make_etag(user.pk, *state)
+
+
+@per_request
+def _document_file_state(request, pk=None, **kwargs):
+    return (
+        Document.objects.filter(owner=request.user, pk=pk)
+        .values_list("updated", "template__updated")
+        .first()
+    )
+
+
+def document_file_etag(request, pk=None, **kwargs) -> Optional[str]:
+    """Файл документа: даты изменения документа и шаблона, адрес."""
+    state = _document_file_state(request, pk=pk)
+    if state is None:
+        return None
+    return make_etag(request.get_full_path(), *state)
+
+
+def document_file_modified(request, pk=None, **kwargs) -> Optional[datetime]:
+    """Файл документа изменяется с документом и с шаблоном."""
+    state = _document_file_state(request, pk=pk)
+    if state is None:
+        return None
+    return max(state)
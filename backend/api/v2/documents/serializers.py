@@ -1,5 +1,10 @@
 """Сериализаторы для API."""
 import base64
+import csv
+import io
+from typing import Dict, List
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.core.files.base import ContentFile
@@ -14,7 +19,9 @@ from core.constants import Messages
 from documents.models import (
     Document,
     DocumentField,
-    FavDocument)
+    FavDocument,
+    Template,
+    TemplateField)
 
 User = get_user_model()
 
@@ -23,6 +30,9 @@ class DocumentFieldSerializer(serializers.ModelSerializer):
     """Сериализатор поля документов."""
 
     description = serializers.CharField(required=False, max_length=200)
+    # id поля шаблона: поля загружаются и проверяются одним запросом
+    # (DocumentWriteSerializer.validate)
+    field = serializers.IntegerField(source="field_id")
 
     class Meta:
         model = DocumentField
@@ -47,6 +57,122 @@ class DocumentFieldWriteSerializer(serializers.ModelSerializer):
         return template_field
 
 
+class TemplateFieldByTag(serializers.Field):
+    """
+    Поле шаблона, заданное тэгом. Поля шаблона передаются в контексте
+    сериализатора (fields_by_tag), запросы к БД не выполняются.
+    """
+
+    default_error_messages = {"does_not_exist": Messages.UNKNOWN_FIELD_TAG}
+
+    def to_internal_value(self, tag):
+        template_field = self.context["fields_by_tag"].get(tag)
+        if template_field is None:
+            self.fail("does_not_exist", tag=tag)
+        return template_field
+
+    def to_representation(self, template_field):
+        return template_field.tag
+
+
+class BatchDocumentFieldSerializer(DocumentFieldWriteSerializer):
+    """Сериализатор поля записи пакетного формирования документов."""
+
+    field = TemplateFieldByTag()
+
+
+class BatchRecordsSerializer(serializers.Serializer):
+    """
+    Записи для пакетного формирования документов: значения полей по тэгам
+    в виде массива JSON (records) или файла CSV (file) с тэгами в заголовке.
+    """
+
+    records = serializers.ListField(
+        child=serializers.DictField(
+            child=serializers.CharField(allow_blank=True, allow_null=True)
+        ),
+        required=False,
+    )
+    file = serializers.FileField(required=False)
+
+    def validate(self, data):
+        records = data.get("records") or []
+        if "file" in data:
+            records = self.read_csv(data["file"])
+        if not records:
+            raise serializers.ValidationError(Messages.BATCH_NO_RECORDS)
+        # пакет формируется в ответе на запрос и должен укладываться в
+        # timeout рабочего процесса gunicorn; объединенный документ
+        # конвертируется в pdf один раз
+        max_records = (
+            settings.BATCH_MAX_PDF_RECORDS
+            if self.context.get("pdf") and not self.context.get("merge")
+            else settings.BATCH_MAX_RECORDS
+        )
+        if len(records) > max_records:
+            raise serializers.ValidationError(
+                Messages.BATCH_TOO_MANY_RECORDS.format(max_records)
+            )
+        # пустые значения не передаются: поле заполняется по умолчанию
+        data["records"] = [
+            {tag: value for tag, value in record.items() if tag and value}
+            for record in records
+        ]
+        return data
+
+    @staticmethod
+    def read_csv(file) -> List[Dict[str, str]]:
+        try:
+            text = file.read().decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise serializers.ValidationError(
+                {"file": Messages.BATCH_CSV_INVALID}
+            )
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        return list(csv.DictReader(io.StringIO(text), dialect=dialect))
+
+
+class DocumentPackageSerializer(serializers.Serializer):
+    """
+    Пакет документов: несколько шаблонов (templates - id в порядке
+    следования в архиве) и общие для них значения полей по тэгам (context).
+    """
+
+    templates = serializers.ListField(
+        child=serializers.IntegerField(),
+        min_length=1,
+        max_length=settings.PACKAGE_MAX_TEMPLATES,
+    )
+    context = serializers.DictField(
+        child=serializers.CharField(allow_blank=True, allow_null=True),
+        required=False,
+        default=dict,
+    )
+
+    def validate_templates(self, template_ids):
+        if len(set(template_ids)) != len(template_ids):
+            raise serializers.ValidationError(
+                Messages.PACKAGE_TEMPLATES_NOT_UNIQUE
+            )
+        templates = Template.objects.filter(
+            id__in=template_ids, deleted=False
+        ).prefetch_related("fields__type")
+        templates = {template.id: template for template in templates}
+        not_found = [id for id in template_ids if id not in templates]
+        if not_found:
+            raise serializers.ValidationError(
+                Messages.PACKAGE_TEMPLATES_NOT_FOUND.format(not_found)
+            )
+        return [templates[id] for id in template_ids]
+
+    def validate_context(self, context):
+        # пустые значения не передаются: поле заполняется по умолчанию
+        return {tag: value for tag, value in context.items() if value}
+
+
 class DocumentReadSerializerMinified(serializers.ModelSerializer):
     """Сериализатор документов сокращенный (без информации о полях)"""
 
@@ -66,6 +192,9 @@ class DocumentReadSerializerMinified(serializers.ModelSerializer):
         )
 
     def get_is_favorited(self, document: Document) -> bool:
+        # значение аннотации DocumentQuerySet.with_is_favorited
+        if hasattr(document, "is_favorited"):
+            return document.is_favorited
         user = self.context.get("request").user
         if not user.is_authenticated:
             return False
@@ -103,6 +232,9 @@ class DocumentReadSerializerExtended(serializers.ModelSerializer):
         )
 
     def get_is_favorited(self, document: Document) -> bool:
+        # значение аннотации DocumentQuerySet.with_is_favorited
+        if hasattr(document, "is_favorited"):
+            return document.is_favorited
         user = self.context.get("request").user
         if not user.is_authenticated:
             return False
@@ -111,18 +243,20 @@ class DocumentReadSerializerExtended(serializers.ModelSerializer):
         ).exists()
 
     def get_ungrouped_fields(self, instance):
-        solo_fields = instance.template.fields.filter(group=None).order_by(
-            "id"
-        )
+        # поля предзагружены TemplateQuerySet.with_fields
+        solo_fields = [
+            field
+            for field in instance.template.fields.all()
+            if field.group_id is None
+        ]
         return TemplateFieldSerializerMinified(solo_fields, many=True).data
 
     def to_representation(self, instance):
         response = super().to_representation(instance)
-        response["grouped_fields"].sort(key=lambda x: x["id"])
         # add field values
         field_vals = {}
         for document_field in instance.document_fields.all():
-            field_vals[document_field.field.id] = document_field.value
+            field_vals[document_field.field_id] = document_field.value
         for group in response["grouped_fields"]:
             for field in group["fields"]:
                 id = field.get("id")
@@ -151,6 +285,42 @@ class DocumentWriteSerializer(serializers.ModelSerializer):
             "document_fields",
         )
 
+    def validate(self, attrs):
+        """
+        Поля документа принадлежат шаблону документа. Поля шаблона вместе
+        с типами (для custom_fieldtypes_validation) загружаются одним
+        запросом.
+        """
+        document_fields = attrs.get("document_fields")
+        if not document_fields:
+            return attrs
+        template = attrs.get("template")
+        if template is not None:
+            template_id = template.id
+        else:
+            template_id = getattr(self.instance, "template_id", None)
+        ids = [field_data["field_id"] for field_data in document_fields]
+        template_fields = (
+            TemplateField.objects.select_related("type")
+            .filter(template_id=template_id)
+            .in_bulk(ids)
+        )
+        wrong_ids = [
+            id for id in dict.fromkeys(ids) if id not in template_fields
+        ]
+        if wrong_ids:
+            raise serializers.ValidationError(
+                {
+                    "document_fields": [
+                        Messages.WRONG_TEMPLATE_FIELD.format(id)
+                        for id in wrong_ids
+                    ]
+                }
+            )
+        for field_data in document_fields:
+            field_data["field"] = template_fields[field_data.pop("field_id")]
+        return attrs
+
     @transaction.atomic
     def create(self, validated_data):
         """Создание документа и полей документа"""
@@ -170,8 +340,7 @@ class DocumentWriteSerializer(serializers.ModelSerializer):
         document = Document.objects.get(id=instance.id)
         if document_fields is not None:
             custom_fieldtypes_validation(document_fields)
-            document.document_fields.all().delete()
-            document.create_document_fields(document_fields)
+            document.update_document_fields(document_fields)
         return document
 
     def to_representation(self, instance):
@@ -1,8 +1,10 @@
 """Вьюсеты v1 API."""
 from datetime import datetime
+import io
 import logging
 
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
 from django.http import FileResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
@@ -13,12 +15,14 @@ from rest_framework import (
     views,
 )
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 
-from core.template_render import DocumentTemplate
 from .serializers import (
+    BatchDocumentFieldSerializer,
+    BatchRecordsSerializer,
+    DocumentPackageSerializer,
     DocumentFieldSerializer,
     DocumentReadSerializerExtended,
     DocumentReadSerializerMinified,
@@ -26,7 +30,17 @@ from .serializers import (
     DocumentFieldWriteSerializer,
 )
 from api.v2 import utils as v1utils
-from documents.models import Document, Template
+from api.v2.conditional import (
+    conditional_get,
+    document_etag,
+    document_file_etag,
+    document_file_modified,
+)
+from api.v2.pagination import OptInCursorPagination
+from api.v2.jobs.serializers import ConversionJobSerializer
+from core.constants import Messages
+from core.zip_stream import iter_zip
+from documents.models import ConversionJob, Document, Template
 
 logger = logging.getLogger(__name__)
 
@@ -35,11 +49,35 @@ User = get_user_model()
 
 def send_file(filestream, filename: str, as_attachment: bool = True):
     """Функция подготовки открытого двоичного файла к отправке."""
+    uri = v1utils.accel_redirect_uri(filestream)
+    if uri is not None:
+        # файл отправляет nginx, бэкенд только проверяет права доступа
+        filestream.close()
+        response = FileResponse(
+            iter(()), as_attachment=as_attachment, filename=filename
+        )
+        response.set_headers(None)
+        response["X-Accel-Redirect"] = uri
+        return response
     response = FileResponse(
         streaming_content=filestream,
         as_attachment=as_attachment,
         filename=filename,
     )
+    # для файлов, открытых не по абсолютному пути (FieldFile, файл pdf
+    # из временного каталога), размер берется у открытого файла
+    if not response.has_header("Content-Length"):
+        size = v1utils.file_size(filestream)
+        if size is not None:
+            response["Content-Length"] = size
+    return response
+
+
+def send_stream(chunks, filename: str):
+    """Отправка файла, формируемого по частям (генератор байтовых строк)."""
+    response = FileResponse(chunks, as_attachment=True, filename=filename)
+    # для генератора заголовки по имени файла не устанавливаются
+    response.set_headers(None)
     return response
 
 
@@ -56,19 +94,30 @@ class DocumentViewSet(viewsets.ModelViewSet):
         filters.OrderingFilter,
         DjangoFilterBackend,
     )
-    pagination_class = None
+    pagination_class = OptInCursorPagination
+    # сортировка постраничной выдачи (индекс document_owner_created_idx)
+    ordering = ("created", "id")
     filterset_fields = ("owner",)
     search_fields = ("owner",)
 
     def get_queryset(self):
         """Выдаем только список документов текущего пользователя."""
+        user = self.request.user
         # ЗАглушка
-        if self.request.user.is_authenticated:
-            return self.request.user.documents
+        if user.is_authenticated:
+            queryset = user.documents.all()
         else:
-            user = User.objects.get(id=1)
-            return Document.objects.filter(owner=user)
-        return Document.objects.none()
+            queryset = Document.objects.filter(owner=User.objects.get(id=1))
+        queryset = queryset.with_is_favorited(user)
+        if self.action == "retrieve":
+            # схема шаблона (поля по id) и значения полей загружаются
+            # заранее
+            templates = Template.objects.with_fields().with_is_favorited(user)
+            queryset = queryset.prefetch_related(
+                Prefetch("template", queryset=templates),
+                "document_fields",
+            )
+        return queryset
 
     def get_serializer_class(self):
         """Выбор сериализатора."""
@@ -78,9 +127,25 @@ class DocumentViewSet(viewsets.ModelViewSet):
             return DocumentReadSerializerMinified
         return DocumentWriteSerializer
 
+    @conditional_get(document_etag)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    def list_documents(self, queryset):
+        """Список документов (постранично, если запрошено)."""
+        page = self.paginate_queryset(queryset)
+        serializer = DocumentReadSerializerMinified(
+            queryset if page is None else page,
+            many=True,
+            context={"request": self.request},
+        )
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
     @action(
         detail=False,
         permission_classes=[
@@ -92,11 +157,10 @@ class DocumentViewSet(viewsets.ModelViewSet):
     def draft_documents(self, request):
         """Возвращает список незаконченных документов/черновиков"""
         user = self.request.user
-        queryset = Document.objects.filter(completed=False, owner=user)
-        serializer = DocumentReadSerializerMinified(
-            queryset, many=True, context={"request": request}
-        )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        queryset = Document.objects.filter(
+            completed=False, owner=user
+        ).with_is_favorited(user)
+        return self.list_documents(queryset)
 
     @action(
         detail=False,
@@ -108,25 +172,51 @@ class DocumentViewSet(viewsets.ModelViewSet):
     def history_documents(self, request):
         """Возвращает список законченных документов/история"""
         user = self.request.user
-        queryset = Document.objects.filter(completed=True, owner=user)
-        serializer = DocumentReadSerializerMinified(
-            queryset, many=True, context={"request": request}
+        queryset = Document.objects.filter(
+            completed=True, owner=user
+        ).with_is_favorited(user)
+        return self.list_documents(queryset)
+
+    @action(
+        detail=False,
+        permission_classes=[
+            IsAuthenticated,
+        ],
+        url_path=r"search",
+    )
+    def search_documents(self, request):
+        """
+        Поиск документов пользователя по тексту (параметр q) в описании,
+        наименовании шаблона и значениях полей.
+        """
+        text = request.query_params.get("q", "").strip()
+        if not text:
+            raise ValidationError({"q": Messages.SEARCH_QUERY_REQUIRED})
+        user = self.request.user
+        queryset = (
+            Document.objects.filter(owner=user)
+            .search(text)
+            .with_is_favorited(user)
         )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.list_documents(queryset)
 
     @action(
         detail=True,
         permission_classes=[
-            IsAuthenticated
-            ],
+            IsAuthenticated,
+        ],
         url_path=r"download_document",
     )
+    @conditional_get(document_file_etag, document_file_modified)
     def download_document(self, request, pk=None):
         """Скачивание готового документа."""
         logger.debug(f"Start docx generation for document_id {pk}")
         start_time = datetime.utcnow()
-        document = get_object_or_404(Document, id=pk)
-        buffer = v1utils.fill_docx_template_for_document(document)
+        # только документы пользователя (DocumentViewSet.get_queryset)
+        document = self.get_object()
+        buffer = v1utils.open_partial_docx(
+            document.template, *v1utils.get_document_context(document)
+        )
         docx_time = datetime.utcnow()
         logger.debug(
             f"Time of docx generation for document_id {pk} is {docx_time-start_time}"
@@ -137,16 +227,20 @@ class DocumentViewSet(viewsets.ModelViewSet):
     @action(
         detail=True,
         permission_classes=[
-            IsAuthenticated
-            ],
+            IsAuthenticated,
+        ],
         url_path="download_pdf",
     )
+    @conditional_get(document_file_etag, document_file_modified)
     def download_pdf(self, request, pk=None):
         """Генерация и выдача на скачивание pdf-файла."""
-        document = get_object_or_404(Document, pk=pk)
+        # только документы пользователя (DocumentViewSet.get_queryset)
+        document = self.get_object()
         logger.debug(f"Start docx generation for document_id {pk}")
         start_time = datetime.utcnow()
-        buffer = v1utils.create_document_pdf_for_export(document)
+        buffer = v1utils.open_partial_pdf(
+            document.template, *v1utils.get_document_context(document)
+        )
         pdf_time = datetime.utcnow()
         logger.debug(
             f"Time of docx generation for document_id {pk} is {pdf_time-start_time}"
@@ -154,6 +248,28 @@ class DocumentViewSet(viewsets.ModelViewSet):
         response = send_file(buffer, f"{document.template.name}.pdf")
         return response
 
+    @action(
+        detail=True,
+        methods=["post"],
+        permission_classes=[
+            IsAuthenticated,
+        ],
+        url_path="pdf_job",
+    )
+    def pdf_job(self, request, pk=None):
+        """
+        Постановка в очередь задания на формирование pdf-файла.
+        Статус и результат - по адресу pdf_jobs/<id>/.
+        """
+        document = self.get_object()
+        job = ConversionJob.objects.create(
+            owner=request.user,
+            document=document,
+            filename=f"{document.template.name}.pdf",
+        )
+        serializer = ConversionJobSerializer(job, context={"request": request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
 
 class DocumentFieldViewSet(viewsets.ModelViewSet):
     """Поле шаблона."""
@@ -163,7 +279,7 @@ class DocumentFieldViewSet(viewsets.ModelViewSet):
     http_method_names = ("get",)
     permission_classes = (IsAuthenticated,)
     # permission_classes = (AllowAny,) # Заглушка
-    pagination_class = None
+    pagination_class = OptInCursorPagination
 
     def get_queryset(self):
         document_id = self.kwargs.get("document_id")
@@ -199,20 +315,188 @@ class AnonymousDownloadPreviewAPIView(views.APIView):
             field.tag: field.default or field.name
             for field in template.fields.all()
         }
-        doc = DocumentTemplate(template.template)
-        buffer = doc.get_partial(context, context_default)
-        filename = f"{template.name}_preview.docx"
-        docx_time = datetime.utcnow()
-        logger.debug(
-            f"Time of docx generation for template {template_id} is {docx_time-start_time}"
-        )
+        if request.query_params.get("pdf") and request.query_params.get(
+            "async"
+        ):
+            job = ConversionJob.objects.create(
+                owner=request.user if request.user.is_authenticated else None,
+                template=template,
+                context=context,
+                context_default=context_default,
+                filename=f"{template.name}_preview.pdf",
+            )
+            serializer = ConversionJobSerializer(
+                job, context={"request": request}
+            )
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
         if request.query_params.get("pdf"):
-            buffer = v1utils.convert_file_to_pdf(buffer)
+            buffer = v1utils.open_partial_pdf(
+                template, context, context_default
+            )
             filename = f"{template.name}_preview.pdf"
-            pdf_time = datetime.utcnow()
-            logger.debug(
-                f"Time of pdf generation for template {template_id} is {pdf_time-docx_time}"
+        else:
+            buffer = v1utils.open_partial_docx(
+                template, context, context_default
             )
+            filename = f"{template.name}_preview.docx"
+        end_time = datetime.utcnow()
+        logger.debug(
+            f"Time of {filename} generation for template {template_id} "
+            f"is {end_time-start_time}"
+        )
         response = send_file(buffer, filename)
         return response
 
+
+class BatchDocumentsAPIView(views.APIView):
+    """
+    Пакетное формирование документов по шаблону (слияние).
+
+    Принимает записи - значения полей по тэгам - массивом JSON
+    ({"records": [...]}) или файлом CSV (file), возвращает zip-архив
+    документов docx (pdf с параметром ?pdf=1). С параметром ?merge=1
+    возвращается один документ со всеми записями, каждая с новой страницы.
+    Ошибки отдельных записей не прерывают формирование и возвращаются в
+    файле errors.json архива.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, template_id):
+        template = get_object_or_404(Template, id=template_id, deleted=False)
+        data = request.data
+        if isinstance(data, list):
+            data = {"records": data}
+        pdf = bool(request.query_params.get("pdf"))
+        merge = bool(request.query_params.get("merge"))
+        serializer = BatchRecordsSerializer(
+            data=data, context={"pdf": pdf, "merge": merge}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        fields_by_tag = {
+            field.tag: field
+            for field in template.fields.select_related("type")
+        }
+        context = {
+            "template_fields": set(fields_by_tag.values()),
+            "fields_by_tag": fields_by_tag,
+        }
+        records, errors = [], {}
+        for number, record in enumerate(
+            serializer.validated_data["records"], 1
+        ):
+            items = [
+                {"field": tag, "value": value} for tag, value in record.items()
+            ]
+            fields = BatchDocumentFieldSerializer(
+                data=items, many=True, context=context
+            )
+            if not fields.is_valid():
+                errors[number] = {
+                    item["field"]: error
+                    for item, error in zip(items, fields.errors)
+                    if error
+                }
+                continue
+            v1utils.custom_fieldtypes_validation(fields.validated_data)
+            records.append(
+                (
+                    number,
+                    {
+                        data["field"].tag: data["value"]
+                        for data in fields.validated_data
+                    },
+                )
+            )
+        if not records:
+            return Response(
+                data={"errors": errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if not merge:
+            entries = v1utils.render_batch(template, records, errors, pdf)
+            return send_stream(iter_zip(entries), f"{template.name}.zip")
+
+        content = v1utils.render_batch_merged(template, records, errors, pdf)
+        if content is None:
+            return Response(
+                data={"errors": errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        filename = f"{template.name}.{'pdf' if pdf else 'docx'}"
+        if not errors:
+            return send_file(io.BytesIO(content), filename)
+        # объединенный документ и ошибки отдельных записей
+        entries = (
+            (filename.replace("/", "_"), content),
+            ("errors.json", v1utils.batch_errors_json(errors)),
+        )
+        return send_stream(iter_zip(entries), f"{template.name}.zip")
+
+
+class DocumentPackageAPIView(views.APIView):
+    """
+    Пакет документов по нескольким шаблонам с общими значениями полей.
+
+    Принимает id шаблонов (templates) и значения полей по тэгам (context),
+    возвращает zip-архив документов docx (pdf с параметром ?pdf=1).
+    Каждый шаблон заполняется значениями своих тэгов, остальные поля
+    заполняются по умолчанию.
+    """
+
+    permission_classes = (AllowAny,)
+
+    def post(self, request):
+        serializer = DocumentPackageSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        templates = serializer.validated_data["templates"]
+        context = serializer.validated_data["context"]
+
+        package, errors = [], {}
+        unknown_tags = set(context)
+        for template in templates:
+            fields_by_tag = {
+                field.tag: field for field in template.fields.all()
+            }
+            items = [
+                {"field": tag, "value": value}
+                for tag, value in context.items()
+                if tag in fields_by_tag
+            ]
+            unknown_tags.difference_update(fields_by_tag)
+            fields = BatchDocumentFieldSerializer(
+                data=items,
+                many=True,
+                context={
+                    "template_fields": set(fields_by_tag.values()),
+                    "fields_by_tag": fields_by_tag,
+                },
+            )
+            if not fields.is_valid():
+                errors[template.id] = {
+                    item["field"]: error
+                    for item, error in zip(items, fields.errors)
+                    if error
+                }
+                continue
+            v1utils.custom_fieldtypes_validation(fields.validated_data)
+            package.append(
+                (
+                    template,
+                    {
+                        data["field"].tag: data["value"]
+                        for data in fields.validated_data
+                    },
+                )
+            )
+        for tag in sorted(unknown_tags):
+            errors.setdefault("context", {})[tag] = [
+                Messages.PACKAGE_UNKNOWN_FIELD_TAG.format(tag)
+            ]
+        if errors:
+            return Response(
+                data={"errors": errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        entries = v1utils.render_package(
+            package, errors, bool(request.query_params.get("pdf"))
+        )
+        return send_stream(iter_zip(entries), "package.zip")
@@ -0,0 +1,30 @@
+"""Сериализаторы заданий на формирование pdf-файлов."""
+from django.urls import reverse
+from rest_framework import serializers
+
+from documents.models import ConversionJob
+
+
+class ConversionJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ConversionJob
+        fields = (
+            "id",
+            "status",
+            "error",
+            "created",
+            "finished",
+            "download_url",
+        )
+
+    def get_download_url(self, job):
+        """Ссылка на скачивание готового файла."""
+        if job.status != ConversionJob.DONE:
+            return None
+        url = reverse("api:pdf_jobs-download", args=(job.id,))
+        request = self.context.get("request")
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        return url
@@ -0,0 +1,66 @@
+"""Вьюсеты заданий на формирование pdf-файлов."""
+import logging
+import time
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+
+from .serializers import ConversionJobSerializer
+from api.v2.documents.views import send_file
+from documents.models import ConversionJob
+
+logger = logging.getLogger(__name__)
+
+# интервал проверки статуса задания при ожидании, с
+WAIT_POLL_INTERVAL = 0.5
+
+
+class ConversionJobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Статус задания на формирование pdf-файла и скачивание результата."""
+
+    serializer_class = ConversionJobSerializer
+    permission_classes = (AllowAny,)
+
+    def get_queryset(self):
+        """
+        Задания анонимных пользователей (предпросмотр) доступны по
+        идентификатору, остальные - только автору.
+        """
+        anonymous = Q(owner=None)
+        if self.request.user.is_authenticated:
+            return ConversionJob.objects.filter(
+                anonymous | Q(owner=self.request.user)
+            )
+        return ConversionJob.objects.filter(anonymous)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Статус задания. С параметром wait=<секунды> ответ возвращается после
+        завершения задания, но не позже чем через wait секунд (long polling,
+        не более PDF_JOB_MAX_WAIT): клиент повторяет запрос, пока задание
+        не завершено.
+        """
+        job = self.get_object()
+        try:
+            wait = float(request.query_params.get("wait", 0))
+        except ValueError:
+            wait = 0
+        deadline = time.monotonic() + min(wait, settings.PDF_JOB_MAX_WAIT)
+        while not job.is_finished and time.monotonic() < deadline:
+            time.sleep(WAIT_POLL_INTERVAL)
+            job.refresh_from_db()
+        return Response(self.get_serializer(job).data)
+
+    @action(detail=True, url_path="download")
+    def download(self, request, pk=None):
+        """Скачивание pdf-файла выполненного задания."""
+        job = self.get_object()
+        if job.status != ConversionJob.DONE:
+            return Response(
+                self.get_serializer(job).data, status=status.HTTP_409_CONFLICT
+            )
+        return send_file(job.result.open("rb"), job.filename)
@@ -0,0 +1,24 @@
+"""Постраничная выдача списков."""
+from rest_framework.pagination import CursorPagination
+
+
+class OptInCursorPagination(CursorPagination):
+    """
+    Постраничная выдача по курсору (keyset): страница выбирается условием
+    по полям сортировки, а не смещением, поэтому время выдачи не зависит
+    от глубины прокрутки. Включается параметром cursor или page_size,
+    без них список выдается целиком, как раньше. Сортировка - атрибут
+    ordering представления (см. OrderingFilter).
+    """
+
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("id",)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            self.cursor_query_param not in request.query_params
+            and self.page_size_query_param not in request.query_params
+        ):
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -1,5 +1,6 @@
 """Сериализаторы для API."""
 import base64
+from io import BytesIO
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.core.files.base import ContentFile
@@ -9,6 +10,7 @@ from rest_framework import serializers
 
 from api.v2.utils import custom_fieldtypes_validation, get_non_unique_items
 from core.constants import Messages
+from core.template_render import prepare_template
 from documents.models import (
     Category,
     Document,
@@ -124,11 +126,6 @@ class TemplateGroupSerializer(serializers.ModelSerializer):
             "fields",
         )
 
-    def to_representation(self, instance):
-        response = super().to_representation(instance)
-        response["fields"].sort(key=lambda x: x["id"])
-        return response
-
 
 class TemplateGroupWriteSerializer(serializers.ModelSerializer):
     """Сериализатор группы полей шаблона для записи/обновления"""
@@ -151,7 +148,15 @@ class TemplateSerializerMinified(serializers.ModelSerializer):
 
     class Meta:
         model = Template
-        exclude = ("template",)
+        exclude = (
+            "template",
+            "prepared_template",
+            "tags",
+            "draft_docx",
+            "draft_pdf",
+            "draft_version",
+            "search_vector",
+        )
         read_only_fields = (
             "name",
             "category",
@@ -164,6 +169,9 @@ class TemplateSerializerMinified(serializers.ModelSerializer):
         )
 
     def get_is_favorited(self, template: Template) -> bool:
+        # значение аннотации TemplateQuerySet.with_is_favorited
+        if hasattr(template, "is_favorited"):
+            return template.is_favorited
         user = self.context.get("request").user
         if not user.is_authenticated:
             return False
@@ -191,7 +199,15 @@ class TemplateSerializerPlain(TemplateSerializerMinified):
 
     class Meta(TemplateSerializerMinified.Meta):
         model = Template
-        exclude = ("template",)
+        exclude = (
+            "template",
+            "prepared_template",
+            "tags",
+            "draft_docx",
+            "draft_pdf",
+            "draft_version",
+            "search_vector",
+        )
         # fields = "__all__"
         read_only_fields = ("is_favorited", "groups")
 
@@ -209,7 +225,15 @@ class TemplateSerializer(TemplateSerializerMinified):
 
     class Meta(TemplateSerializerMinified.Meta):
         model = Template
-        exclude = ("template",)
+        exclude = (
+            "template",
+            "prepared_template",
+            "tags",
+            "draft_docx",
+            "draft_pdf",
+            "draft_version",
+            "search_vector",
+        )
         read_only_fields = (
             "is_favorited",
             "grouped_fields",
@@ -217,14 +241,12 @@ class TemplateSerializer(TemplateSerializerMinified):
         )
 
     def get_ungrouped_fields(self, instance):
-        solo_fields = instance.fields.filter(group=None).order_by("id")
+        # поля предзагружены TemplateQuerySet.with_fields
+        solo_fields = [
+            field for field in instance.fields.all() if field.group_id is None
+        ]
         return TemplateFieldSerializerMinified(solo_fields, many=True).data
 
-    def to_representation(self, instance):
-        response = super().to_representation(instance)
-        response["grouped_fields"].sort(key=lambda x: x["id"])
-        return response
-
 
 class TemplateWriteSerializer(serializers.ModelSerializer):
     """Сериализатор шаблонов для записи/изменения."""
@@ -290,6 +312,8 @@ class TemplateWriteSerializer(serializers.ModelSerializer):
                 data["group"] = group_models[group_id]
             template_fields.append(TemplateField(template=template, **data))
         TemplateField.objects.bulk_create(template_fields)
+        # bulk_create не отправляет сигналы post_save полей
+        Template.objects.filter(pk=template.pk).update_search_vector()
         return template
 
     def to_representation(self, instance):
@@ -306,5 +330,17 @@ class TemplateFileUploadSerializer(serializers.ModelSerializer):
         model = Template
         fields = ("template", "errors")
 
+    def validate_template(self, value):
+        """Файл должен подготавливаться к рендерингу (см. Template.prepare)."""
+        content = value.read()
+        value.seek(0)
+        try:
+            prepare_template(BytesIO(content))
+        except Exception as e:
+            raise serializers.ValidationError(
+                Messages.TEMPLATE_FILE_INVALID.format(e)
+            )
+        return value
+
     def get_errors(self, instance):
         return instance.get_consistency_errors()
@@ -14,9 +14,11 @@ from rest_framework import (
     viewsets,
 )
 from rest_framework.decorators import action
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from api.v2.pagination import OptInCursorPagination
 from api.v2.permissions import IsAdminOrReadOnly, IsOwner, IsOwnerOrAdminOrReadOnly
 from .serializers import (
     TemplateFieldSerializer,
@@ -27,9 +29,16 @@ from .serializers import (
 )
 
 from api.v2 import utils as v1utils
+from api.v2.conditional import (
+    conditional_get,
+    template_etag,
+    template_fields_etag,
+    template_list_etag,
+    template_updated,
+)
 from core.constants import Messages
-from core.template_render import DocumentTemplate
-from documents.models import Template
+from core.template_render import morph_cache
+from documents.models import Template, template_cache
 
 
 logger = logging.getLogger(__name__)
@@ -39,11 +48,27 @@ User = get_user_model()
 
 def send_file(filestream, filename: str, as_attachment: bool = True):
     """Функция подготовки открытого двоичного файла к отправке."""
+    uri = v1utils.accel_redirect_uri(filestream)
+    if uri is not None:
+        # файл отправляет nginx, бэкенд только проверяет права доступа
+        filestream.close()
+        response = FileResponse(
+            iter(()), as_attachment=as_attachment, filename=filename
+        )
+        response.set_headers(None)
+        response["X-Accel-Redirect"] = uri
+        return response
     response = FileResponse(
         streaming_content=filestream,
         as_attachment=as_attachment,
         filename=filename,
     )
+    # для файлов, открытых не по абсолютному пути (FieldFile, файл pdf
+    # из временного каталога), размер берется у открытого файла
+    if not response.has_header("Content-Length"):
+        size = v1utils.file_size(filestream)
+        if size is not None:
+            response["Content-Length"] = size
     return response
 
 
@@ -58,7 +83,9 @@ class TemplateViewSet(viewsets.ModelViewSet):
         filters.SearchFilter,
         filters.OrderingFilter,
     )
-    pagination_class = None
+    pagination_class = OptInCursorPagination
+    # сортировка постраничной выдачи (индекс template_name_id_idx)
+    ordering = ("name", "id")
     filterset_fields = (
         "owner",
         "category",
@@ -76,10 +103,22 @@ class TemplateViewSet(viewsets.ModelViewSet):
         return TemplateSerializer
 
     def get_queryset(self):
-        if self.request.user.is_superuser:
-            return Template.objects.all()
+        user = self.request.user
+        if user.is_superuser:
+            queryset = Template.objects.all()
         else:
-            return Template.objects.filter(deleted=False)
+            queryset = Template.objects.filter(deleted=False)
+        if self.action == "retrieve":
+            queryset = queryset.with_fields()
+        return queryset.with_is_favorited(user)
+
+    @conditional_get(template_list_etag)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(template_etag)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     @action(
         detail=True,
@@ -88,22 +127,65 @@ class TemplateViewSet(viewsets.ModelViewSet):
         url_path="download_draft",
         url_name="download_draft",
     )
+    @conditional_get(template_fields_etag, template_updated)
     def download_draft(self, request, pk=None):
         # template = get_object_or_404(Template, pk=pk)
         template = serializers.PrimaryKeyRelatedField(
             many=False, queryset=Template.objects.all()
         ).to_internal_value(data=pk)
-        context = {field.tag: field.name for field in template.fields.all()}
-        path = template.template
-        doc = DocumentTemplate(path)
-        buffer = doc.get_draft(context)
-        filename = f"{template.name}_шаблон.docx"
-        if request.query_params.get("pdf"):
-            buffer = v1utils.convert_file_to_pdf(buffer)
-            filename = f"{template.name}_шаблон.pdf"
-        response = send_file(buffer, filename)
+        pdf = bool(request.query_params.get("pdf"))
+        draft = v1utils.get_template_draft(template, pdf)
+        extension = "pdf" if pdf else "docx"
+        filename = f"{template.name}_шаблон.{extension}"
+        response = send_file(draft.open("rb"), filename)
         return response
 
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="search",
+        url_name="search",
+        pagination_class=LimitOffsetPagination,
+    )
+    def search(self, request):
+        """
+        Поиск шаблонов по тексту (параметр q) в наименовании, описании,
+        категории и полях шаблона. Результаты упорядочены по
+        релевантности.
+        """
+        text = request.query_params.get("q", "").strip()
+        if not text:
+            raise serializers.ValidationError(
+                {"q": Messages.SEARCH_QUERY_REQUIRED}
+            )
+        queryset = self.get_queryset().search(text)
+        page = self.paginate_queryset(queryset)
+        serializer = TemplateSerializerMinified(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=(IsAdminUser,),
+        url_path="cache_stats",
+        url_name="cache_stats",
+    )
+    def cache_stats(self, request):
+        """
+        Статистика кэшей шаблонов и склонений текущего процесса и кэша
+        сформированных файлов.
+        """
+        return Response(
+            data={
+                "templates": template_cache.info(),
+                "morph": morph_cache.info(),
+                "files": v1utils.render_cache.info(),
+            },
+            status=status.HTTP_200_OK,
+        )
+
     def destroy(self, request, *args, **kwargs):
         user = request.user
         template = self.get_object()
@@ -126,13 +208,21 @@ class TemplateFieldViewSet(viewsets.ModelViewSet):
     http_method_names = ("get",)
     permission_classes = (IsAdminOrReadOnly,)
         # permission_classes = (AllowAny,) # Заглушка
-    pagination_class = None
+    pagination_class = OptInCursorPagination
 
     def get_queryset(self):
         template_id = self.kwargs.get("template_id")
         template = get_object_or_404(Template, id=template_id)
         return template.fields.all()
 
+    @conditional_get(template_fields_etag, template_updated)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_get(template_fields_etag, template_updated)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class CheckTemplateConsistencyAPIView(views.APIView):
     permission_classes = (IsAdminUser,)
@@ -158,3 +248,7 @@ class UploadTemplateFileAPIView(generics.UpdateAPIView):
     permission_classes = (IsAdminUser,)
     # permission_classes = (AllowAny,) # Заглушка
     http_method_names = ["patch", "put"]
+
+    def perform_update(self, serializer):
+        template = serializer.save()
+        v1utils.prepare_template_drafts(template)
@@ -1,10 +1,31 @@
 import json
+from unittest import skipUnless
 
 from api.v1.serializers import TemplateWriteSerializer
-from django.test import TestCase
+from api.v2.documents.serializers import DocumentReadSerializerExtended
+from api.v2.documents.views import DocumentViewSet
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+from rest_framework.request import Request
+from rest_framework.test import APIClient
 
 from core.constants import Messages
-from documents.models import Template, TemplateFieldType
+from documents.models import (
+    Category,
+    Document,
+    DocumentField,
+    FavDocument,
+    FavTemplate,
+    Template,
+    TemplateField,
+    TemplateFieldGroup,
+    TemplateFieldType,
+)
+
+User = get_user_model()
 
 duplicate_fields_fixture = {
     "name": "Тестовый шаблон",
@@ -190,4 +211,533 @@ class Test(TestCase):
                         field_obj.group.name,
                         field["group"]["name"],
                         "Поле {} неправильно привязано к группе".format(field),
-                    )
\ No newline at end of file
+                    )
+
+
+class FavoritesQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password"
+        )
+        other = User.objects.create_user(
+            username="other", email="other@example.com", password="password"
+        )
+        templates = [
+            Template.objects.create(
+                name=f"Шаблон {i}", deleted=False, description="Тест"
+            )
+            for i in range(5)
+        ]
+        documents = [
+            Document.objects.create(
+                template=template,
+                owner=self.user,
+                completed=i % 2 == 0,
+                description="Тест",
+            )
+            for i, template in enumerate(templates)
+        ]
+        for template in templates[:2]:
+            FavTemplate.objects.create(user=self.user, template=template)
+        FavTemplate.objects.create(user=other, template=templates[2])
+        for document in documents[:2]:
+            FavDocument.objects.create(user=self.user, document=document)
+        self.favorite_templates = {template.id for template in templates[:2]}
+        self.favorite_documents = {document.id for document in documents[:2]}
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_template_list(self):
+        """Проверка, что признак избранного не требует запросов на шаблон"""
+        # и запрос валидатора ETag (api.v2.conditional)
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/v2/templates/")
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(
+            {item["id"] for item in response.data if item["is_favorited"]},
+            self.favorite_templates,
+        )
+
+    def test_document_lists(self):
+        """Проверка, что признак избранного не требует запросов на документ"""
+        for url, count in (
+            ("/api/v2/documents/", 5),
+            ("/api/v2/documents/draft/", 2),
+            ("/api/v2/documents/history/", 3),
+        ):
+            with self.subTest(url=url), self.assertNumQueries(1):
+                response = self.client.get(url)
+                self.assertEqual(len(response.data), count)
+                self.assertEqual(
+                    {
+                        item["id"]
+                        for item in response.data
+                        if item["is_favorited"]
+                    },
+                    {
+                        item["id"] for item in response.data
+                    } & self.favorite_documents,
+                )
+
+    def test_anonymous_template_list(self):
+        self.client.logout()
+        response = self.client.get("/api/v2/templates/")
+        self.assertFalse(any(item["is_favorited"] for item in response.data))
+
+
+class SchemaQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password"
+        )
+        self.template = Template.objects.create(
+            name="Шаблон", deleted=False, description="Тест"
+        )
+        field_type = TemplateFieldType.objects.create(type="str", name="Str")
+        groups = [
+            TemplateFieldGroup.objects.create(
+                template=self.template, name=f"Группа {i}"
+            )
+            for i in range(3)
+        ]
+        self.fields = []
+        # имена полей в обратном порядке: порядок выдачи - по id
+        for i, group in enumerate(groups * 2 + [None] * 3):
+            self.fields.append(
+                TemplateField.objects.create(
+                    template=self.template,
+                    tag=f"tag{i}",
+                    name=f"Поле {9 - i}",
+                    group=group,
+                    type=field_type,
+                )
+            )
+        self.document = Document.objects.create(
+            template=self.template, owner=self.user, description="Тест"
+        )
+        for field in self.fields[::2]:
+            DocumentField.objects.create(
+                document=self.document, field=field, value=field.tag
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_schema(self, data):
+        self.assertEqual(
+            [group["name"] for group in data["grouped_fields"]],
+            ["Группа 0", "Группа 1", "Группа 2"],
+        )
+        for group in data["grouped_fields"]:
+            ids = [field["id"] for field in group["fields"]]
+            self.assertEqual(ids, sorted(ids))
+            self.assertEqual(len(ids), 2)
+        self.assertEqual(
+            [field["id"] for field in data["ungrouped_fields"]],
+            [field.id for field in self.fields[6:]],
+        )
+        self.assertEqual(data["ungrouped_fields"][0]["type"], "str")
+
+    def test_template_detail(self):
+        """Проверка, что схема шаблона загружается за 4 запроса"""
+        url = f"/api/v2/templates/{self.template.id}/"
+        # и запрос валидатора ETag (api.v2.conditional)
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assert_schema(response.data)
+
+    def test_document_detail(self):
+        """Проверка, что документ со схемой и значениями - за 6 запросов"""
+        url = f"/api/v2/documents/{self.document.id}/"
+        # и запрос валидатора ETag (api.v2.conditional)
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assert_schema(response.data)
+        values = {
+            field["id"]: field.get("value")
+            for group in response.data["grouped_fields"]
+            for field in group["fields"]
+        }
+        values.update(
+            (field["id"], field.get("value"))
+            for field in response.data["ungrouped_fields"]
+        )
+        self.assertEqual(
+            values,
+            {
+                field.id: field.tag if i % 2 == 0 else None
+                for i, field in enumerate(self.fields)
+            },
+        )
+
+    def test_anonymous_document_schema_order(self):
+        """Проверка порядка полей документа в заглушке без авторизации"""
+        # заглушка выдает документы пользователя с id=1
+        owner, _ = User.objects.get_or_create(
+            id=1, defaults={"username": "owner", "email": "owner@example.com"}
+        )
+        Document.objects.filter(pk=self.document.pk).update(owner=owner)
+        request = Request(RequestFactory().get("/"))
+        view = DocumentViewSet(action="retrieve", request=request)
+        document = view.get_queryset().get(pk=self.document.pk)
+        self.assert_schema(
+            DocumentReadSerializerExtended(
+                document, context={"request": request}
+            ).data
+        )
+
+    def test_document_fields_update_writes_changes_only(self):
+        """Проверка, что при автосохранении записываются только изменения"""
+        url = f"/api/v2/documents/{self.document.id}/"
+        document_fields = [
+            {"field": field.id, "value": field.tag} for field in self.fields
+        ]
+        # добавлены значения полей с нечетными индексами
+        response = self.client.patch(
+            url, {"document_fields": document_fields}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        document_fields[0]["value"] = "новое значение"
+        document_fields.pop()
+        # документ, поля шаблона (одним запросом), запись документа и
+        # значений полей в точке сохранения, признак избранного
+        with self.assertNumQueries(10), CaptureQueriesContext(
+            connection
+        ) as queries:
+            response = self.client.patch(
+                url, {"document_fields": document_fields}, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        writes = [
+            query["sql"].split()[0]
+            for query in queries.captured_queries
+            if query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+        ]
+        # документ, удаление одного значения, изменение одного значения
+        self.assertEqual(writes, ["UPDATE", "DELETE", "UPDATE"])
+        self.assertEqual(
+            dict(
+                self.document.document_fields.values_list("field", "value")
+            ),
+            {field["field"]: field["value"] for field in document_fields},
+        )
+
+    def test_document_fields_of_another_template_are_rejected(self):
+        """Проверка, что поле другого шаблона или несуществующее - ошибка"""
+        other_template = Template.objects.create(name="Другой", deleted=False)
+        other_field = TemplateField.objects.create(
+            template=other_template,
+            tag="other",
+            name="Поле",
+            type=self.fields[0].type,
+        )
+        missing_id = other_field.id + 1
+        url = f"/api/v2/documents/{self.document.id}/"
+        response = self.client.patch(
+            url,
+            {
+                "document_fields": [
+                    {"field": other_field.id, "value": "x"},
+                    {"field": self.fields[0].id, "value": "x"},
+                    {"field": missing_id, "value": "x"},
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data["document_fields"],
+            [
+                Messages.WRONG_TEMPLATE_FIELD.format(other_field.id),
+                Messages.WRONG_TEMPLATE_FIELD.format(missing_id),
+            ],
+        )
+        self.assertFalse(
+            self.document.document_fields.filter(field=other_field).exists()
+        )
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password"
+        )
+        # одинаковые наименования: порядок внутри - по id
+        for name in ("В", "Б", "А", "Б", "А"):
+            template = Template.objects.create(
+                name=name, deleted=False, description="Тест"
+            )
+            Document.objects.create(
+                template=template,
+                owner=self.user,
+                completed=True,
+                description="Тест",
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fetch_all(self, url: str) -> list:
+        items = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            items.extend(item["id"] for item in response.data["results"])
+            url = response.data["next"]
+        return items
+
+    def test_pages_cover_list_in_order(self):
+        """Проверка постраничной выдачи шаблонов и документов"""
+        templates = Template.objects.order_by("name", "id")
+        documents = Document.objects.order_by("created", "id")
+        for url, queryset in (
+            ("/api/v2/templates/", templates),
+            ("/api/v2/documents/", documents),
+            ("/api/v2/documents/history/", documents),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.fetch_all(f"{url}?page_size=2"),
+                    list(queryset.values_list("id", flat=True)),
+                )
+
+    def test_unpaginated_by_default(self):
+        """Проверка, что без параметров список выдается целиком"""
+        response = self.client.get("/api/v2/templates/")
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 5)
+
+    def test_template_fields_pages(self):
+        """Проверка постраничной выдачи полей шаблона и документа"""
+        template = Template.objects.first()
+        document = Document.objects.filter(template=template).first()
+        field_type = TemplateFieldType.objects.create(type="str", name="Str")
+        for i in range(3):
+            field = TemplateField.objects.create(
+                template=template, tag=f"tag{i}", name="Поле", type=field_type
+            )
+            DocumentField.objects.create(
+                document=document, field=field, value=field.tag
+            )
+        for url, queryset in (
+            (f"/api/v2/templates/{template.id}/fields/", template.fields),
+            (
+                f"/api/v2/documents/{document.id}/fields/",
+                document.document_fields,
+            ),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.fetch_all(f"{url}?page_size=2"),
+                    list(queryset.order_by("id").values_list("id", flat=True)),
+                )
+                self.assertEqual(len(self.client.get(url).data), 3)
+
+
+class TemplateSearchTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Кадровые документы")
+        self.contract = Template.objects.create(
+            name="Трудовой договор", deleted=False, description="Найм"
+        )
+        self.order = Template.objects.create(
+            name="Приказ о приеме",
+            deleted=False,
+            description="Приказ по трудовому договору",
+            category=category,
+        )
+        self.power = Template.objects.create(
+            name="Доверенность", deleted=False, description="Представительство"
+        )
+        TemplateField.objects.create(
+            template=self.power,
+            tag="passport",
+            name="Паспорт",
+            hint="Серия и номер паспорта доверителя",
+        )
+        Template.objects.create(
+            name="Договор (удален)", deleted=True, description="Удален"
+        )
+        self.client = APIClient()
+
+    def search(self, text: str) -> list:
+        response = self.client.get(
+            "/api/v2/templates/search/", {"q": text}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [item["id"] for item in response.data["results"]]
+
+    def test_search_fields(self):
+        """Проверка поиска по наименованию, категории и подсказкам полей"""
+        self.assertEqual(self.search("ДОВЕРЕННОСТЬ"), [self.power.id])
+        self.assertEqual(self.search("кадровые"), [self.order.id])
+        self.assertEqual(self.search("паспорта"), [self.power.id])
+        self.assertEqual(self.search("приказ кадровые"), [self.order.id])
+        self.assertEqual(self.search("отсутствует"), [])
+
+    def test_search_ranking(self):
+        """Проверка, что совпадения в наименовании выдаются первыми"""
+        self.assertEqual(
+            self.search("трудов"), [self.contract.id, self.order.id]
+        )
+
+    @skipUnless(connection.vendor == "postgresql", "поиск триграмм PostgreSQL")
+    def test_search_word_similarity(self):
+        """Проверка, что опечатка в слове находит длинное наименование"""
+        self.assertEqual(self.search("догавор"), [self.contract.id])
+
+    def test_search_query_required(self):
+        """Проверка, что текст для поиска обязателен"""
+        response = self.client.get("/api/v2/templates/search/", {"q": " "})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["q"], Messages.SEARCH_QUERY_REQUIRED)
+
+
+class DocumentSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password"
+        )
+        other = User.objects.create_user(
+            username="other", email="other@example.com", password="password"
+        )
+        contract = Template.objects.create(
+            name="Трудовой договор", deleted=False, description="Тест"
+        )
+        power = Template.objects.create(
+            name="Доверенность", deleted=False, description="Тест"
+        )
+        field = TemplateField.objects.create(
+            template=contract, tag="employee", name="Работник"
+        )
+        self.ivanov = Document.objects.create(
+            template=contract, owner=self.user, description="Найм"
+        )
+        DocumentField.objects.create(
+            document=self.ivanov, field=field, value="Иванов Иван"
+        )
+        self.petrov = Document.objects.create(
+            template=contract, owner=self.user, description="Найм"
+        )
+        DocumentField.objects.create(
+            document=self.petrov, field=field, value="Петров Петр"
+        )
+        self.power = Document.objects.create(
+            template=power, owner=self.user, description="Для Иванова"
+        )
+        foreign = Document.objects.create(
+            template=contract, owner=other, description="Найм"
+        )
+        DocumentField.objects.create(
+            document=foreign, field=field, value="Иванов Иван"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, text: str) -> list:
+        response = self.client.get(
+            "/api/v2/documents/search/", {"q": text}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [item["id"] for item in response.data]
+
+    def test_search_own_documents(self):
+        """Проверка поиска по описанию, шаблону и значениям полей"""
+        self.assertEqual(
+            self.search("иванов"), [self.ivanov.id, self.power.id]
+        )
+        self.assertEqual(
+            self.search("договор ИВАНОВ"), [self.ivanov.id]
+        )
+        self.assertEqual(self.search("доверенность"), [self.power.id])
+        self.assertEqual(self.search("Сидоров"), [])
+
+    def test_search_query_required(self):
+        """Проверка, что текст для поиска обязателен"""
+        response = self.client.get("/api/v2/documents/search/")
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalRequestTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password"
+        )
+        self.template = Template.objects.create(
+            name="Шаблон", deleted=False, description="Тест"
+        )
+        self.field = TemplateField.objects.create(
+            template=self.template, tag="tag", name="Поле"
+        )
+        # файл шаблона не загружен: формирование файла завершится ошибкой
+        self.document = Document.objects.create(
+            template=self.template, owner=self.user, description="Тест"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_not_modified(self, url: str):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        # ответ 304 - только запрос валидатора
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        self.assertEqual(response.status_code, 304)
+        return response["ETag"]
+
+    def assert_modified(self, url: str, etag: str):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_template_list(self):
+        """Проверка 304 для каталога и изменения ETag при смене избранного"""
+        url = "/api/v2/templates/"
+        etag = self.assert_not_modified(url)
+        FavTemplate.objects.create(user=self.user, template=self.template)
+        self.assert_modified(url, etag)
+
+    def test_template_detail(self):
+        """Проверка изменения ETag шаблона при изменении его полей"""
+        for url in (
+            f"/api/v2/templates/{self.template.id}/",
+            f"/api/v2/templates/{self.template.id}/fields/",
+        ):
+            with self.subTest(url=url):
+                etag = self.assert_not_modified(url)
+                self.field.hint = "Подсказка"
+                self.field.save()
+                self.assert_modified(url, etag)
+
+    def test_deleted_template_is_not_found(self):
+        """Проверка, что по ETag удаленного шаблона выдается 404, а не 304"""
+        url = f"/api/v2/templates/{self.template.id}/"
+        response = self.client.get(url)
+        # дата изменения не меняется: ETag прежний
+        Template.objects.filter(pk=self.template.pk).update(deleted=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 404)
+
+    def test_document_detail(self):
+        """Проверка изменения ETag документа при изменении шаблона"""
+        url = f"/api/v2/documents/{self.document.id}/"
+        etag = self.assert_not_modified(url)
+        self.template.description = "Изменен"
+        self.template.save()
+        self.assert_modified(url, etag)
+
+    def test_download_not_modified(self):
+        """Проверка, что по If-Modified-Since файл не формируется"""
+        self.document.refresh_from_db()
+        self.template.refresh_from_db()
+        modified = http_date(
+            max(self.document.updated, self.template.updated).timestamp()
+        )
+        for action in ("download_document", "download_pdf"):
+            with self.subTest(action=action):
+                response = self.client.get(
+                    f"/api/v2/documents/{self.document.id}/{action}/",
+                    HTTP_IF_MODIFIED_SINCE=modified,
+                )
+                self.assertEqual(response.status_code, 304)
@@ -1,12 +1,15 @@
 from api.v2.documents.views import (
     AnonymousDownloadPreviewAPIView,
+    BatchDocumentsAPIView,
     DocumentFieldViewSet,
+    DocumentPackageAPIView,
     DocumentViewSet,)
 from api.v2.templates.views import (
     UploadTemplateFileAPIView,
     CheckTemplateConsistencyAPIView,
     TemplateFieldViewSet,
     TemplateViewSet,)
+from api.v2.jobs.views import ConversionJobViewSet
 from api.v2.favorites.views import (
     FavTemplateAPIview,
     FavDocumentAPIview,)
@@ -43,6 +46,12 @@ router_v1.register(
     viewset=DocumentViewSet,
 )
 
+router_v1.register(
+    prefix="pdf_jobs",
+    basename="pdf_jobs",
+    viewset=ConversionJobViewSet,
+)
+
 
 urlpatterns = [
     path(
@@ -56,6 +65,16 @@ urlpatterns = [
         AnonymousDownloadPreviewAPIView.as_view(),
         name="download_preview",
     ),
+    path(
+        "templates/<int:template_id>/batch/",
+        BatchDocumentsAPIView.as_view(),
+        name="batch_documents",
+    ),
+    path(
+        "templates/package/",
+        DocumentPackageAPIView.as_view(),
+        name="document_package",
+    ),
     path(
         "templates/<int:template_id>/check_consistency/",
         CheckTemplateConsistencyAPIView.as_view(),
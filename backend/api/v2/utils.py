@@ -1,19 +1,50 @@
 """Утилиты."""
 
+import contextlib
 import datetime
 import io
+import json
 import logging
+import os
 import pathlib
-import subprocess
 import tempfile
-from typing import Any, Dict, List, Set, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from urllib.parse import quote
 
+from django.conf import settings
+from django.core.files.base import ContentFile, File
 from django.core.mail import send_mail
+from django.db.models.fields.files import FieldFile
 
-from documents.models import Document, DocumentTemplate, TemplateField
+from core.office_pool import (
+    OfficePoolUnavailable,
+    convert_to_pdf,
+    convert_to_pdf_oneshot,
+)
+from core.batch_render import merge_documents, ordered_map, render_many
+from core.render_cache import RenderCache, make_key
+from core.template_render import RenderMode, render_template
+from documents.models import ConversionJob, Document, Template, TemplateField
 
 logger = logging.getLogger(__name__)
 
+# Кэш сформированных документов (общий для всех процессов)
+render_cache = RenderCache(
+    settings.RENDER_CACHE_DIR, settings.RENDER_CACHE_MAX_SIZE
+)
+
 
 class Util:
     @staticmethod
@@ -39,8 +70,8 @@ def get_non_unique_items(items: List[Any]) -> Set[Any]:
     return non_unique
 
 
-def fill_docx_template_for_document(document: Document) -> io.BytesIO:
-    """Создание документа из шаблона."""
+def get_document_context(document: Document) -> Tuple[Dict, Dict]:
+    """Значения полей документа и значения по умолчанию полей шаблона."""
     context = {
         docfield.field.tag: docfield.value
         for docfield in document.document_fields.all()
@@ -49,44 +80,401 @@ def fill_docx_template_for_document(document: Document) -> io.BytesIO:
         field.tag: field.default or field.name
         for field in document.template.fields.all()
     }
-    path = document.template.template
-    doc = DocumentTemplate(path)
-    buffer = doc.get_partial(context, context_default)
-    return buffer
+    return context, context_default
+
+
+def render_partial_docx(
+    template: Template, context: Dict, context_default: Dict
+) -> bytes:
+    """
+    Документ docx по шаблону, незаполненные поля подсвечиваются.
+    Результат берется из кэша, если такой документ уже формировался.
+    """
+    key = make_key(
+        template.version, RenderMode.PARTIAL, context, context_default
+    )
+    return render_cache.get_or_create(
+        key,
+        "docx",
+        lambda: render_template(
+            template.get_compiled_template(),
+            context,
+            context_default,
+            RenderMode.PARTIAL,
+        ),
+    )
+
+
+def render_partial_pdf(
+    template: Template, context: Dict, context_default: Dict
+) -> bytes:
+    """
+    То же, что render_partial_docx, в формате pdf. Для закэшированного
+    pdf-файла не выполняются ни рендеринг, ни конвертация.
+    """
+    with open_partial_pdf(template, context, context_default) as pdf:
+        return pdf.read()
+
+
+def open_cached(key: str, ext: str) -> Optional[BinaryIO]:
+    """Открытый файл из кэша сформированных документов или None."""
+    path = render_cache.get(key, ext)
+    if path is None:
+        return None
+    try:
+        return path.open("rb")
+    except FileNotFoundError:
+        # файл вытеснен другим процессом
+        return None
+
+
+def open_partial_docx(
+    template: Template, context: Dict, context_default: Dict
+) -> BinaryIO:
+    """
+    Файл документа docx для отправки (см. render_partial_docx):
+    закэшированный файл отправляется с диска.
+    """
+    key = make_key(
+        template.version, RenderMode.PARTIAL, context, context_default
+    )
+    cached = open_cached(key, "docx")
+    if cached is not None:
+        return cached
+    return io.BytesIO(render_partial_docx(template, context, context_default))
+
+
+def open_partial_pdf(
+    template: Template, context: Dict, context_default: Dict
+) -> BinaryIO:
+    """
+    Файл pdf для отправки (см. render_partial_pdf): закэшированный или
+    только что сконвертированный файл отправляется с диска, без чтения
+    в память. Сконвертированный файл перемещается в кэш.
+    """
+    key = make_key(
+        template.version, RenderMode.PARTIAL, context, context_default
+    )
+    cached = open_cached(key, "pdf")
+    if cached is not None:
+        return cached
+    content = render_partial_docx(template, context, context_default)
+    with converted_pdf(content) as pdf_file:
+        # файл остается доступным после перемещения в кэш или удаления
+        # временного каталога
+        pdf = open(os.open(pdf_file, os.O_RDONLY), "rb")
+        try:
+            render_cache.put_file(key, "pdf", pdf_file)
+        except OSError:
+            logger.exception("Render cache write failed")
+    return pdf
+
+
+def file_size(filestream) -> Optional[int]:
+    """Размер открытого файла на диске или None, если он неизвестен."""
+    try:
+        return os.fstat(filestream.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def media_path(filestream) -> Optional[pathlib.Path]:
+    """Путь открытого файла относительно MEDIA_ROOT или None."""
+    if isinstance(filestream, FieldFile):
+        name = filestream.path
+    else:
+        name = getattr(filestream, "name", None)
+    if not isinstance(name, str) or not os.path.isabs(name):
+        return None
+    try:
+        return pathlib.Path(name).resolve().relative_to(
+            pathlib.Path(settings.MEDIA_ROOT).resolve()
+        )
+    except ValueError:
+        return None
+
+
+def accel_redirect_uri(filestream) -> Optional[str]:
+    """
+    Адрес файла во внутреннем location nginx (ACCEL_REDIRECT_LOCATION)
+    для отправки файла nginx. None - файл отправляет бэкенд.
+    """
+    if not settings.ACCEL_REDIRECT_LOCATION:
+        return None
+    path = media_path(filestream)
+    if path is None:
+        return None
+    return settings.ACCEL_REDIRECT_LOCATION.rstrip("/") + quote(
+        f"/{path.as_posix()}"
+    )
+
+
+def file_exists(file: FieldFile) -> bool:
+    return bool(file) and file.storage.exists(file.name)
+
+
+def save_template_drafts(template: Template):
+    """Сохранение полей черновиков без изменения даты шаблона."""
+    Template.objects.filter(pk=template.pk).update(
+        draft_docx=template.draft_docx.name or "",
+        draft_pdf=template.draft_pdf.name or "",
+        draft_version=template.draft_version,
+    )
+
+
+def get_template_draft(template: Template, pdf: bool = False) -> FieldFile:
+    """
+    Черновик шаблона (тэги заменены названиями полей). Файлы формируются
+    один раз для версии шаблона и набора полей и хранятся в полях
+    draft_docx и draft_pdf; при отсутствии или устаревании формируются
+    заново.
+    """
+    context = template.get_draft_context()
+    version = template.get_draft_version(context)
+    name = f"{template.pk}_{version[:16]}"
+    if template.draft_version != version or not file_exists(
+        template.draft_docx
+    ):
+        template.delete_drafts()
+        template.draft_version = version
+        content = render_template(
+            template.get_compiled_template(), context, mode=RenderMode.DRAFT
+        )
+        template.draft_docx.save(
+            f"{name}.docx", ContentFile(content), save=False
+        )
+        save_template_drafts(template)
+    if pdf and not file_exists(template.draft_pdf):
+        with template.draft_docx.open("rb") as docx:
+            content = docx.read()
+        with converted_pdf(content) as pdf_file, pdf_file.open("rb") as f:
+            template.draft_pdf.save(f"{name}.pdf", File(f), save=False)
+        save_template_drafts(template)
+    return template.draft_pdf if pdf else template.draft_docx
+
+
+def prepare_template_drafts(template: Template):
+    """Формирование черновиков docx и pdf после загрузки шаблона."""
+    try:
+        get_template_draft(template, pdf=True)
+    except Exception:
+        logger.exception(f"Template {template.pk} draft generation failed")
+
+
+def fill_docx_template_for_document(document: Document) -> io.BytesIO:
+    """Создание документа из шаблона."""
+    content = render_partial_docx(
+        document.template, *get_document_context(document)
+    )
+    return io.BytesIO(content)
 
 
 def create_document_pdf_for_export(document: Document) -> io.BytesIO:
     """Создание pdf-файла."""
-    doc_file = fill_docx_template_for_document(document)
-    buffer = convert_file_to_pdf(doc_file)
-    return buffer
+    content = render_partial_pdf(
+        document.template, *get_document_context(document)
+    )
+    return io.BytesIO(content)
+
+
+@contextlib.contextmanager
+def converted_pdf(content: bytes) -> Iterator[pathlib.Path]:
+    """
+    Конвертация документа docx в pdf. Возвращает путь к pdf-файлу во
+    временном каталоге, который удаляется при выходе из контекста.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out_file = pathlib.Path(tmpdir) / "document.docx"
+        out_file.write_bytes(content)
+        pdf_file = out_file.with_suffix(".pdf")
+        try:
+            convert_to_pdf(
+                out_file,
+                pdf_file,
+                settings.OFFICE_POOL_DIR,
+                settings.OFFICE_JOB_TIMEOUT,
+            )
+        except OfficePoolUnavailable:
+            logger.warning("Office pool is not running, starting soffice")
+            convert_to_pdf_oneshot(
+                out_file, out_file.parent, settings.OFFICE_JOB_TIMEOUT
+            )
+        out_file.unlink()
+        yield pdf_file
 
 
 def convert_file_to_pdf(in_file: io.BytesIO) -> io.BytesIO:
     """Файл в виде строки байт преобразуем в строку байт pdf-файла."""
-    with tempfile.NamedTemporaryFile() as output:
-        out_file = pathlib.Path(output.name).resolve()
-        out_file.write_bytes(in_file.getvalue())
-        subprocess.run(
-            [
-                "soffice",
-                "--headless",
-                "--invisible",
-                "--nologo",
-                "--convert-to",
-                "pdf",
-                "--outdir",
-                out_file.parent,
-                out_file.absolute(),
-            ],
-            check=True,
+    with converted_pdf(in_file.getvalue()) as pdf_file:
+        return io.BytesIO(pdf_file.read_bytes())
+
+
+def run_conversion_job(job: ConversionJob):
+    """Выполнение задания на формирование pdf-файла."""
+    if job.document is not None:
+        content = create_document_pdf_for_export(job.document).getvalue()
+    else:
+        content = render_partial_pdf(
+            job.template, job.context, job.context_default or {}
         )
-        pdf_file = out_file.with_suffix(".pdf")
-        out_buffer = io.BytesIO()
-        out_buffer.write(pdf_file.read_bytes())
-        out_buffer.seek(0)
-        pdf_file.unlink(missing_ok=True)
-    return out_buffer
+    job.complete(content)
+
+
+def convert_many_to_pdf(
+    documents: Iterable[Union[bytes, Exception]]
+) -> Iterator[Union[bytes, Exception]]:
+    """
+    Параллельная конвертация документов в pdf (по числу процессов пула
+    LibreOffice). Исключения передаются дальше без изменений.
+    """
+    workers = max(settings.OFFICE_POOL_SIZE, 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from ordered_map(
+            executor,
+            lambda content: convert_file_to_pdf(
+                io.BytesIO(content)
+            ).getvalue(),
+            (
+                document if isinstance(document, Exception) else (document,)
+                for document in documents
+            ),
+            workers * 2,
+        )
+
+
+def render_batch_documents(
+    template: Template,
+    records: List[Tuple[int, Dict[str, str]]],
+    errors: Dict[int, Any],
+    pdf: bool = False,
+) -> Iterator[Tuple[int, bytes]]:
+    """
+    Пакетное формирование документов по шаблону.
+
+    records - пары (номер записи, значения полей по тэгам)
+    errors - ошибки записей по номерам, дополняется ошибками формирования
+    Выдает пары (номер записи, содержимое файла) в порядке записей.
+    """
+    context_default = {
+        field.tag: field.default or field.name
+        for field in template.fields.all()
+    }
+    documents = render_many(
+        template.get_compiled_template(),
+        (context for _, context in records),
+        context_default,
+        processes=min(settings.BATCH_PROCESSES, len(records)),
+    )
+    if pdf:
+        documents = convert_many_to_pdf(documents)
+    try:
+        for (number, _), document in zip(records, documents):
+            if isinstance(document, Exception):
+                logger.warning(f"Batch record {number} failed: {document}")
+                errors[number] = [str(document)]
+                continue
+            yield number, document
+    finally:
+        # завершение пулов процессов и потоков
+        documents.close()
+
+
+def batch_errors_json(errors: Dict[int, Any]) -> bytes:
+    return json.dumps(
+        dict(sorted(errors.items())), ensure_ascii=False, indent=2
+    ).encode()
+
+
+def render_batch(
+    template: Template,
+    records: List[Tuple[int, Dict[str, str]]],
+    errors: Dict[int, Any],
+    pdf: bool = False,
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    Пакетное формирование документов: пары (имя файла, содержимое) для
+    zip-архива, последним выдается файл errors.json, если есть ошибки.
+    """
+    extension = "pdf" if pdf else "docx"
+    name = template.name.replace("/", "_")
+    width = len(str(records[-1][0])) if records else 1
+    for number, document in render_batch_documents(
+        template, records, errors, pdf
+    ):
+        yield f"{number:0{width}d}_{name}.{extension}", document
+    if errors:
+        yield "errors.json", batch_errors_json(errors)
+
+
+def render_batch_merged(
+    template: Template,
+    records: List[Tuple[int, Dict[str, str]]],
+    errors: Dict[int, Any],
+    pdf: bool = False,
+) -> Optional[bytes]:
+    """
+    Пакетное формирование одного документа со всеми записями (каждая
+    запись - с новой страницы). Pdf получается одной конвертацией
+    объединенного документа. None - если не сформирована ни одна запись.
+    """
+    content = merge_documents(
+        document
+        for _, document in render_batch_documents(template, records, errors)
+    )
+    if content is not None and pdf:
+        content = convert_file_to_pdf(io.BytesIO(content)).getvalue()
+    return content
+
+
+def render_package(
+    package: List[Tuple[Template, Dict[str, str]]],
+    errors: Dict[int, Any],
+    pdf: bool = False,
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    Пакет документов по нескольким шаблонам с общими значениями полей.
+
+    package - пары (шаблон, значения полей шаблона по тэгам)
+    errors - ошибки формирования по id шаблонов
+    Документы формируются параллельно в потоках процесса, поэтому
+    используют общие кэши разобранных шаблонов и склонений; выдаются
+    пары (имя файла, содержимое) для zip-архива в порядке шаблонов,
+    последним - файл errors.json, если есть ошибки.
+    """
+    render = render_partial_pdf if pdf else render_partial_docx
+    extension = "pdf" if pdf else "docx"
+    width = len(str(len(package)))
+    workers = max(min(settings.PACKAGE_THREADS, len(package)), 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        documents = ordered_map(
+            executor,
+            render,
+            (
+                (
+                    template,
+                    context,
+                    {
+                        field.tag: field.default or field.name
+                        for field in template.fields.all()
+                    },
+                )
+                for template, context in package
+            ),
+            workers * 2,
+        )
+        for number, ((template, _), document) in enumerate(
+            zip(package, documents), 1
+        ):
+            if isinstance(document, Exception):
+                logger.warning(
+                    f"Package template {template.id} failed: {document}"
+                )
+                errors[template.id] = [str(document)]
+                continue
+            name = template.name.replace("/", "_")
+            yield f"{number:0{width}d}_{name}.{extension}", document
+    if errors:
+        yield "errors.json", batch_errors_json(errors)
 
 
 def date_iso_to_ddmmyyyy(value: str):
@@ -106,5 +494,5 @@ def custom_fieldtypes_validation(
     """Валидация полей согласно кастомным типам"""
     for data in validated_data:
         field = data["field"]
-        if field.type.type == "date":
+        if field.type and field.type.type == "date":
             data["value"] = date_iso_to_ddmmyyyy(data["value"])
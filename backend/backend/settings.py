@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "drf_yasg",
     "rest_framework",
     "djoser",
@@ -139,6 +140,74 @@ MEDIA_ROOT = "/app/media"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Количество разобранных шаблонов docx, хранимых в памяти процесса
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "32"))
+
+# Быстрый рендеринг шаблонов, содержащих только подстановки {{ tag }}
+# и {{ tag|filter }} (см. core/fast_render.py)
+FAST_RENDER = os.getenv("FAST_RENDER", "True").lower() == "true"
+
+# Уровень сжатия (0-9) измененных частей docx при сохранении документа,
+# неизменные части копируются из файла шаблона без повторного сжатия
+DOCX_COMPRESS_LEVEL = int(os.getenv("DOCX_COMPRESS_LEVEL", "6"))
+
+# Количество результатов склонения слов, хранимых в памяти процесса
+MORPH_CACHE_SIZE = int(os.getenv("MORPH_CACHE_SIZE", "10000"))
+# Хранить результаты склонения в БД (общий кэш для всех процессов)
+MORPH_CACHE_PERSISTENT = (
+    os.getenv("MORPH_CACHE_PERSISTENT", "False").lower() == "true"
+)
+
+# Пул процессов LibreOffice для конвертации в PDF (команда run_office_pool).
+# Если пул не запущен, для каждой конвертации запускается отдельный soffice
+OFFICE_POOL_SIZE = int(os.getenv("OFFICE_POOL_SIZE", "2"))
+OFFICE_POOL_DIR = os.getenv("OFFICE_POOL_DIR", "/tmp/office_pool")
+# Интерпретатор с модулем uno (python3-uno) для обработчиков пула
+OFFICE_PYTHON = os.getenv("OFFICE_PYTHON", "/usr/bin/python3")
+# Ограничение времени конвертации одного документа, с
+OFFICE_JOB_TIMEOUT = int(os.getenv("OFFICE_JOB_TIMEOUT", "60"))
+# Интервал проверки состояния обработчиков пула, с
+OFFICE_HEALTH_CHECK_INTERVAL = int(
+    os.getenv("OFFICE_HEALTH_CHECK_INTERVAL", "10")
+)
+
+# Кэш сформированных файлов docx и pdf на диске
+RENDER_CACHE_DIR = os.getenv(
+    "RENDER_CACHE_DIR", os.path.join(MEDIA_ROOT, "render_cache")
+)
+# Максимальный размер кэша, байт (0 - кэш отключен)
+RENDER_CACHE_MAX_SIZE = int(os.getenv("RENDER_CACHE_MAX_SIZE", str(2**30)))
+
+# Внутренний location nginx, отображаемый на MEDIA_ROOT: файлы из MEDIA_ROOT
+# отдает nginx по заголовку X-Accel-Redirect (пустое значение - файлы
+# отправляет бэкенд)
+ACCEL_REDIRECT_LOCATION = os.getenv("ACCEL_REDIRECT_LOCATION", "")
+
+# Пакетное формирование документов: количество процессов рендеринга
+# и максимальное количество записей в одном запросе (docx и объединенный
+# документ, в том числе pdf - одна конвертация; архив pdf - конвертация
+# каждой записи). Пакет формируется в ответе на запрос: время его
+# формирования должно быть меньше timeout рабочего процесса gunicorn
+# (по умолчанию 30 с)
+BATCH_PROCESSES = int(os.getenv("BATCH_PROCESSES", "4"))
+BATCH_MAX_RECORDS = int(os.getenv("BATCH_MAX_RECORDS", "200"))
+BATCH_MAX_PDF_RECORDS = int(os.getenv("BATCH_MAX_PDF_RECORDS", "20"))
+
+# Пакет документов по нескольким шаблонам: количество потоков рендеринга
+# и максимальное количество шаблонов в одном запросе
+PACKAGE_THREADS = int(os.getenv("PACKAGE_THREADS", "4"))
+PACKAGE_MAX_TEMPLATES = int(os.getenv("PACKAGE_MAX_TEMPLATES", "20"))
+
+# Очередь заданий на формирование pdf (команда run_pdf_jobs), с:
+# повторное выполнение задания, не завершившегося за это время
+PDF_JOB_STALE_TIMEOUT = int(os.getenv("PDF_JOB_STALE_TIMEOUT", "600"))
+# время хранения результатов выполненных заданий
+PDF_JOB_TTL = int(os.getenv("PDF_JOB_TTL", "86400"))
+# максимальное время ожидания при запросе статуса с параметром wait;
+# ожидающий клиент занимает синхронный рабочий процесс gunicorn, поэтому
+# значение должно быть значительно меньше его timeout (по умолчанию 30 с)
+PDF_JOB_MAX_WAIT = int(os.getenv("PDF_JOB_MAX_WAIT", "5"))
+
 AUTH_USER_MODEL = "users.User"
 
 REST_FRAMEWORK = {
@@ -4,6 +4,8 @@ python manage.py makemigrations
 
 python manage.py migrate
 
+python manage.py prepare_templates
+
 python manage.py collectstatic
 
 cp -r /app/collected_static/. /app/static/
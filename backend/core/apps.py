@@ -1,6 +1,26 @@
+import os
+
 from django.apps import AppConfig
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+
+        from core import docx_package
+        from core.models import (
+            DatabaseInflectionBackend,
+            discard_inherited_connections,
+        )
+        from core.template_render import morph_cache
+
+        docx_package.compress_level = settings.DOCX_COMPRESS_LEVEL
+        morph_cache.maxsize = settings.MORPH_CACHE_SIZE
+        if settings.MORPH_CACHE_PERSISTENT:
+            morph_cache.backend = DatabaseInflectionBackend()
+        # соединение с БД не разделяется между процессами (пул пакетного
+        # рендеринга, рабочие процессы gunicorn при preload)
+        os.register_at_fork(after_in_child=discard_inherited_connections)
@@ -0,0 +1,144 @@
+"""
+Пакетный рендеринг документов по одному шаблону.
+
+Записи рендерятся в пуле процессов; каждый процесс разбирает шаблон
+один раз (в инициализаторе пула) и рендерит записи из своей копии.
+Результаты выдаются в порядке записей по мере готовности, одновременно
+в обработке находится ограниченное число записей, поэтому потребление
+памяти не зависит от размера пакета.
+"""
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from io import BytesIO
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Union,
+)
+
+from docx import Document
+from docxcompose.composer import Composer
+
+from .models import discard_inherited_connections
+from .template_render import CompiledTemplate, RenderMode, render_template
+
+# Количество записей в обработке на один процесс (поток) пула
+WINDOW_PER_WORKER = 4
+
+_worker_template: Optional[CompiledTemplate] = None
+
+
+def _init_worker(
+    source: bytes, prepared: bool, tags: List[str], fast: bool
+):
+    global _worker_template
+    # соединение с БД родительского процесса не используется (склонения
+    # из DatabaseInflectionBackend запрашиваются через собственное)
+    discard_inherited_connections()
+    _worker_template = CompiledTemplate(
+        BytesIO(source), prepared=prepared, tags=tags, fast=fast
+    )
+
+
+def _render(
+    context: Dict[str, Any], context_default: Dict[str, Any], mode: str
+) -> bytes:
+    return render_template(_worker_template, context, context_default, mode)
+
+
+def ordered_map(
+    executor: Executor,
+    fn: Callable,
+    items: Iterable,
+    window: int,
+) -> Iterator[Union[Any, Exception]]:
+    """
+    Аналог executor.map: результаты в исходном порядке, исключение
+    возвращается вместо результата, в обработке не более window элементов.
+    """
+    pending = deque()
+    items = iter(items)
+    try:
+        while True:
+            while len(pending) < window:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                if isinstance(item, Exception):
+                    pending.append(item)
+                else:
+                    pending.append(executor.submit(fn, *item))
+            if not pending:
+                return
+            future = pending.popleft()
+            if isinstance(future, Exception):
+                yield future
+                continue
+            try:
+                yield future.result()
+            except Exception as e:
+                yield e
+    finally:
+        for future in pending:
+            if not isinstance(future, Exception):
+                future.cancel()
+
+
+def render_many(
+    compiled: CompiledTemplate,
+    contexts: Iterable[Dict[str, Any]],
+    context_default: Optional[Dict[str, Any]] = None,
+    mode: str = RenderMode.PARTIAL,
+    processes: int = 1,
+) -> Iterator[Union[bytes, Exception]]:
+    """
+    Рендеринг шаблона для каждого контекста. Для каждой записи выдаётся
+    содержимое docx-файла или исключение, возникшее при рендеринге.
+    """
+    items = ((context, context_default, mode) for context in contexts)
+    if processes <= 1:
+        for context, context_default, mode in items:
+            try:
+                yield render_template(compiled, context, context_default, mode)
+            except Exception as e:
+                yield e
+        return
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(
+            compiled.source,
+            compiled.prepared,
+            compiled.get_tags(),
+            compiled.fast is not None,
+        ),
+    ) as pool:
+        yield from ordered_map(
+            pool, _render, items, processes * WINDOW_PER_WORKER
+        )
+
+
+def merge_documents(documents: Iterable[bytes]) -> Optional[bytes]:
+    """
+    Объединение документов docx в один, каждый документ начинается с
+    новой страницы. Возвращает None, если документов нет.
+    """
+    composer = None
+    for content in documents:
+        document = Document(BytesIO(content))
+        if composer is None:
+            composer = Composer(document)
+            continue
+        composer.doc.add_page_break()
+        composer.append(document)
+    if composer is None:
+        return None
+    stream = BytesIO()
+    composer.save(stream)
+    return stream.getvalue()
@@ -18,6 +18,18 @@ class Messages:
     WRONG_TEMPLATE_FIELD: Final = (
         "Идентификатор поля {} не соответствует шаблону"
     )
+    UNKNOWN_FIELD_TAG: Final = "Поле с тэгом '{tag}' отсутствует в шаблоне"
+    BATCH_NO_RECORDS: Final = "Не переданы записи для формирования документов"
+    BATCH_TOO_MANY_RECORDS: Final = (
+        "Количество записей превышает допустимое ({})"
+    )
+    BATCH_CSV_INVALID: Final = "Файл CSV должен быть в кодировке UTF-8"
+    PACKAGE_TEMPLATES_NOT_FOUND: Final = "Шаблоны не найдены: {}"
+    PACKAGE_TEMPLATES_NOT_UNIQUE: Final = "Шаблоны в пакете повторяются"
+    PACKAGE_UNKNOWN_FIELD_TAG: Final = (
+        "Поле с тэгом '{}' отсутствует в шаблонах пакета"
+    )
+    SEARCH_QUERY_REQUIRED: Final = "Не задан текст для поиска"
 
     TEMPLATE_ALREADY_DELETED: Final = "Шаблон уже удален ранее"
 
@@ -40,6 +52,9 @@ class Messages:
         "Загрузка завершена. Загружено {} шаблонов."
     )
     TEMPLATE_JSON_CORRUPTED: Final = "Ошибка в структуре json файла '{}'"
+    TEMPLATE_PREPARE_FAILED: Final = "Ошибка подготовки шаблона '{}': {}"
+    TEMPLATE_FILE_INVALID: Final = "Файл не является шаблоном docx: {}"
+    TEMPLATE_PREPARE_FINISHED: Final = "Подготовлено шаблонов: {}."
     FILE_NOT_FOUND: Final = "Файл '{}' не найден."
     UNKNOWN_GROUP_ID: Final = "Ошибка: неизвестный идентификатор группы '{}'"
     UNKNOWN_TYPE: Final = "Ошибка: неизвестный тип поля '{}'"
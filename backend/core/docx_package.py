@@ -0,0 +1,140 @@
+"""
+Запись пакета docx (zip-архива) без повторного сжатия неизменных частей.
+
+python-docx при сохранении сжимает заново все части документа: шрифты,
+изображения, стили. При рендеринге меняются только document.xml,
+колонтитулы и свойства документа, поэтому части, совпадающие с файлом
+шаблона, копируются из него в сжатом виде, а сжимаются только
+измененные части (с уровнем compress_level).
+"""
+import copy
+import struct
+import zipfile
+from io import BytesIO
+from typing import Dict, Iterable, List, NamedTuple, Tuple, Union
+
+from docx.opc.pkgwriter import PackageWriter
+from docxtpl import DocxTemplate
+
+# Уровень сжатия измененных частей (zlib, 0-9), задается настройкой
+# DOCX_COMPRESS_LEVEL (см. core.apps)
+compress_level = 6
+
+_LOCAL_HEADER = struct.Struct("<4s22xHH")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+# Бит флага: CRC и размеры записаны после данных (дескриптор данных)
+_DATA_DESCRIPTOR_FLAG = 0x08
+
+
+class RawMember(NamedTuple):
+    """Файл zip-архива в сжатом виде."""
+
+    info: zipfile.ZipInfo
+    data: bytes
+
+
+def read_members(source: bytes) -> Dict[str, Tuple[RawMember, bytes]]:
+    """
+    Файлы архива: имя -> (файл в сжатом виде, содержимое).
+    """
+    members = {}
+    with zipfile.ZipFile(BytesIO(source)) as archive:
+        for info in archive.infolist():
+            signature, name_length, extra_length = _LOCAL_HEADER.unpack_from(
+                source, info.header_offset
+            )
+            if signature != _LOCAL_HEADER_SIGNATURE:
+                raise zipfile.BadZipFile(f"Bad local header: {info.filename}")
+            start = (
+                info.header_offset
+                + _LOCAL_HEADER.size
+                + name_length
+                + extra_length
+            )
+            raw = RawMember(info, source[start:start + info.compress_size])
+            members[info.filename] = (raw, archive.read(info))
+    return members
+
+
+def write_raw(archive: zipfile.ZipFile, member: RawMember):
+    """Запись в архив файла в сжатом виде (без повторного сжатия)."""
+    info = copy.copy(member.info)
+    info.flag_bits &= ~_DATA_DESCRIPTOR_FLAG
+    info.extra = b""
+    info.header_offset = archive.fp.tell()
+    archive.fp.write(info.FileHeader(zip64=False))
+    archive.fp.write(member.data)
+    archive.filelist.append(info)
+    archive.NameToInfo[info.filename] = info
+    archive.start_dir = archive.fp.tell()
+
+
+def write_package(
+    members: Iterable[Tuple[str, Union[bytes, RawMember]]]
+) -> bytes:
+    """
+    Архив из файлов: содержимое (сжимается) или файл в сжатом виде
+    (копируется как есть).
+    """
+    stream = BytesIO()
+    with zipfile.ZipFile(
+        stream, "w", zipfile.ZIP_DEFLATED, compresslevel=compress_level
+    ) as archive:
+        for name, content in members:
+            if isinstance(content, RawMember):
+                write_raw(archive, content)
+            else:
+                archive.writestr(name, content)
+    return stream.getvalue()
+
+
+class _MemberCollector:
+    """Замена PhysPkgWriter python-docx: собирает части пакета."""
+
+    def __init__(self):
+        self.members: List[Tuple[str, bytes]] = []
+
+    def write(self, pack_uri, blob: bytes):
+        self.members.append((pack_uri.membername, blob))
+
+
+def package_members(template: DocxTemplate) -> List[Tuple[str, bytes]]:
+    """Части документа в том виде, в котором их сохраняет python-docx."""
+    package = template.docx.part.package
+    parts = package.parts
+    for part in parts:
+        part.before_marshal()
+    collector = _MemberCollector()
+    # последовательность записи как в PackageWriter.write
+    PackageWriter._write_content_types_stream(collector, parts)
+    PackageWriter._write_pkg_rels(collector, package.rels)
+    PackageWriter._write_parts(collector, parts)
+    return collector.members
+
+
+def save_docx(
+    template: DocxTemplate,
+    source_members: Dict[str, Tuple[RawMember, bytes]],
+) -> bytes:
+    """
+    Сохранение отрендеренного документа: части, совпадающие с частями
+    файла шаблона (source_members), копируются из него в сжатом виде.
+    """
+    if (
+        template.crc_to_new_media
+        or template.crc_to_new_embedded
+        or template.zipname_to_replace
+    ):
+        # замена файлов архива выполняется только при сохранении docxtpl
+        stream = BytesIO()
+        template.save(stream)
+        return stream.getvalue()
+    template.pre_processing()
+    members = []
+    for name, blob in package_members(template):
+        source = source_members.get(name)
+        if source is not None and source[1] == blob:
+            members.append((name, source[0]))
+        else:
+            members.append((name, blob))
+    return write_package(members)
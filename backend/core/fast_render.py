@@ -0,0 +1,380 @@
+"""
+Быстрый рендеринг простых шаблонов docx.
+
+Простой шаблон содержит только подстановки вида {{ tag }} и
+{{ tag|filter(...) }} (без блоков {% %}, комментариев и выражений
+сложнее имен, констант и фильтров). Для такого шаблона результат
+рендеринга docxtpl отличается только подставленными значениями, поэтому
+шаблон один раз рендерится средствами docxtpl с маркерами вместо
+значений, а сохраненный файл разбивается на неизменные фрагменты XML и
+слоты подстановок. Рендеринг сводится к вычислению выражений слотов и
+склейке фрагментов, части архива без подстановок копируются в сжатом виде
+(см. core.docx_package).
+
+Результат совпадает с результатом docxtpl побайтно (для каждого файла
+архива). Если значение нельзя подставить без обработки, которую выполняет
+docxtpl (разметка XML, управляющие символы), рендеринг возвращает None
+и выполняется обычным способом.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import jinja2
+from docxtpl import DocxTemplate
+from jinja2 import nodes
+
+from .docx_package import RawMember, read_members, save_docx, write_package
+
+# Маркеры слотов и переключателей (символы из области частного
+# использования Unicode, не изменяются при обработке и сериализации XML)
+SLOT_MARKER = "\ue000{}\ue001"
+SWITCH_MARKER = "\ue002{}\ue003"
+_MARKER_CHARS = re.compile("[\ue000-\ue003]")
+_SLOT_RE = "\ue000(\\d+)\ue001"
+
+# Значения, которые docxtpl обрабатывает особым образом или которые
+# нарушают разметку XML: подставляются только обычным рендерингом
+_UNSAFE_VALUE = re.compile(
+    "[\x00-\x1f\x7f-\x9f<&\ud800-\udfff\ue000-\ue003\ufffe\uffff]"
+)
+# Последовательности, заменяемые docxtpl после рендеринга ({_{ и т.п.)
+_ESCAPED_BRACES = (b"{_", b"_}")
+# Элемент, ставший пустым после подстановки пустого значения:
+# lxml записывает такие элементы в сокращенной форме
+_EMPTY_ELEMENT = re.compile(rb"<([^\s<>/!?]+)([^<>]*)></\1>")
+
+
+class NotSimple(Exception):
+    """Шаблон не может быть отрендерен быстрым способом."""
+
+
+class Switch(NamedTuple):
+    """
+    Переключаемый фрагмент шаблона (например, подсветка поля).
+
+    search - фрагмент с маркером в отрендеренном шаблоне
+    on, off - фрагмент во включенном и выключенном состоянии
+    tags - тэги, при наличии любого из которых фрагмент включается
+    """
+
+    search: str
+    on: str
+    off: str
+    tags: frozenset
+
+
+def _check_expr(node: nodes.Node, filters: Dict[str, Callable]):
+    """Проверка, что выражение - имя, константа или цепочка фильтров."""
+    if isinstance(node, (nodes.Name, nodes.Const)):
+        return
+    if isinstance(node, nodes.Filter):
+        func = filters.get(node.name)
+        if (
+            func is None
+            # фильтры, которым передается окружение или контекст jinja2
+            or getattr(func, "jinja_pass_arg", None) is not None
+            or node.kwargs
+            or node.dyn_args is not None
+            or node.dyn_kwargs is not None
+        ):
+            raise NotSimple(f"filter {node.name}")
+        _check_expr(node.node, filters)
+        for arg in node.args:
+            _check_expr(arg, filters)
+        return
+    raise NotSimple(type(node).__name__)
+
+
+def evaluate(
+    node: nodes.Node, context: Dict[str, Any], env: jinja2.Environment
+) -> Any:
+    """Вычисление выражения слота так же, как это делает jinja2."""
+    if isinstance(node, nodes.Const):
+        return node.value
+    if isinstance(node, nodes.Name):
+        if node.name in context:
+            return context[node.name]
+        if node.name in env.globals:
+            return env.globals[node.name]
+        return env.undefined(name=node.name)
+    return env.filters[node.name](
+        evaluate(node.node, context, env),
+        *(evaluate(arg, context, env) for arg in node.args),
+    )
+
+
+class _MarkedSource:
+    def __init__(self, text: str):
+        self.text = text
+
+    def render(self, *args, **kwargs) -> str:
+        return self.text
+
+
+class SlotEnvironment:
+    """
+    Окружение jinja2 для docxtpl, которое вместо рендеринга заменяет
+    выражения маркерами слотов (выражения сохраняются в slots).
+    """
+
+    def __init__(
+        self,
+        jinja_env: jinja2.Environment,
+        source_members: Dict[str, Tuple[RawMember, bytes]] = None,
+    ):
+        self.jinja_env = jinja_env
+        self.source_members = source_members
+        self.slots: List[nodes.Expr] = []
+
+    def from_string(self, source: str) -> _MarkedSource:
+        try:
+            template = self.jinja_env.parse(source)
+        except jinja2.TemplateSyntaxError as e:
+            raise NotSimple(str(e))
+        text = []
+        for output in template.body:
+            if not isinstance(output, nodes.Output):
+                raise NotSimple(type(output).__name__)
+            for node in output.nodes:
+                if isinstance(node, nodes.TemplateData):
+                    text.append(node.data)
+                    continue
+                _check_expr(node, self.jinja_env.filters)
+                text.append(SLOT_MARKER.format(len(self.slots)))
+                self.slots.append(node)
+        return _MarkedSource("".join(text))
+
+
+def is_simple(template: DocxTemplate, jinja_env: jinja2.Environment) -> bool:
+    """Проверка, что шаблон содержит только простые подстановки."""
+    env = SlotEnvironment(jinja_env)
+    sources = [template.get_xml()]
+    for uri in (template.HEADER_URI, template.FOOTER_URI):
+        for _, part in template.get_headers_footers(uri):
+            sources.append(template.get_part_xml(part))
+    try:
+        for source in sources:
+            if _MARKER_CHARS.search(source):
+                raise NotSimple("marker characters in template")
+            env.from_string(template.patch_xml(source))
+    except NotSimple:
+        return False
+    return True
+
+
+class _Slot(NamedTuple):
+    index: int
+    attribute: bool
+
+
+class _SwitchRef(NamedTuple):
+    index: int
+
+
+Segment = Union[bytes, _Slot, _SwitchRef]
+
+
+class FastVariant:
+    """
+    Шаблон, разбитый на фрагменты: для каждого файла архива - файл в сжатом
+    виде (без подстановок) или список фрагментов, слотов и переключателей.
+    """
+
+    def __init__(
+        self,
+        members: List[tuple],
+        slots: List[nodes.Expr],
+        switches: List[Switch],
+    ):
+        self.members = members
+        self.slots = slots
+        self.switches = switches
+
+    @classmethod
+    def build(
+        cls,
+        template: DocxTemplate,
+        jinja_env: jinja2.Environment,
+        switches: List[Switch] = (),
+        source_members: Dict[str, Tuple[RawMember, bytes]] = None,
+    ) -> "FastVariant":
+        """
+        Разбор шаблона docxtpl (с уже внесенными маркерами переключателей).
+        Рендеринг и сохранение выполняются средствами docxtpl, поэтому
+        неизменные фрагменты совпадают с результатом обычного рендеринга.
+        Файлы архива без подстановок сохраняются в сжатом виде
+        (совпадающие с source_members - в сжатом виде из файла шаблона).
+        """
+        env = SlotEnvironment(jinja_env)
+        template.render({}, jinja_env=env)
+        saved = read_members(save_docx(template, source_members or {}))
+        switches = list(switches)
+        for switch in switches:
+            if _MARKER_CHARS.search(switch.on + switch.off):
+                raise NotSimple("marker characters in switch")
+        pattern = re.compile(
+            "|".join(
+                [_SLOT_RE] + [re.escape(switch.search) for switch in switches]
+            )
+        )
+        switch_index = {switch.search: i for i, switch in enumerate(switches)}
+        slot_count = [0] * len(env.slots)
+        members = []
+        for name, (raw, content) in saved.items():
+            if b"\xee\x80" not in content:
+                members.append((name, raw))
+                continue
+            text = content.decode("utf-8")
+            segments: List[Segment] = []
+            position = 0
+            for match in pattern.finditer(text):
+                literal = text[position:match.start()]
+                segments.append(literal.encode())
+                if match.group(1) is not None:
+                    index = int(match.group(1))
+                    slot_count[index] += 1
+                    # слот внутри тэга - в значении атрибута
+                    attribute = text.rfind(
+                        "<", 0, match.start()
+                    ) > text.rfind(">", 0, match.start())
+                    segments.append(_Slot(index, attribute))
+                else:
+                    segments.append(
+                        _SwitchRef(switch_index[match.group(0)])
+                    )
+                position = match.end()
+            segments.append(text[position:].encode())
+            for segment in segments:
+                if isinstance(segment, bytes) and (
+                    _MARKER_CHARS.search(segment.decode())
+                    or any(s in segment for s in _ESCAPED_BRACES)
+                ):
+                    raise NotSimple(f"unresolved markers in {name}")
+            members.append((name, segments))
+        if any(count != 1 for count in slot_count):
+            raise NotSimple("slot is duplicated or lost")
+        return cls(members, env.slots, switches)
+
+    @staticmethod
+    def _escape(value: str, attribute: bool) -> bytes:
+        value = value.replace(">", "&gt;")
+        if attribute:
+            value = value.replace('"', "&quot;")
+        return value.encode()
+
+    def render(
+        self,
+        context: Dict[str, Any],
+        jinja_env: jinja2.Environment,
+        tags: Set[str] = frozenset(),
+    ) -> Optional[bytes]:
+        """
+        Содержимое документа docx или None, если значения нельзя
+        подставить быстрым способом.
+
+        tags - тэги, включающие переключатели (например, подсвечиваемые)
+        """
+        values = []
+        for slot in self.slots:
+            value = str(evaluate(slot, context, jinja_env))
+            if _UNSAFE_VALUE.search(value):
+                return None
+            values.append(value)
+        switches = [
+            (switch.on if switch.tags & tags else switch.off).encode()
+            for switch in self.switches
+        ]
+        contents = []
+        for name, member in self.members:
+            if isinstance(member, RawMember):
+                contents.append((name, member))
+                continue
+            parts = []
+            empty = False
+            for segment in member:
+                if isinstance(segment, bytes):
+                    parts.append(segment)
+                elif isinstance(segment, _Slot):
+                    value = values[segment.index]
+                    empty = empty or (not value and not segment.attribute)
+                    parts.append(self._escape(value, segment.attribute))
+                else:
+                    parts.append(switches[segment.index])
+            content = b"".join(parts)
+            if any(s in content for s in _ESCAPED_BRACES):
+                return None
+            if empty:
+                content = _EMPTY_ELEMENT.sub(rb"<\1\2/>", content)
+            contents.append((name, content))
+        return write_package(contents)
+
+
+_NOT_BUILT = object()
+
+
+class FastTemplate:
+    """
+    Варианты быстрого рендеринга шаблона (например, для документа и
+    эскиза). Вариант строится при первом использовании; если шаблон
+    не может быть разобран, для варианта сохраняется None.
+    """
+
+    def __init__(
+        self,
+        jinja_env: jinja2.Environment,
+        source_members: Dict[str, Tuple[RawMember, bytes]] = None,
+    ):
+        self.jinja_env = jinja_env
+        self.source_members = source_members
+        self._variants: Dict[Hashable, Optional[FastVariant]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(
+        cls,
+        template: DocxTemplate,
+        jinja_env: jinja2.Environment,
+        source_members: Dict[str, Tuple[RawMember, bytes]] = None,
+    ) -> Optional["FastTemplate"]:
+        """FastTemplate для простого шаблона, иначе None."""
+        if not is_simple(template, jinja_env):
+            return None
+        return cls(jinja_env, source_members)
+
+    def get_variant(
+        self,
+        key: Hashable,
+        builder: Callable[[], tuple],
+    ) -> Optional[FastVariant]:
+        """
+        Вариант по ключу. builder возвращает пару (шаблон docxtpl,
+        переключатели) для построения варианта.
+        """
+        variant = self._variants.get(key, _NOT_BUILT)
+        if variant is not _NOT_BUILT:
+            return variant
+        with self._lock:
+            variant = self._variants.get(key, _NOT_BUILT)
+            if variant is _NOT_BUILT:
+                template, switches = builder()
+                try:
+                    variant = FastVariant.build(
+                        template, self.jinja_env, switches, self.source_members
+                    )
+                except NotSimple:
+                    variant = None
+                self._variants[key] = variant
+        return variant
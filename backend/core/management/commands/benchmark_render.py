@@ -0,0 +1,73 @@
+import json
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from core.template_render import (
+    CompiledTemplate,
+    RenderMode,
+    prepare_template,
+    render_template,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнение времени рендеринга шаблонов из каталога начальных данных "
+        "быстрым способом и средствами docxtpl"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Количество рендерингов каждого шаблона",
+        )
+
+    @staticmethod
+    def measure(compiled, context, context_default, repeat) -> float:
+        """Среднее время рендеринга, мс (первый рендеринг не учитывается)."""
+        render_template(compiled, context, context_default, RenderMode.PARTIAL)
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            render_template(
+                compiled, context, context_default, RenderMode.PARTIAL
+            )
+        return (time.perf_counter() - start_time) / repeat * 1000
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        total_fast = total_docxtpl = 0
+        for path in sorted(settings.INITIAL_DATA_DIR.rglob("*_tpl.docx")):
+            fields = json.loads(path.with_suffix(".json").read_text())
+            context_default = {
+                field["tag"]: field["name"] for field in fields["fields"]
+            }
+            source, tags = prepare_template(str(path))
+            # заполнена половина полей, остальные подсвечиваются
+            context = {tag: f"Значение {tag}" for tag in tags[::2]}
+            fast = CompiledTemplate(BytesIO(source), prepared=True, tags=tags)
+            docxtpl = CompiledTemplate(
+                BytesIO(source), prepared=True, tags=tags, fast=False
+            )
+            fast_time = self.measure(fast, context, context_default, repeat)
+            docxtpl_time = self.measure(
+                docxtpl, context, context_default, repeat
+            )
+            total_fast += fast_time
+            total_docxtpl += docxtpl_time
+            self.stdout.write(
+                f"{path.name}: {fast_time:.1f} мс / {docxtpl_time:.1f} мс "
+                f"(x{docxtpl_time / fast_time:.1f}"
+                f"{'' if fast.fast else ', не простой'})"
+            )
+        if total_fast:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Итого: {total_fast:.1f} мс / {total_docxtpl:.1f} мс "
+                    f"(x{total_docxtpl / total_fast:.1f})"
+                )
+            )
@@ -62,6 +62,7 @@ def create_template_fields(
             TemplateField(template=template, group=group, type=type, **field)
         )
     TemplateField.objects.bulk_create(template_fields)
+    Template.objects.filter(pk=template.pk).update_search_vector()
 
 
 def load_template(docx_file_name, json_file_name):
@@ -0,0 +1,54 @@
+from django.core.management import BaseCommand
+
+from api.v2.utils import prepare_template_drafts
+from core.constants import Messages
+from documents.models import Template
+
+
+class Command(BaseCommand):
+    help = (
+        "Подготовка файлов шаблонов к рендерингу (объединение прогонов, "
+        "извлечение тэгов) для ранее загруженных шаблонов и формирование "
+        "их черновиков docx и pdf. Подготовленные шаблоны пропускаются, "
+        "если не задан параметр --all"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help=(
+                "Подготовить заново все шаблоны и проверить черновики всех "
+                "шаблонов, а не только неподготовленных"
+            ),
+        )
+        parser.add_argument(
+            "--no-drafts",
+            action="store_true",
+            help="Не формировать черновики шаблонов",
+        )
+
+    def handle(self, *args, **options):
+        templates = Template.objects.exclude(template="")
+        if not options["all"]:
+            templates = templates.filter(prepared_template="")
+        prepared = []
+        for template in templates:
+            try:
+                template.prepare()
+            except Exception as e:
+                self.stderr.write(
+                    Messages.TEMPLATE_PREPARE_FAILED.format(template.name, e)
+                )
+                continue
+            prepared.append(template)
+        self.stdout.write(
+            self.style.SUCCESS(
+                Messages.TEMPLATE_PREPARE_FINISHED.format(len(prepared))
+            )
+        )
+        if options["no_drafts"]:
+            return
+        # устаревшие черновики остальных шаблонов формируются при запросе
+        for template in prepared:
+            prepare_template_drafts(template)
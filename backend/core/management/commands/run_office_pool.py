@@ -0,0 +1,34 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from core.office_pool import OfficePool
+
+
+class Command(BaseCommand):
+    help = (
+        "Запуск пула процессов LibreOffice для конвертации документов в PDF "
+        "с перезапуском упавших и зависших процессов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=settings.OFFICE_POOL_SIZE,
+            help="Количество процессов LibreOffice",
+        )
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stop_event.set())
+        pool = OfficePool(
+            settings.OFFICE_POOL_DIR,
+            options["size"],
+            settings.OFFICE_PYTHON,
+            job_timeout=settings.OFFICE_JOB_TIMEOUT,
+        )
+        pool.run(settings.OFFICE_HEALTH_CHECK_INTERVAL, stop_event)
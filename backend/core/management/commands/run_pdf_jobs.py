@@ -0,0 +1,100 @@
+import datetime
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import connections
+
+from api.v2.utils import run_conversion_job
+from documents.models import ConversionJob
+
+logger = logging.getLogger(__name__)
+
+# интервал удаления устаревших заданий, с
+CLEANUP_INTERVAL = 600
+
+
+def process_jobs(poll_interval: float, stop_event: threading.Event = None):
+    """
+    Цикл обработчика очереди заданий. Без stop_event обработчик
+    завершается, когда очередь пуста.
+    """
+    stale_after = datetime.timedelta(seconds=settings.PDF_JOB_STALE_TIMEOUT)
+    ttl = datetime.timedelta(seconds=settings.PDF_JOB_TTL)
+    next_cleanup = time.monotonic()
+    while stop_event is None or not stop_event.is_set():
+        job = ConversionJob.claim_next(stale_after)
+        if job is None:
+            if stop_event is None:
+                break
+            if time.monotonic() >= next_cleanup:
+                ConversionJob.delete_expired(ttl)
+                next_cleanup = time.monotonic() + CLEANUP_INTERVAL
+            stop_event.wait(poll_interval)
+            continue
+        logger.debug(f"Start conversion job {job.id}")
+        try:
+            run_conversion_job(job)
+        except Exception as e:
+            logger.exception(f"Conversion job {job.id} failed")
+            job.fail(str(e))
+
+
+def run_worker(poll_interval: float):
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop_event.set())
+    process_jobs(poll_interval, stop_event)
+
+
+class Command(BaseCommand):
+    help = "Обработка очереди заданий на формирование pdf-файлов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Количество процессов-обработчиков",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1,
+            help="Интервал опроса очереди при отсутствии заданий, с",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Выполнить задания из очереди и завершить работу",
+        )
+
+    def handle(self, *args, **options):
+        poll_interval = options["poll_interval"]
+        if options["once"]:
+            process_jobs(poll_interval)
+            return
+        if options["processes"] == 1:
+            run_worker(poll_interval)
+            return
+        # соединения с БД не должны наследоваться дочерними процессами
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(poll_interval,))
+            for _ in range(options["processes"])
+        ]
+        for worker in workers:
+            worker.start()
+
+        def stop(*args):
+            for worker in workers:
+                worker.terminate()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, stop)
+        for worker in workers:
+            worker.join()
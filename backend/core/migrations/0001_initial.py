@@ -0,0 +1,31 @@
+# Generated by Django 3.2 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Inflection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=255, verbose_name='Слово')),
+                ('grammemes', models.CharField(max_length=64, verbose_name='Граммемы')),
+                ('result', models.CharField(blank=True, max_length=255, null=True, verbose_name='Результат склонения')),
+            ],
+            options={
+                'verbose_name': 'Склонение слова',
+                'verbose_name_plural': 'Склонения слов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='inflection',
+            constraint=models.UniqueConstraint(fields=('word', 'grammemes'), name='unique_word_grammemes'),
+        ),
+    ]
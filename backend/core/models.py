@@ -0,0 +1,70 @@
+"""Модели ядра шаблонизатора."""
+from typing import Any, List, Optional, Tuple
+
+from django.db import connections, models
+
+# Соединения с БД, унаследованные процессом при fork. Они не закрываются
+# (закрытие завершило бы сеанс родительского процесса) и не используются.
+_inherited_connections: List[Any] = []
+
+
+def discard_inherited_connections():
+    """
+    Отказ от соединений с БД, унаследованных дочерним процессом при fork:
+    при следующем запросе процесс откроет собственное соединение.
+    Вызывается после fork (см. core.apps).
+    """
+    for connection in connections.all():
+        if connection.connection is not None:
+            _inherited_connections.append(connection.connection)
+            connection.connection = None
+
+
+class Inflection(models.Model):
+    """Результат склонения слова (общий кэш фильтров шаблонов)."""
+
+    word = models.CharField(max_length=255, verbose_name="Слово")
+    grammemes = models.CharField(max_length=64, verbose_name="Граммемы")
+    result = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        verbose_name="Результат склонения",
+    )
+
+    class Meta:
+        verbose_name = "Склонение слова"
+        verbose_name_plural = "Склонения слов"
+        constraints = (
+            models.UniqueConstraint(
+                fields=("word", "grammemes"), name="unique_word_grammemes"
+            ),
+        )
+
+    def __str__(self):
+        """Отображение - слово (граммемы)."""
+        return f"{self.word} ({self.grammemes})"
+
+
+class DatabaseInflectionBackend:
+    """
+    Постоянное хранилище для MorphCache на основе модели Inflection.
+    Используется и в процессах пакетного рендеринга: после fork процесс
+    работает через собственное соединение с БД.
+    """
+
+    def get(self, word: str, grammemes: str) -> Tuple[bool, Optional[str]]:
+        row = (
+            Inflection.objects.filter(word=word, grammemes=grammemes)
+            .values_list("result")
+            .first()
+        )
+        if row is None:
+            return False, None
+        return True, row[0]
+
+    def set(self, word: str, grammemes: str, result: Optional[str]):
+        Inflection.objects.bulk_create(
+            [Inflection(word=word, grammemes=grammemes, result=result)],
+            ignore_conflicts=True,
+        )
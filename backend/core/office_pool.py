@@ -0,0 +1,229 @@
+"""
+Пул постоянно запущенных процессов LibreOffice для конвертации в PDF.
+
+OfficePool (команда run_office_pool) запускает обработчики
+core/office_worker.py, по одному на слот, и следит за их состоянием.
+convert_to_pdf отправляет задание свободному обработчику через unix-сокет
+слота; занятость слота между процессами определяется блокировкой файла
+<слот>.lock.
+"""
+import fcntl
+import json
+import logging
+import os
+import pathlib
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = pathlib.Path(__file__).resolve().parent / "office_worker.py"
+SLOT_POLL_INTERVAL = 0.05
+PING_TIMEOUT = 30
+
+
+class ConversionError(Exception):
+    """Ошибка конвертации документа."""
+
+
+class OfficePoolUnavailable(ConversionError):
+    """Пул не запущен."""
+
+
+def slot_sockets(pool_dir: str) -> List[pathlib.Path]:
+    return sorted(pathlib.Path(pool_dir).glob("*.sock"))
+
+
+@contextmanager
+def acquire_slot(
+    sockets: List[pathlib.Path], timeout: float, blocking: bool = True
+) -> Iterator[Optional[pathlib.Path]]:
+    """Захватывает первый свободный слот; ждёт не дольше timeout."""
+    deadline = time.monotonic() + timeout
+    while True:
+        for sock in sockets:
+            lock_file = open(sock.with_suffix(".lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            try:
+                yield sock
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+            return
+        if not blocking or time.monotonic() > deadline:
+            break
+        time.sleep(SLOT_POLL_INTERVAL)
+    if blocking:
+        raise ConversionError("All office workers are busy")
+    yield None
+
+
+def send_job(sock: pathlib.Path, job: dict, timeout: float) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(str(sock))
+        client.sendall(json.dumps(job).encode() + b"\n")
+        with client.makefile("rb") as response:
+            return json.loads(response.readline())
+
+
+def convert_to_pdf(
+    src: pathlib.Path, dst: pathlib.Path, pool_dir: str, timeout: int
+):
+    """Конвертирует src в PDF-файл dst с помощью обработчика пула."""
+    sockets = slot_sockets(pool_dir)
+    if not sockets:
+        raise OfficePoolUnavailable(f"No office workers in {pool_dir}")
+    job = {
+        "cmd": "convert",
+        "src": str(src.resolve()),
+        "dst": str(dst.resolve()),
+        "timeout": timeout,
+    }
+    with acquire_slot(sockets, timeout) as sock:
+        try:
+            # запас по времени на перезапуск soffice обработчиком
+            response = send_job(sock, job, timeout * 2)
+        except (OSError, ValueError) as e:
+            raise ConversionError(f"Office worker {sock.name}: {e}")
+    if not response.get("ok"):
+        raise ConversionError(response.get("error"))
+
+
+_soffice_lock = threading.Lock()
+
+
+def convert_to_pdf_oneshot(src: pathlib.Path, outdir: pathlib.Path, timeout):
+    """
+    Конвертация отдельным запуском soffice (если пул не запущен).
+    У каждого процесса свой профиль LibreOffice, чтобы параллельные
+    запуски не конфликтовали.
+    """
+    profile = pathlib.Path(tempfile.gettempdir()) / f"soffice_{os.getpid()}"
+    with _soffice_lock:
+        try:
+            subprocess.run(
+                [
+                    "soffice",
+                    "--headless",
+                    "--invisible",
+                    "--nologo",
+                    f"-env:UserInstallation={profile.as_uri()}",
+                    "--convert-to",
+                    "pdf",
+                    "--outdir",
+                    outdir,
+                    src.absolute(),
+                ],
+                check=True,
+                timeout=timeout,
+            )
+        except (subprocess.SubprocessError, OSError) as e:
+            raise ConversionError(str(e))
+
+
+class OfficePool:
+    """Запускает обработчики и перезапускает упавшие и зависшие."""
+
+    def __init__(
+        self,
+        pool_dir: str,
+        size: int,
+        python: str,
+        soffice: str = "soffice",
+        job_timeout: int = 60,
+    ):
+        self.pool_dir = pathlib.Path(pool_dir)
+        self.size = size
+        self.python = python
+        self.soffice = soffice
+        self.job_timeout = job_timeout
+        self.workers = {}
+
+    def slot_socket(self, slot: int) -> pathlib.Path:
+        return self.pool_dir / f"slot{slot}.sock"
+
+    def start_worker(self, slot: int):
+        sock = self.slot_socket(slot)
+        sock.unlink(missing_ok=True)
+        profile = self.pool_dir / f"profile{slot}"
+        self.workers[slot] = subprocess.Popen(
+            [
+                self.python,
+                str(WORKER_SCRIPT),
+                "--socket",
+                str(sock),
+                "--profile",
+                str(profile),
+                "--soffice",
+                self.soffice,
+                "--timeout",
+                str(self.job_timeout),
+            ]
+        )
+        logger.info(f"Office worker {slot} started")
+
+    def stop_worker(self, slot: int):
+        process = self.workers.pop(slot, None)
+        # сокет удаляется сразу, чтобы клиенты не отправляли задания
+        self.slot_socket(slot).unlink(missing_ok=True)
+        if process is None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def start(self):
+        self.pool_dir.mkdir(parents=True, exist_ok=True)
+        for sock in slot_sockets(self.pool_dir):
+            sock.unlink()
+        for slot in range(self.size):
+            self.start_worker(slot)
+
+    def stop(self):
+        for slot in list(self.workers):
+            self.stop_worker(slot)
+
+    def is_healthy(self, slot: int) -> bool:
+        if self.workers[slot].poll() is not None:
+            return False
+        sock = self.slot_socket(slot)
+        if not sock.exists():
+            # обработчик ещё запускает soffice
+            return True
+        # занятый обработчик не проверяется: зависшее задание он
+        # прервёт сам по таймауту
+        with acquire_slot([sock], 0, blocking=False) as acquired:
+            if acquired is None:
+                return True
+            try:
+                return send_job(sock, {"cmd": "ping"}, PING_TIMEOUT)["ok"]
+            except (OSError, ValueError, KeyError):
+                return False
+
+    def check(self):
+        for slot in list(self.workers):
+            if not self.is_healthy(slot):
+                logger.warning(f"Office worker {slot} is down, restarting")
+                self.stop_worker(slot)
+                self.start_worker(slot)
+
+    def run(self, interval: float, stop_event: threading.Event):
+        self.start()
+        try:
+            while not stop_event.wait(interval):
+                self.check()
+        finally:
+            self.stop()
@@ -0,0 +1,210 @@
+"""
+Обработчик пула LibreOffice (запускается командой run_office_pool).
+
+Скрипт выполняется интерпретатором python, которому доступен модуль uno
+(пакет python3-uno), и не зависит от Django. Обработчик запускает
+собственный экземпляр soffice с отдельным профилем пользователя и
+принимает задания на конвертацию через unix-сокет.
+
+Протокол: одно задание на соединение, запрос и ответ - строка JSON.
+    {"cmd": "convert", "src": "/path/in.docx", "dst": "/path/out.pdf",
+     "timeout": 60}
+    {"cmd": "ping"}
+Ответ: {"ok": true} или {"ok": false, "error": "..."}
+"""
+import argparse
+import json
+import logging
+import os
+import pathlib
+import signal
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+
+logger = logging.getLogger("office_worker")
+
+CONNECT_TIMEOUT = 60
+
+
+def property_values(**kwargs):
+    """Формирует кортеж PropertyValue из именованных аргументов."""
+    values = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        values.append(prop)
+    return tuple(values)
+
+
+class Office:
+    """Экземпляр soffice, управляемый через UNO."""
+
+    def __init__(self, soffice: str, profile_dir: str, pipe_name: str):
+        self.soffice = soffice
+        self.profile_url = pathlib.Path(profile_dir).resolve().as_uri()
+        self.pipe_name = pipe_name
+        self.process = None
+        self.desktop = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [
+                self.soffice,
+                "--headless",
+                "--invisible",
+                "--nologo",
+                "--norestore",
+                "--nodefault",
+                "--nolockcheck",
+                f"-env:UserInstallation={self.profile_url}",
+                f"--accept=pipe,name={self.pipe_name};urp;",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(
+                    f"uno:pipe,name={self.pipe_name};urp;"
+                    "StarOffice.ComponentContext"
+                )
+                break
+            except Exception:
+                if (
+                    time.monotonic() > deadline
+                    or self.process.poll() is not None
+                ):
+                    self.stop()
+                    raise RuntimeError("soffice failed to start")
+                time.sleep(0.2)
+        self.desktop = context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", context
+        )
+        logger.info(f"soffice started, pid {self.process.pid}")
+
+    def stop(self):
+        self.desktop = None
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.wait()
+        self.process = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def is_alive(self) -> bool:
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            self.desktop.getComponents()
+        except Exception:
+            return False
+        return True
+
+    def convert(self, src: str, dst: str):
+        document = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(src),
+            "_blank",
+            0,
+            property_values(Hidden=True, ReadOnly=True),
+        )
+        try:
+            document.storeToURL(
+                uno.systemPathToFileUrl(dst),
+                property_values(FilterName="writer_pdf_Export"),
+            )
+        finally:
+            document.close(True)
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            job = json.loads(self.rfile.readline())
+            response = self.server.process_job(job)
+        except Exception as e:
+            logger.exception("Job failed")
+            response = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class WorkerServer(socketserver.UnixStreamServer):
+    """Сервер заданий: задания выполняются последовательно."""
+
+    def __init__(self, socket_path: str, office: Office, job_timeout: int):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, JobHandler)
+        self.office = office
+        self.job_timeout = job_timeout
+
+    def process_job(self, job: dict) -> dict:
+        if not self.office.is_alive():
+            logger.warning("soffice is not responding, restarting")
+            self.office.restart()
+        if job.get("cmd") == "ping":
+            return {"ok": True}
+        if job.get("cmd") != "convert":
+            return {"ok": False, "error": "unknown command"}
+
+        result = {}
+
+        def convert():
+            try:
+                self.office.convert(job["src"], job["dst"])
+                result["ok"] = True
+            except Exception as e:
+                result["error"] = str(e)
+
+        thread = threading.Thread(target=convert, daemon=True)
+        thread.start()
+        thread.join(job.get("timeout") or self.job_timeout)
+        if thread.is_alive():
+            # зависшая конвертация: перезапуск soffice прерывает задание
+            logger.error(f"Conversion timeout for {job['src']}")
+            self.office.restart()
+            return {"ok": False, "error": "timeout"}
+        if not result.get("ok"):
+            return {"ok": False, "error": result.get("error", "failed")}
+        return {"ok": True}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--socket", required=True)
+    parser.add_argument("--profile", required=True)
+    parser.add_argument("--soffice", default="soffice")
+    parser.add_argument("--timeout", type=int, default=60)
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(name)-12s %(levelname)-8s %(message)s"
+    )
+    # при остановке пулом soffice завершается вместе с обработчиком
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    pipe_name = f"office_{os.getpid()}"
+    office = Office(args.soffice, args.profile, pipe_name)
+    office.start()
+    server = WorkerServer(args.socket, office, args.timeout)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        office.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Кэш сформированных файлов (docx, pdf) на диске.
+
+Ключ - хэш версии файла шаблона, режима генерации и нормализованного
+контекста, поэтому одинаковые запросы получают один и тот же файл, а
+изменение шаблона или значений полей даёт новый ключ. Кэш общий для всех
+процессов: запись атомарна (временный файл + os.replace), при превышении
+max_size удаляются давно не использованные файлы (время последнего
+использования - mtime файла).
+
+Размер кэша учитывается каждым процессом по своим записям; каталог
+обходится (пересчет размера с учетом записей других процессов и
+вытеснение) только при превышении max_size и не реже RESCAN_INTERVAL.
+"""
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Увеличивается при изменении генерации документов, чтобы не выдавать
+# файлы, сформированные прежней версией
+CACHE_FORMAT_VERSION = 1
+# После вытеснения кэш занимает не более этой доли max_size
+EVICTION_TARGET = 0.9
+# Максимальный интервал между обходами каталога кэша при записи, с
+RESCAN_INTERVAL = 60
+
+
+def make_key(
+    version: str,
+    mode: str,
+    context: Dict[str, Any],
+    context_default: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Ключ кэша. Контекст нормализуется: порядок ключей не важен, значения
+    приводятся к строкам так же, как при подстановке в шаблон.
+    """
+    data = json.dumps(
+        [
+            CACHE_FORMAT_VERSION,
+            version,
+            mode,
+            context,
+            context_default or {},
+        ],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def file_size(path: pathlib.Path) -> int:
+    """Размер файла, 0 - если файла нет."""
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+class RenderCache:
+    """Ограниченный по размеру кэш файлов с вытеснением LRU."""
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        # размер по последнему обходу каталога и записям процесса
+        self._size: Optional[int] = None
+        self._scanned = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.max_size > 0
+
+    def path(self, key: str, ext: str) -> pathlib.Path:
+        return pathlib.Path(self.directory) / key[:2] / f"{key}.{ext}"
+
+    def get(self, key: str, ext: str) -> Optional[pathlib.Path]:
+        """Путь к файлу из кэша или None."""
+        if not self.enabled:
+            return None
+        path = self.path(key, ext)
+        try:
+            # отметка использования для вытеснения LRU
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(
+        self, key: str, ext: str, content: bytes
+    ) -> Optional[pathlib.Path]:
+        """Сохранение файла в кэш."""
+        if not self.enabled:
+            return None
+        path = self.path(key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(content)
+            replaced = file_size(path)
+            os.replace(tmp_name, path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        self.added(len(content) - replaced)
+        return path
+
+    def put_file(
+        self, key: str, ext: str, source: pathlib.Path
+    ) -> Optional[pathlib.Path]:
+        """Перемещение готового файла в кэш (без чтения в память)."""
+        if not self.enabled:
+            return None
+        path = self.path(key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            # между файловыми системами файл копируется по частям
+            shutil.move(str(source), tmp_name)
+            size = file_size(pathlib.Path(tmp_name)) - file_size(path)
+            os.replace(tmp_name, path)
+        except BaseException:
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            raise
+        self.added(size)
+        return path
+
+    def get_or_create(
+        self, key: str, ext: str, factory: Callable[[], bytes]
+    ) -> bytes:
+        """Содержимое файла из кэша; при отсутствии - формирует и сохраняет."""
+        path = self.get(key, ext)
+        if path is not None:
+            try:
+                return path.read_bytes()
+            except FileNotFoundError:
+                # файл вытеснен другим процессом
+                pass
+        content = factory()
+        try:
+            self.put(key, ext, content)
+        except OSError:
+            logger.exception("Render cache write failed")
+        return content
+
+    def files(self):
+        root = pathlib.Path(self.directory)
+        if not root.is_dir():
+            return []
+        return [
+            path
+            for path in root.glob("*/*")
+            if path.is_file() and path.suffix != ".tmp"
+        ]
+
+    def added(self, size: int):
+        """Учет записи в кэш; при необходимости - обход и вытеснение."""
+        if self._size is not None:
+            self._size += size
+        if (
+            self._size is None
+            or self._size > self.max_size
+            or time.monotonic() - self._scanned > RESCAN_INTERVAL
+        ):
+            self.evict()
+
+    def evict(self):
+        """Удаление давно не использованных файлов сверх max_size."""
+        entries = []
+        total = 0
+        for path in self.files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if total > self.max_size:
+            target = self.max_size * EVICTION_TARGET
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+        self._size = total
+        self._scanned = time.monotonic()
+
+    def clear(self):
+        for path in self.files():
+            path.unlink(missing_ok=True)
+        self._size = 0
+
+    def info(self) -> Dict[str, int]:
+        count = size = 0
+        for path in self.files():
+            # файл мог быть вытеснен другим процессом после обхода
+            try:
+                size += path.stat().st_size
+            except FileNotFoundError:
+                continue
+            count += 1
+        return {"files": count, "size": size, "max_size": self.max_size}
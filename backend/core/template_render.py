@@ -1,22 +1,182 @@
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
 from io import BytesIO
-from typing import Any, Dict, Final, List, Tuple
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Final,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
 
 import docxtpl
 import jinja2
-import pymorphy2
 from docx import Document
 from docx.enum.text import WD_COLOR_INDEX
+from docx.oxml.ns import qn
 from docxtpl import DocxTemplate
 from num2words import num2words
 
-morph = pymorphy2.MorphAnalyzer()
+from .docx_package import read_members, save_docx
+from .fast_render import SWITCH_MARKER, FastTemplate, FastVariant, Switch
+
+logger = logging.getLogger(__name__)
+
+_morph = None
+_morph_lock = threading.Lock()
+
+
+def get_morph():
+    """
+    Возвращает морфологический анализатор pymorphy2.
+
+    Словари загружаются при первом вызове (первом применении фильтра
+    склонения), а не при импорте модуля. Для совместного использования
+    словарей процессами gunicorn см. gunicorn.conf.py (MORPH_PRELOAD).
+    """
+    global _morph
+    if _morph is None:
+        with _morph_lock:
+            if _morph is None:
+                import pymorphy2
+
+                start_time = time.perf_counter()
+                _morph = pymorphy2.MorphAnalyzer()
+                logger.info(
+                    "pymorphy2 dictionaries loaded in "
+                    f"{time.perf_counter() - start_time:.2f}s"
+                )
+    return _morph
+
+
+_MISSING: Final = object()
+
+
+class MorphCache:
+    """
+    Ограниченный по размеру LRU-кэш результатов склонения слов.
+
+    Ключ кэша - (слово, граммемы). Дополнительно может использоваться
+    постоянное хранилище (backend), общее для всех процессов сервера:
+    объект с методами get(word, grammemes) -> (found, result)
+    и set(word, grammemes, result).
+    """
+
+    def __init__(self, maxsize: int = 10000, backend=None):
+        self.maxsize = maxsize
+        self.backend = backend
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.backend_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def grammemes_key(grammemes: Iterable[str], source: str = None) -> str:
+        """
+        Строковое представление граммем для ключа кэша.
+
+        source - граммема, которая должна быть у исходной формы слова
+        (например 'nomn'), записывается в виде 'nomn>gent'.
+        """
+        key = ",".join(sorted(grammemes))
+        return f"{source}>{key}" if source else key
+
+    @staticmethod
+    def _inflect(word: str, grammemes: set, source: str = None):
+        """Склонение слова без использования кэша."""
+        parses = get_morph().parse(word)
+        if source:
+            parses = [p for p in parses if {source} in p.tag]
+        if not parses:
+            return None
+        inflected = parses[0].inflect(set(grammemes))
+        return inflected.word if inflected else None
+
+    def inflect(
+        self, word: str, grammemes: Iterable[str], source: str = None
+    ) -> Optional[str]:
+        """
+        Возвращает слово в форме с заданными граммемами или None,
+        если такую форму получить невозможно.
+        """
+        key = (word, self.grammemes_key(grammemes, source))
+        with self._lock:
+            result = self._items.get(key, _MISSING)
+            if result is not _MISSING:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+        found = False
+        if self.backend is not None:
+            try:
+                found, result = self.backend.get(*key)
+            except Exception:
+                logger.exception("Inflection backend read failed")
+        if found:
+            with self._lock:
+                self.backend_hits += 1
+        else:
+            result = self._inflect(word, grammemes, source)
+            if self.backend is not None:
+                try:
+                    self.backend.set(*key, result)
+                except Exception:
+                    logger.exception("Inflection backend write failed")
+        with self._lock:
+            self._items[key] = result
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        """Очищает кэш и сбрасывает счетчики."""
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = self.backend_hits = 0
+            self.evictions = 0
+
+    def info(self) -> Dict[str, Any]:
+        """Статистика использования кэша."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "backend_hits": self.backend_hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "size": len(self._items),
+                "maxsize": self.maxsize,
+                "persistent": self.backend is not None,
+            }
+
+
+# Кэш склонений, общий для всех фильтров процесса
+morph_cache = MorphCache()
 
 
 class CustomFilters:
     # Вспомогательные фильтры шаблонов
-    def __init__(self):
-        self._enabled = True
-        self._skip_filter_tags = set()
+    def __init__(self, enabled: bool = True, skip_filter_tags=()):
+        """
+        :param:
+        enabled - активны ли пользовательские фильтры
+        skip_filter_tags - значения, к которым фильтры не применяются
+        """
+        self._enabled = enabled
+        self._skip_filter_tags = frozenset(skip_filter_tags)
 
     def enable(self, enable_filters: bool):
         """Активирует/деактивирует все пользовательские фильтры класса"""
@@ -69,12 +229,11 @@ class CustomFilters:
         """
         if not word:
             return word
-        try:
-            p = next(filter(lambda x: {"nomn"} in x.tag, morph.parse(word)))
-        except StopIteration:
+        inflected = morph_cache.inflect(word, {case}, source="nomn")
+        if inflected is None:
             print("Not found nomn form for ", word)
             return word
-        return p.inflect({case}).word
+        return inflected
 
     def inflect_words(self, words: str, case: str) -> str:
         """Преобразование каждого из слов в строке в заданный падеж
@@ -124,19 +283,14 @@ class CustomFilters:
         except Exception:
             return word
 
-        word = morph.parse(word)[0]
-        words = (
-            word.inflect({"sing", "nomn"}).word,  # 'день'
-            word.inflect({"gent"}).word,  # 'дня'
-            word.inflect({"plur", "gent"}).word,  # 'дней'
-        )
-
         n_mod100 = n % 100
         if n % 10 == 1 and n_mod100 != 11:
-            return words[0]
+            grammemes = {"sing", "nomn"}  # 'день'
         elif 2 <= n % 10 <= 4 and (n_mod100 < 10 or n_mod100 >= 20):
-            return words[1]
-        return words[2]
+            grammemes = {"gent"}  # 'дня'
+        else:
+            grammemes = {"plur", "gent"}  # 'дней'
+        return morph_cache.inflect(word, grammemes) or word
 
     def adj_plural(self, word: str, n: int) -> str:
         """Склонение заданного слова (прилагательное) в зависимости от числа n."""
@@ -147,11 +301,12 @@ class CustomFilters:
             number = int(n)
         except Exception:
             return word
-        word = morph.parse(word)[0]
         number_mod100 = number % 100
         if number % 10 == 1 and number_mod100 != 11:
-            return word.inflect({"sing", "nomn"}).word  # 'новый'
-        return word.inflect({"plur", "gent"}).word  # 'новых'
+            grammemes = {"sing", "nomn"}  # 'новый'
+        else:
+            grammemes = {"plur", "gent"}  # 'новых'
+        return morph_cache.inflect(word, grammemes) or word
 
     def currency_to_words(self, num) -> str:
         """Преобразует заданную сумму в представление прописью."""
@@ -197,37 +352,416 @@ class CustomFilters:
         return filters
 
 
+def create_jinja_env(customfilters: CustomFilters) -> jinja2.Environment:
+    """Создает окружение jinja2 с заданным набором пользовательских фильтров"""
+    jinja_env = jinja2.Environment()
+    jinja_env.filters.update(customfilters.get_filters())
+    return jinja_env
+
+
+# Окружение только для разбора шаблонов (поиск тэгов), не для рендеринга
+_parse_jinja_env = create_jinja_env(CustomFilters())
+
+
+# Предопределенное наименование стиля для всех тэгов(переменных) в шаблоне
+TAG_STYLE_NAME: Final = "TemplateTag"
+
+
+def read_template_source(template_file) -> bytes:
+    """Читает содержимое файла шаблона (путь, FieldFile или поток)."""
+    if isinstance(template_file, (str, os.PathLike)):
+        with open(template_file, "rb") as f:
+            return f.read()
+    if hasattr(template_file, "open"):
+        with template_file.open("rb") as f:
+            return f.read()
+    template_file.seek(0)
+    return template_file.read()
+
+
+def docx_paragraphs(docx: Document):
+    """Генератор по всем параграфам документа"""
+    for p in docx.paragraphs:
+        yield p
+    for table in docx.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for p in cell.paragraphs:
+                    yield p
+
+
+def docx_runs(docx: Document):
+    """Генератор по всем прогонам (run) документа"""
+    for p in docx_paragraphs(docx):
+        for r in p.runs:
+            yield r
+
+
+def combine_styled_tag_runs(tag_style, runs):
+    """Объединяет последовательные прогоны стиля tag_style в один."""
+    start_run = None
+    for r in runs:
+        if r.style == tag_style:
+            if start_run:
+                start_run.text += r.text
+                r.clear()
+            else:
+                start_run = r
+        else:
+            start_run = None
+
+
+def get_tag_style(docx: Document):
+    """Возвращает стиль тэгов шаблона или None, если стиль не задан."""
+    try:
+        return docx.styles[TAG_STYLE_NAME]
+    except KeyError:
+        return None
+
+
+def normalize_tag_runs(docx: Document):
+    """
+    Нормализация прогонов с тэгами: последовательные прогоны стиля тэгов
+    объединяются в один, опустевшие после объединения прогоны удаляются.
+    """
+    tag_style = get_tag_style(docx)
+    if tag_style is None:
+        return
+    runs = list(docx_runs(docx))
+    combine_styled_tag_runs(tag_style, runs)
+    for r in runs:
+        if r.style == tag_style and not r.text:
+            # в прогоне остались только свойства (w:rPr)
+            if all(child.tag.endswith("}rPr") for child in r._r):
+                r._r.getparent().remove(r._r)
+
+
+def prepare_template(template_file) -> Tuple[bytes, List[str]]:
+    """
+    Подготовка шаблона к использованию (выполняется при загрузке шаблона).
+
+    :returns: (content, tags)
+    content - содержимое подготовленного файла docx
+    tags - отсортированный список тэгов шаблона
+    """
+    compiled = CompiledTemplate(template_file, fast=False)
+    file_stream = BytesIO()
+    compiled.clone().docx.save(file_stream)
+    return file_stream.getvalue(), sorted(compiled.get_tags())
+
+
+class CompiledTemplate:
+    """
+    Разобранный и предобработанный шаблон docx.
+
+    Экземпляр не изменяется при рендеринге: каждый рендеринг работает
+    с собственной копией документа, полученной методом clone().
+
+    :param:
+    template_file - файл шаблона (путь, FieldFile или поток)
+    prepared - файл уже подготовлен функцией prepare_template
+    tags - известный заранее список тэгов шаблона
+    fast - использовать быстрый рендеринг, если шаблон простой
+    (см. core.fast_render)
+    """
+
+    def __init__(
+        self,
+        template_file,
+        prepared: bool = False,
+        tags=None,
+        fast: bool = True,
+    ):
+        self.source = read_template_source(template_file)
+        self.members = read_members(self.source)
+        self.prepared = prepared
+        self._docx = Document(BytesIO(self.source))
+        if not prepared:
+            normalize_tag_runs(self._docx)
+        self._tags = frozenset(tags) if tags is not None else None
+        self.has_tag_style = get_tag_style(self._docx) is not None
+        self.fast = (
+            FastTemplate.create(self.clone(), _parse_jinja_env, self.members)
+            if fast
+            else None
+        )
+
+    def clone(self) -> DocxTemplate:
+        """Возвращает копию шаблона docxtpl, готовую к рендерингу."""
+        template = docxtpl.DocxTemplate(BytesIO(self.source))
+        template.docx = copy.deepcopy(self._docx)
+        return template
+
+    def get_tags(self) -> set:
+        """Возвращает множество тэгов шаблона (вычисляется однократно)."""
+        if self._tags is None:
+            self._tags = frozenset(
+                self.clone().get_undeclared_template_variables(
+                    jinja_env=_parse_jinja_env
+                )
+            )
+        return set(self._tags)
+
+    def get_fast_variant(self, draft: bool) -> Optional[FastVariant]:
+        """
+        Вариант быстрого рендеринга: для эскиза или для документа
+        (с переключаемой подсветкой незаполненных полей).
+        None - если шаблон не может быть отрендерен быстрым способом.
+        """
+        if self.fast is None:
+            return None
+        return self.fast.get_variant(
+            RenderMode.DRAFT if draft else RenderMode.DOCUMENT,
+            lambda: self._fast_variant_template(draft),
+        )
+
+    def _fast_variant_template(self, draft: bool):
+        template = self.clone()
+        if draft:
+            markdown_tag(template.docx, WD_COLOR_INDEX.YELLOW, "{{")
+            markdown_tag(template.docx, WD_COLOR_INDEX.YELLOW, "}}")
+            return template, []
+        if not self.has_tag_style:
+            return template, []
+        return template, highlight_switches(template.docx)
+
+
+class TemplateCache:
+    """
+    Ограниченный по размеру LRU-кэш разобранных шаблонов.
+
+    Ключ кэша - идентификатор шаблона, для каждого шаблона хранится
+    только одна версия, определяемая отпечатком (fingerprint) файла.
+    При изменении отпечатка закэшированная версия заменяется новой.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(
+        self,
+        template_id: Hashable,
+        fingerprint: Hashable,
+        loader: Callable[[], CompiledTemplate],
+    ) -> CompiledTemplate:
+        """Возвращает шаблон из кэша, при отсутствии загружает его loader."""
+        with self._lock:
+            item = self._items.get(template_id)
+            if item is not None and item[0] == fingerprint:
+                self._items.move_to_end(template_id)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+        compiled = loader()
+        with self._lock:
+            self._items[template_id] = (fingerprint, compiled)
+            self._items.move_to_end(template_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        return compiled
+
+    def invalidate(self, template_id: Hashable):
+        """Удаляет шаблон из кэша."""
+        with self._lock:
+            self._items.pop(template_id, None)
+
+    def clear(self):
+        """Очищает кэш и сбрасывает счетчики."""
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self) -> Dict[str, int]:
+        """Статистика использования кэша."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._items),
+                "maxsize": self.maxsize,
+            }
+
+
+class RenderMode:
+    """Режимы генерации документа из шаблона"""
+
+    # документ, заполненный значениями полей
+    DOCUMENT: Final = "document"
+    # эскиз: тэги заменяются наименованиями полей, фильтры отключены
+    DRAFT: Final = "draft"
+    # частично заполненный документ, незаполненные поля подсвечиваются
+    PARTIAL: Final = "partial"
+
+
+def markdown_tag(docx: Document, color, tag: str = "{{"):
+    """
+    Подсветка заданного тега в документе при помощи заданного цвета.
+    """
+    for r in docx_runs(docx):
+        if tag in r.text:
+            r.font.highlight_color = color
+
+
+def markdown_given_tags(
+    docx: Document, tags: List[str], color=WD_COLOR_INDEX.YELLOW
+):
+    """
+    Подсветка полей с тегом из списка при помощи заданного цвета.
+    """
+
+    def markdown_tag_begin(i, runs):
+        while i >= 0:
+            if "{{" in runs[i].text:
+                runs[i].font.highlight_color = color
+                return
+            i -= 1
+
+    tags_set = set(tags)
+    tag_style = docx.styles[TAG_STYLE_NAME]
+    # прогоны с тэгами объединены при разборе шаблона (CompiledTemplate)
+    runs = list(docx_runs(docx))
+    for i, r in enumerate(runs):
+        if r.style == tag_style and r.text in tags_set:
+            markdown_tag_begin(i, runs)
+
+
+def highlight_switches(
+    docx: Document, color=WD_COLOR_INDEX.YELLOW
+) -> List[Switch]:
+    """
+    Переключатели подсветки полей для быстрого рендеринга.
+
+    Для каждого прогона, который подсвечивает markdown_given_tags,
+    в документ вносится подсветка с маркером вместо цвета; переключатель
+    включается, если незаполнен любой из тэгов, подсвечивающих прогон.
+    """
+    tag_style = docx.styles[TAG_STYLE_NAME]
+    # прогон, подсвечиваемый для тэга (см. markdown_tag_begin); прогоны
+    # объединенных ячеек таблиц встречаются в docx_runs несколько раз
+    targets: Dict[Any, set] = {}
+    begin = None
+    for r in docx_runs(docx):
+        if "{{" in r.text:
+            begin = r._r
+        if r.style == tag_style and begin is not None:
+            targets.setdefault(begin, set()).add(r.text)
+
+    color = WD_COLOR_INDEX.to_xml(color)
+    switches = []
+    for r, tags in targets.items():
+        rpr_exists = r.rPr is not None
+        rpr = r.get_or_add_rPr()
+        highlight = rpr.highlight
+        marker = SWITCH_MARKER.format(len(switches))
+        if highlight is not None:
+            search, on = marker, color
+            off = highlight.get(qn("w:val"))
+        else:
+            highlight = rpr.get_or_add_highlight()
+            search = f'<w:highlight w:val="{marker}"/>'
+            if not rpr_exists:
+                search = f"<w:rPr>{search}</w:rPr>"
+            on, off = search.replace(marker, color), ""
+        highlight.set(qn("w:val"), marker)
+        switches.append(Switch(search, on, off, frozenset(tags)))
+    return switches
+
+
+def render_template(
+    compiled: CompiledTemplate,
+    context: Dict[str, str],
+    context_default: Dict[str, str] = None,
+    mode: str = RenderMode.DOCUMENT,
+) -> bytes:
+    """
+    Генерирует документ по разобранному шаблону и возвращает его содержимое.
+
+    Функция не изменяет ни шаблон, ни переданные контексты: все состояние
+    рендеринга (копия документа, фильтры, окружение jinja2) создается
+    на время вызова, поэтому один шаблон можно использовать
+    одновременно из нескольких потоков.
+
+    Простые шаблоны рендерятся быстрым способом (core.fast_render),
+    результат совпадает с результатом docxtpl.
+
+    :param:
+    compiled - разобранный шаблон
+    context - словарь вида {field.tag: field.value}
+    context_default - словарь значений по умолчанию {field.tag: field.name},
+    используется в режиме RenderMode.PARTIAL
+    mode - режим генерации (RenderMode)
+    """
+    context = dict(context)
+    partial = mode == RenderMode.PARTIAL and bool(context_default)
+    default_tags = set()
+    if mode == RenderMode.DRAFT:
+        customfilters = CustomFilters(enabled=False)
+    elif partial:
+        non_filled_tags = compiled.get_tags() - context.keys()
+        default_tags = non_filled_tags & context_default.keys()
+        for tag in default_tags:
+            context[tag] = context_default[tag]
+        customfilters = CustomFilters(
+            skip_filter_tags={context_default[tag] for tag in default_tags}
+        )
+    else:
+        customfilters = CustomFilters()
+    jinja_env = create_jinja_env(customfilters)
+
+    # без стиля тэгов подсветка полей невозможна (см. markdown_given_tags)
+    if not partial or compiled.has_tag_style:
+        variant = compiled.get_fast_variant(mode == RenderMode.DRAFT)
+        if variant is not None:
+            content = variant.render(context, jinja_env, default_tags)
+            if content is not None:
+                return content
+
+    template = compiled.clone()
+    if mode == RenderMode.DRAFT:
+        markdown_tag(template.docx, WD_COLOR_INDEX.YELLOW, "{{")
+        markdown_tag(template.docx, WD_COLOR_INDEX.YELLOW, "}}")
+    elif partial:
+        markdown_given_tags(template.docx, default_tags)
+    template.render(context, jinja_env=jinja_env)
+    return save_docx(template, compiled.members)
+
+
 class DocumentTemplate:
-    # Предопределенное наименование стиля для всех тэгов(переменных) в шаблоне
-    TAG_STYLE_NAME: Final = "TemplateTag"
+    """
+    Генератор документов по шаблону docx.
+
+    Не хранит состояния рендеринга: каждый вызов get_* работает
+    с собственной копией разобранного шаблона (см. render_template).
+    """
+
+    TAG_STYLE_NAME: Final = TAG_STYLE_NAME
 
-    def __init__(self, template_file_name: str):
+    def __init__(
+        self, template_file_name, compiled: CompiledTemplate = None
+    ):
         self._tempalte_file_name = template_file_name
-        self._template: DocxTemplate = docxtpl.DocxTemplate(template_file_name)
-        self._jinja_env = jinja2.Environment()
-        self._customfilters = CustomFilters()
-        self._jinja_env.filters.update(self._customfilters.get_filters())
+        if compiled is None:
+            compiled = CompiledTemplate(template_file_name)
+        self._compiled = compiled
 
     def get_document(self, context: Dict[str, str]) -> BytesIO:
         """Генерирует и возвращает документ согласно заданному контексту"""
-        self._customfilters.enable(True)  # switch custom filters on
-        self._customfilters._skip_filter_tags.clear()
-        self._template.render(context, jinja_env=self._jinja_env)
-        file_stream = BytesIO()
-        self._template.save(file_stream)
-        file_stream.seek(0)
-        return file_stream
+        return BytesIO(
+            render_template(self._compiled, context, mode=RenderMode.DOCUMENT)
+        )
 
     def get_draft(self, context: Dict[str, str]) -> BytesIO:
         """Генерирует и возвращает эскиз документа согласно контексту"""
-        self._customfilters.enable(False)  # switch custom filters off
-        self.markdown_tags()
-        self._template.render(context, jinja_env=self._jinja_env)
-        self._customfilters.enable(True)  # switch custom filters on
-        file_stream = BytesIO()
-        self._template.save(file_stream)
-        file_stream.seek(0)
-        return file_stream
+        return BytesIO(
+            render_template(self._compiled, context, mode=RenderMode.DRAFT)
+        )
 
     def get_partial(
         self, context: Dict[str, str], context_default: Dict[str, str] = None
@@ -240,108 +774,29 @@ class DocumentTemplate:
         context_default - словарь значений по умолчанию {field.tag: field.name}
         если тэг не найден ни в одном из контекстов, то заменяется на ''
         """
-        self._template.init_docx()
-        non_filled_tags = self.get_tags() - context.keys()
-        default_tags = set()
-        if context_default:
-            default_tags = non_filled_tags & context_default.keys()
-            self._markdown_given_tags(self._template.docx, default_tags)
-            for tag in default_tags:
-                self._customfilters._skip_filter_tags.add(context_default[tag])
-                context[tag] = context_default[tag]
-        # замена полей из context
-        self._customfilters.enable(True)
-        self._template.render(context, jinja_env=self._jinja_env)
-        file_stream = BytesIO()
-        self._template.save(file_stream)
-        file_stream.seek(0)
-        return file_stream
-
-    def save(self, result_file_name):
-        self._template.save(result_file_name)
+        return BytesIO(
+            render_template(
+                self._compiled, context, context_default, RenderMode.PARTIAL
+            )
+        )
 
     def get_tags(self) -> List[str]:
         """Ищет и возвращает список тэгов подстановок переменных из шаблона"""
-        return self._template.get_undeclared_template_variables(
-            jinja_env=self._jinja_env
-        )
-
-    def markdown_tags(self, color=WD_COLOR_INDEX.YELLOW):
-        """Размечает места тэгов заданным цветом."""
-        self._template.init_docx()
-        self._markdown_tag(self._template.docx, color, "{{")
-        self._markdown_tag(self._template.docx, color, "}}")
-        # self._template.is_rendered = True
-
-    def _docx_paragraphs(self, docx: Document):
-        """Генератор по всем параграфам документа"""
-        for p in docx.paragraphs:
-            yield p
-        for table in docx.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for p in cell.paragraphs:
-                        yield p
-
-    def _docx_runs(self, docx: Document):
-        """Генератор по всем прогонам (run) документа"""
-        for p in self._docx_paragraphs(docx):
-            for r in p.runs:
-                yield r
-
-    def _combine_styled_tag_runs(self, tag_style, runs):
-        """Объединяет последовательные прогоны стиля tag_style в один."""
-        start_run = None
-        for r in runs:
-            if r.style == tag_style:
-                if start_run:
-                    start_run.text += r.text
-                    r.clear()
-                else:
-                    start_run = r
-            else:
-                start_run = None
+        return self._compiled.get_tags()
 
     def prepare_template(self):
         """Подготовка шаблона к использованию (объединение прогонов)"""
-        self._template.init_docx()
-        docx = self._template.docx
-        tag_style = docx.styles[self.TAG_STYLE_NAME]
+        docx = self._compiled.clone().docx
         self._print_document_runs(docx)
-        runs = list(self._docx_runs(docx))
-        # Объединение последовательных прогонов с тэгами в один
-        self._combine_styled_tag_runs(tag_style, runs)
+        # прогоны с тэгами объединены при разборе шаблона (CompiledTemplate)
         docx.save(self._tempalte_file_name)
 
-    def _markdown_given_tags(
-        self, docx: Document, tags: List[str], color=WD_COLOR_INDEX.YELLOW
-    ):
-        """
-        Подсветка полей с тегом из списка при помощи заданного цвета.
-        """
-
-        def markdown_tag_begin(i, runs):
-            while i >= 0:
-                if "{{" in runs[i].text:
-                    runs[i].font.highlight_color = color
-                    return
-                i -= 1
-
-        tags_set = set(tags)
-        tag_style = docx.styles[self.TAG_STYLE_NAME]
-        runs = list(self._docx_runs(docx))
-        # TODO: подготовка шаблона должна быть выполнена при загрузке шаблона в базу
-        self._combine_styled_tag_runs(tag_style, runs)
-        for i, r in enumerate(runs):
-            if r.style == tag_style and r.text in tags_set:
-                markdown_tag_begin(i, runs)
-
     def _print_document_runs(self, docx: Document):
         """
         Для исследования документа и печати всех его run.
         """
         invalid_runs = []
-        for p in self._docx_paragraphs(docx):
+        for p in docx_paragraphs(docx):
             print(f"p=<{p.text}>")
             for r in p.runs:
                 print(f"r=<{r.text}>")
@@ -352,14 +807,6 @@ class DocumentTemplate:
         if invalid_runs:
             print("Invalid runs: ", invalid_runs)
 
-    def _markdown_tag(self, docx: Document, color, tag: str = "{{"):
-        """
-        Подсветка заданного тега в документе при помощи заданного цвета.
-        """
-        for r in self._docx_runs(docx):
-            if tag in r.text:
-                r.font.highlight_color = color
-
 
 if __name__ == "__main__":
     pass
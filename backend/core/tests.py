@@ -1,5 +1,41 @@
+import json
+import multiprocessing
+import os
+import pathlib
+import shutil
+import socketserver
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from unittest import mock
+
+from django.conf import settings
+from django.db import connection
 from django.test import TestCase
-from core.template_render import CustomFilters
+from docx import Document
+from core import docx_package
+from core.batch_render import render_many
+from core.models import DatabaseInflectionBackend
+from core.office_pool import (
+    ConversionError,
+    OfficePoolUnavailable,
+    convert_to_pdf,
+)
+from core.render_cache import RenderCache, make_key
+from core.template_render import (
+    CompiledTemplate,
+    CustomFilters,
+    DocumentTemplate,
+    MorphCache,
+    RenderMode,
+    TemplateCache,
+    create_jinja_env,
+    get_morph,
+    prepare_template,
+    render_template,
+)
 
 fiom_fixture = "иванов иван петрович"
 fiom_results = {
@@ -172,3 +208,432 @@ class Test(TestCase):
                     result,
                     "Filter split returns unexpected result",
                 )
+
+
+template_fixture = (
+    settings.INITIAL_DATA_DIR / "детский_сад" / "заявление_детсад_tpl.docx"
+)
+
+
+def document_xml(content: bytes) -> bytes:
+    """Возвращает содержимое word/document.xml из docx файла"""
+    with zipfile.ZipFile(BytesIO(content)) as docx:
+        return docx.read("word/document.xml")
+
+
+class TemplateCacheTest(TestCase):
+    def test_hits_and_misses(self):
+        """Проверка счетчиков попаданий/промахов кэша шаблонов"""
+        cache = TemplateCache(maxsize=2)
+        first = cache.get(1, "v1", object)
+        self.assertIs(cache.get(1, "v1", object), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_fingerprint_change_reloads_template(self):
+        """Проверка, что изменение отпечатка файла приводит к перезагрузке"""
+        cache = TemplateCache(maxsize=2)
+        first = cache.get(1, "v1", object)
+        second = cache.get(1, "v2", object)
+        self.assertIsNot(first, second)
+        self.assertEqual(cache.info()["size"], 1)
+
+    def test_eviction(self):
+        """Проверка вытеснения давно не используемых шаблонов"""
+        cache = TemplateCache(maxsize=2)
+        cache.get(1, "v1", object)
+        cache.get(2, "v1", object)
+        cache.get(1, "v1", object)
+        cache.get(3, "v1", object)
+        self.assertEqual(cache.evictions, 1)
+        cache.get(1, "v1", object)
+        self.assertEqual(cache.hits, 2)
+        cache.invalidate(1)
+        cache.get(1, "v1", object)
+        self.assertEqual(cache.misses, 4)
+
+    def test_render_does_not_modify_compiled_template(self):
+        """Проверка, что рендеринг не изменяет закэшированный шаблон"""
+        compiled = CompiledTemplate(str(template_fixture))
+        tags = DocumentTemplate(None, compiled).get_tags()
+        context = {tag: "значение" for tag in tags}
+        first = DocumentTemplate(None, compiled).get_document(context)
+        second = DocumentTemplate(None, compiled).get_partial({}, context)
+        self.assertTrue(first.getvalue())
+        self.assertTrue(second.getvalue())
+        self.assertEqual(DocumentTemplate(None, compiled).get_tags(), tags)
+
+
+class RenderTemplateTest(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.compiled = CompiledTemplate(str(template_fixture))
+        cls.tags = cls.compiled.get_tags()
+
+    def test_skip_filter_tags_are_per_call(self):
+        """Проверка, что параметры фильтров задаются для каждого вызова"""
+        self.assertEqual(
+            CustomFilters(skip_filter_tags={fiom_fixture}).genitive(
+                fiom_fixture
+            ),
+            fiom_fixture,
+        )
+        self.assertEqual(
+            CustomFilters().genitive(fiom_fixture), fiom_results["genitive"]
+        )
+        self.assertEqual(
+            CustomFilters(enabled=False).genitive(fiom_fixture), fiom_fixture
+        )
+
+    def test_render_does_not_modify_context(self):
+        """Проверка, что рендеринг не изменяет переданные контексты"""
+        context = {}
+        context_default = {tag: tag for tag in self.tags}
+        render_template(
+            self.compiled, context, context_default, RenderMode.PARTIAL
+        )
+        self.assertEqual(context, {})
+
+    def test_concurrent_render(self):
+        """Проверка одновременного рендеринга одного шаблона из потоков"""
+        contexts = [
+            {tag: f"значение {i}" for tag in self.tags} for i in range(8)
+        ]
+        expected = [
+            render_template(self.compiled, context) for context in contexts
+        ]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(
+                executor.map(
+                    lambda context: render_template(self.compiled, context),
+                    contexts,
+                )
+            )
+        for result, content in zip(results, expected):
+            self.assertEqual(
+                document_xml(result),
+                document_xml(content),
+                "Результаты рендеринга различны",
+            )
+
+    def test_render_many_in_process_pool(self):
+        """Проверка пакетного рендеринга в пуле процессов"""
+        contexts = [
+            {tag: f"значение {i}" for tag in self.tags} for i in range(5)
+        ]
+        # запись, которую невозможно передать в процесс пула
+        contexts.append({"tag": lambda: None})
+        results = list(render_many(self.compiled, contexts, processes=2))
+        self.assertEqual(len(results), len(contexts))
+        for context, result in zip(contexts[:-1], results):
+            self.assertEqual(
+                document_xml(result),
+                document_xml(render_template(self.compiled, context)),
+            )
+        self.assertIsInstance(results[-1], Exception)
+
+
+def has_inherited_connection() -> bool:
+    """Использует ли процесс пула соединение с БД родительского процесса."""
+    return connection.connection is not None
+
+
+class MorphCacheTest(TestCase):
+    def test_hits_and_misses(self):
+        """Проверка счетчиков кэша склонений"""
+        cache = MorphCache(maxsize=10)
+        self.assertEqual(cache.inflect("день", {"gent"}), "дня")
+        self.assertEqual(cache.inflect("день", {"gent"}), "дня")
+        self.assertEqual(cache.inflect("иван", {"datv"}, "nomn"), "ивану")
+        info = cache.info()
+        self.assertEqual((info["hits"], info["misses"]), (1, 2))
+        self.assertEqual(info["hit_rate"], 1 / 3)
+
+    def test_morph_analyzer_is_shared(self):
+        """Проверка, что анализатор pymorphy2 загружается один раз"""
+        self.assertIs(get_morph(), get_morph())
+
+    def test_eviction(self):
+        """Проверка ограничения размера кэша склонений"""
+        cache = MorphCache(maxsize=2)
+        for case in ("gent", "datv", "ablt"):
+            cache.inflect("день", {case})
+        self.assertEqual(cache.info()["size"], 2)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_database_backend(self):
+        """Проверка общего хранилища склонений в БД"""
+        cache = MorphCache(backend=DatabaseInflectionBackend())
+        self.assertEqual(cache.inflect("день", {"plur", "gent"}), "дней")
+        other = MorphCache(backend=DatabaseInflectionBackend())
+        self.assertEqual(other.inflect("день", {"plur", "gent"}), "дней")
+        self.assertEqual(other.backend_hits, 1)
+
+    def test_database_backend_after_fork(self):
+        """Проверка, что процесс пула открывает собственное соединение с БД"""
+        connection.ensure_connection()
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("fork")
+        ) as pool:
+            self.assertFalse(pool.submit(has_inherited_connection).result())
+        # соединение родительского процесса остается рабочим
+        self.assertEqual(
+            DatabaseInflectionBackend().get("день", "gent"), (False, None)
+        )
+
+
+class FakeOfficeWorker(socketserver.StreamRequestHandler):
+    """Обработчик пула без LibreOffice: "конвертация" - копирование."""
+
+    def handle(self):
+        job = json.loads(self.rfile.readline())
+        self.server.jobs.append(job)
+        if job["src"].endswith("broken.docx"):
+            response = {"ok": False, "error": "timeout"}
+        else:
+            shutil.copyfile(job["src"], job["dst"])
+            response = {"ok": True}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class OfficePoolClientTest(TestCase):
+    def setUp(self):
+        self.pool_dir = pathlib.Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.pool_dir)
+        self.server = socketserver.ThreadingUnixStreamServer(
+            str(self.pool_dir / "slot0.sock"), FakeOfficeWorker
+        )
+        self.server.jobs = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_convert_through_pool(self):
+        src = self.pool_dir / "document.docx"
+        src.write_bytes(b"docx")
+        dst = src.with_suffix(".pdf")
+        convert_to_pdf(src, dst, self.pool_dir, timeout=5)
+        self.assertEqual(dst.read_bytes(), b"docx")
+        self.assertEqual(self.server.jobs[0]["timeout"], 5)
+
+    def test_worker_error(self):
+        src = self.pool_dir / "broken.docx"
+        src.write_bytes(b"docx")
+        with self.assertRaisesMessage(ConversionError, "timeout"):
+            convert_to_pdf(src, src.with_suffix(".pdf"), self.pool_dir, 5)
+
+    def test_pool_not_running(self):
+        empty_dir = self.pool_dir / "empty"
+        empty_dir.mkdir()
+        with self.assertRaises(OfficePoolUnavailable):
+            convert_to_pdf(
+                self.pool_dir / "a.docx", self.pool_dir / "a.pdf", empty_dir, 5
+            )
+
+
+class RenderCacheTest(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache = RenderCache(directory, max_size=1000)
+
+    def test_key_does_not_depend_on_context_order(self):
+        self.assertEqual(
+            make_key("v1", "partial", {"a": "1", "b": "2"}),
+            make_key("v1", "partial", {"b": "2", "a": "1"}),
+        )
+        self.assertNotEqual(
+            make_key("v1", "partial", {"a": "1"}),
+            make_key("v2", "partial", {"a": "1"}),
+        )
+        self.assertNotEqual(
+            make_key("v1", "partial", {"a": "1"}),
+            make_key("v1", "document", {"a": "1"}),
+        )
+
+    def test_get_or_create(self):
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return b"content"
+
+        for _ in range(2):
+            content = self.cache.get_or_create("ab12", "pdf", factory)
+            self.assertEqual(content, b"content")
+        self.assertEqual(len(calls), 1)
+        directory = pathlib.Path(self.cache.directory)
+        self.assertEqual(list(directory.glob("*/*.tmp")), [])
+
+    def test_least_recently_used_files_are_evicted(self):
+        for i, key in enumerate(("aa", "bb", "cc")):
+            path = self.cache.put(key, "pdf", b"x" * 400)
+            os.utime(path, (i, i))
+        # кэш переполнен третьим файлом, первый - самый старый
+        self.assertIsNone(self.cache.get("aa", "pdf"))
+        self.assertIsNotNone(self.cache.get("bb", "pdf"))
+        self.assertLessEqual(self.cache.info()["size"], 1000)
+
+    def test_directory_is_scanned_only_when_full(self):
+        """Проверка, что запись в кэш не обходит каталог до переполнения"""
+        with mock.patch.object(
+            self.cache, "files", wraps=self.cache.files
+        ) as files:
+            for key in ("aa", "bb", "cc", "aa"):
+                self.cache.put(key, "pdf", b"x" * 300)
+            # первая запись - обход для начального размера, четвертая
+            # перезаписывает файл: размер не меняется
+            self.assertEqual(files.call_count, 1)
+            self.cache.put("dd", "pdf", b"x" * 300)
+            self.assertEqual(files.call_count, 2)
+        self.assertLessEqual(self.cache.info()["size"], 1000)
+
+    def test_info_skips_evicted_files(self):
+        """Проверка статистики, если файл вытеснен после обхода каталога"""
+        self.cache.put("aa", "pdf", b"x" * 100)
+        self.cache.put("bb", "pdf", b"x" * 200)
+        files = self.cache.files()
+        files[0].unlink()
+        with mock.patch.object(self.cache, "files", return_value=files):
+            info = self.cache.info()
+        self.assertEqual(info["files"], 1)
+        self.assertEqual(info["size"], files[1].stat().st_size)
+
+    def test_put_file(self):
+        source = pathlib.Path(tempfile.mkdtemp()) / "document.pdf"
+        self.addCleanup(shutil.rmtree, source.parent)
+        source.write_bytes(b"content")
+        path = self.cache.put_file("ab12", "pdf", source)
+        self.assertFalse(source.exists())
+        self.assertEqual(self.cache.get("ab12", "pdf"), path)
+        self.assertEqual(path.read_bytes(), b"content")
+
+    def test_disabled_cache(self):
+        cache = RenderCache("", max_size=1000)
+        self.assertIsNone(cache.put("aa", "pdf", b"x"))
+        self.assertEqual(cache.get_or_create("aa", "pdf", lambda: b"y"), b"y")
+
+
+def docx_members(content: bytes) -> list:
+    """Имена и содержимое файлов архива docx в порядке записи"""
+    with zipfile.ZipFile(BytesIO(content)) as docx:
+        return [(name, docx.read(name)) for name in docx.namelist()]
+
+
+class FastRenderTest(TestCase):
+    @staticmethod
+    def compile(path):
+        source, tags = prepare_template(str(path))
+        fast = CompiledTemplate(BytesIO(source), prepared=True, tags=tags)
+        docxtpl = CompiledTemplate(
+            BytesIO(source), prepared=True, tags=tags, fast=False
+        )
+        return fast, docxtpl, tags
+
+    def test_matches_docxtpl(self):
+        """Проверка, что быстрый рендеринг совпадает с docxtpl побайтно"""
+        for path in sorted(settings.INITIAL_DATA_DIR.rglob("*_tpl.docx")):
+            fields = json.loads(path.with_suffix(".json").read_text())
+            context_default = {
+                field["tag"]: field["name"] for field in fields["fields"]
+            }
+            fast, docxtpl, tags = self.compile(path)
+            cases = (
+                (
+                    {tag: f'{tag} > "{i}"' for i, tag in enumerate(tags)},
+                    None,
+                    RenderMode.DOCUMENT,
+                ),
+                (
+                    {tag: fiom_fixture for tag in tags[::2]},
+                    context_default,
+                    RenderMode.PARTIAL,
+                ),
+                ({tag: "" for tag in tags[1::2]}, None, RenderMode.DOCUMENT),
+                (context_default, None, RenderMode.DRAFT),
+            )
+            for context, default, mode in cases:
+                with self.subTest(template=path.name, mode=mode):
+                    self.assertEqual(
+                        docx_members(
+                            render_template(fast, context, default, mode)
+                        ),
+                        docx_members(
+                            render_template(docxtpl, context, default, mode)
+                        ),
+                    )
+
+    def test_template_with_blocks_is_not_simple(self):
+        """Проверка, что шаблоны с блоками {% %} рендерит docxtpl"""
+        path = (
+            settings.INITIAL_DATA_DIR
+            / "договор_найма_жилого_помещения_tpl.docx"
+        )
+        fast, _, _ = self.compile(path)
+        self.assertIsNone(fast.fast)
+        self.assertIsNotNone(CompiledTemplate(str(template_fixture)).fast)
+
+    def test_unsafe_values_fall_back_to_docxtpl(self):
+        """Проверка рендеринга значений с разметкой и переводами строк"""
+        fast, docxtpl, tags = self.compile(template_fixture)
+        for value in ("ООО <Ромашка> & Co", "строка 1\nстрока 2"):
+            context = {tag: value for tag in tags}
+            variant = fast.get_fast_variant(draft=False)
+            self.assertIsNone(
+                variant.render(context, create_jinja_env(CustomFilters()))
+            )
+            self.assertEqual(
+                docx_members(render_template(fast, context)),
+                docx_members(render_template(docxtpl, context)),
+            )
+
+
+class DocxPackageTest(TestCase):
+    @staticmethod
+    def raw_members(content: bytes) -> dict:
+        return {
+            name: (raw.info.CRC, raw.data)
+            for name, (raw, _) in docx_package.read_members(content).items()
+        }
+
+    def setUp(self):
+        self.source, self.tags = prepare_template(str(template_fixture))
+
+    def render(self, fast: bool) -> bytes:
+        compiled = CompiledTemplate(
+            BytesIO(self.source), prepared=True, tags=self.tags, fast=fast
+        )
+        context = {tag: f"Значение {tag}" for tag in self.tags}
+        return render_template(compiled, context)
+
+    def test_unchanged_members_copied(self):
+        """Проверка, что неизмененные части копируются без сжатия"""
+        source = self.raw_members(self.source)
+        for fast in (True, False):
+            with self.subTest(fast=fast):
+                content = self.render(fast)
+                with zipfile.ZipFile(BytesIO(content)) as docx:
+                    self.assertIsNone(docx.testzip())
+                rendered = self.raw_members(content)
+                self.assertNotEqual(
+                    rendered["word/document.xml"],
+                    source["word/document.xml"],
+                )
+                self.assertEqual(
+                    rendered["word/styles.xml"], source["word/styles.xml"]
+                )
+                self.assertEqual(rendered.keys(), source.keys())
+                Document(BytesIO(content))
+
+    def test_compress_level(self):
+        """Проверка уровня сжатия измененных частей"""
+        level = docx_package.compress_level
+        self.addCleanup(setattr, docx_package, "compress_level", level)
+        sizes = []
+        for level in (0, 9):
+            docx_package.compress_level = level
+            with zipfile.ZipFile(BytesIO(self.render(False))) as docx:
+                sizes.append(docx.getinfo("word/document.xml").compress_size)
+        self.assertGreater(sizes[0], sizes[1])
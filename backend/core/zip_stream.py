@@ -0,0 +1,52 @@
+"""Потоковое формирование zip-архива (без буферизации архива целиком)."""
+import zipfile
+from typing import Iterable, Iterator, List, Tuple
+
+# Файлы docx и xlsx уже сжаты, повторное сжатие не уменьшает их размер
+STORED_EXTENSIONS = (".docx", ".xlsx", ".zip")
+
+
+class ZipStream:
+    """
+    Запись zip-архива по частям: после добавления каждого файла
+    готовая часть архива забирается для отправки клиенту.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        # объект не поддерживает seek: zipfile пишет дескрипторы данных
+        self._zip = zipfile.ZipFile(self, "w", zipfile.ZIP_DEFLATED)
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+    def add(self, name: str, content: bytes) -> bytes:
+        """Добавляет файл, возвращает очередную часть архива."""
+        if name.lower().endswith(STORED_EXTENSIONS):
+            compress_type = zipfile.ZIP_STORED
+        else:
+            compress_type = zipfile.ZIP_DEFLATED
+        self._zip.writestr(name, content, compress_type=compress_type)
+        return self._drain()
+
+    def close(self) -> bytes:
+        """Завершает архив, возвращает последнюю часть архива."""
+        self._zip.close()
+        return self._drain()
+
+
+def iter_zip(entries: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    """Генератор частей zip-архива из пар (имя файла, содержимое)."""
+    stream = ZipStream()
+    for name, content in entries:
+        yield stream.add(name, content)
+    yield stream.close()
@@ -12,6 +12,13 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ("name",)
 
 
+@admin.register(models.ConversionJob)
+class ConversionJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "owner", "status", "created", "finished")
+    readonly_fields = ("id", "created", "started", "finished")
+    list_filter = ("status",)
+
+
 @admin.register(models.FavDocument)
 class FavDocumentAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "document")
@@ -57,7 +64,15 @@ class TemplateAdmin(admin.ModelAdmin):
         "image",
     )
     list_filter = ("owner", "category", "deleted")
-    readonly_fields = ("id", "updated")
+    readonly_fields = (
+        "id",
+        "updated",
+        "prepared_template",
+        "tags",
+        "draft_docx",
+        "draft_pdf",
+        "draft_version",
+    )
     inlines = (TemplateFieldInlineAdmin,)
 
     def get_form(self, request, instance=None, **kwargs):
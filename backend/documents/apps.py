@@ -8,3 +8,6 @@ class DocumentsConfig(AppConfig):
 
     def ready(self):
         import documents.signals
+        from documents.search import register_lookups
+
+        register_lookups()
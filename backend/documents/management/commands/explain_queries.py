@@ -0,0 +1,180 @@
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from documents.models import (
+    Document,
+    DocumentField,
+    FavDocument,
+    FavTemplate,
+    Template,
+    TemplateField,
+    TemplateFieldGroup,
+)
+
+User = get_user_model()
+
+# Количество полей и групп полей шаблона в тестовых данных
+SEED_FIELDS = 10
+SEED_GROUPS = 2
+# Количество документов на один шаблон в тестовых данных
+SEED_DOCUMENTS_PER_TEMPLATE = 50
+# Размер страницы при постраничной выдаче
+PAGE_SIZE = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Планы выполнения (EXPLAIN) запросов API к шаблонам и документам. "
+        "С параметром --seed запросы выполняются на тестовых данных, "
+        "которые удаляются после выполнения"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Количество документов в тестовых данных",
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Выполнить запросы (EXPLAIN ANALYZE, только PostgreSQL)",
+        )
+
+    @staticmethod
+    def seed(documents: int):
+        """Тестовые данные: пользователь с документами и избранным."""
+        user = User.objects.create_user(
+            username="explain_queries", email="explain_queries@example.com"
+        )
+        templates_count = max(documents // SEED_DOCUMENTS_PER_TEMPLATE, 1)
+        templates = [
+            Template.objects.create(
+                name=f"Шаблон {i}",
+                deleted=i % 10 == 9,
+                description="EXPLAIN",
+            )
+            for i in range(templates_count)
+        ]
+        for template in templates:
+            groups = [
+                TemplateFieldGroup.objects.create(
+                    template=template, name=f"Группа {i}"
+                )
+                for i in range(SEED_GROUPS)
+            ]
+            TemplateField.objects.bulk_create(
+                TemplateField(
+                    template=template,
+                    tag=f"tag{i}",
+                    name=f"Поле {i}",
+                    group=groups[i % len(groups)] if i % 3 else None,
+                )
+                for i in range(SEED_FIELDS)
+            )
+        template_fields = {template.id: [] for template in templates}
+        for field in TemplateField.objects.filter(template__in=templates):
+            template_fields[field.template_id].append(field)
+        Document.objects.bulk_create(
+            Document(
+                template=templates[i % templates_count],
+                owner=user,
+                completed=i % 2 == 0,
+                description="EXPLAIN",
+            )
+            for i in range(documents)
+        )
+        created = list(Document.objects.filter(owner=user))
+        DocumentField.objects.bulk_create(
+            DocumentField(document=document, field=field, value=field.tag)
+            for document in created
+            for field in template_fields[document.template_id]
+        )
+        FavTemplate.objects.bulk_create(
+            FavTemplate(user=user, template=template)
+            for template in templates[::2]
+        )
+        FavDocument.objects.bulk_create(
+            FavDocument(user=user, document=document)
+            for document in created[::10]
+        )
+        # статистика для планировщика по новым данным
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        return user
+
+    @staticmethod
+    def querysets(user):
+        """Запросы, выполняемые представлениями API (api/v2)."""
+        template = Template.objects.filter(deleted=False).first()
+        document = user.documents.first()
+        if template is None or document is None:
+            raise CommandError(
+                "Нет данных для запросов: используйте параметр --seed"
+            )
+        catalog = (
+            Template.objects.filter(deleted=False)
+            .with_is_favorited(user)
+            .order_by("name", "id")
+        )
+        documents = user.documents.with_is_favorited(user).order_by(
+            "created", "id"
+        )
+        return (
+            ("Каталог шаблонов", catalog),
+            (
+                "Страница каталога",
+                catalog.filter(name__gte=template.name)[:PAGE_SIZE],
+            ),
+            ("Поиск по каталогу", catalog.search(template.name)),
+            (
+                "Группы полей шаблона",
+                TemplateFieldGroup.objects.filter(template=template),
+            ),
+            (
+                "Поля шаблона",
+                TemplateField.objects.filter(template=template)
+                .select_related("type")
+                .order_by("id"),
+            ),
+            (
+                "Поля шаблона без группы",
+                TemplateField.objects.filter(template=template, group=None),
+            ),
+            ("Документы пользователя", documents),
+            (
+                "Страница документов",
+                documents.filter(created__gte=document.created)[:PAGE_SIZE],
+            ),
+            ("Поиск документов", documents.search(f"tag{SEED_FIELDS - 1}")),
+            ("Черновики", documents.filter(completed=False)),
+            ("История", documents.filter(completed=True)),
+            ("Значения полей документа", document.document_fields.all()),
+            (
+                "Шаблон в избранном",
+                FavTemplate.objects.filter(user=user, template=template),
+            ),
+            (
+                "Документ в избранном",
+                FavDocument.objects.filter(user=user, document=document),
+            ),
+        )
+
+    def handle(self, *args, **options):
+        explain_options = {"analyze": True} if options["analyze"] else {}
+        with transaction.atomic():
+            if options["seed"]:
+                user = self.seed(options["seed"])
+            else:
+                user = User.objects.filter(documents__isnull=False).first()
+                if user is None:
+                    raise CommandError(
+                        "Нет документов: используйте параметр --seed"
+                    )
+            for name, queryset in self.querysets(user):
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                self.stdout.write(queryset.explain(**explain_options))
+            # тестовые данные (и изменения при EXPLAIN ANALYZE) не сохраняются
+            transaction.set_rollback(True)
@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='template',
+            name='prepared_template',
+            field=models.FileField(blank=True, help_text='Формируется автоматически при загрузке файла шаблона', upload_to='templates/prepared/', verbose_name='Подготовленный файл шаблона'),
+        ),
+        migrations.AddField(
+            model_name='template',
+            name='tags',
+            field=models.JSONField(blank=True, help_text='Формируются автоматически при загрузке файла шаблона', null=True, verbose_name='Тэги шаблона'),
+        ),
+    ]
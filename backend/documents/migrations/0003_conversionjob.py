@@ -0,0 +1,45 @@
+# Generated by Django 3.2 on 2026-10-18 19:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '0002_template_prepared'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversionJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('context', models.JSONField(blank=True, null=True, verbose_name='Значения полей (предпросмотр)')),
+                ('context_default', models.JSONField(blank=True, null=True, verbose_name='Значения полей по умолчанию (предпросмотр)')),
+                ('filename', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=16, verbose_name='Статус')),
+                ('result', models.FileField(blank=True, upload_to='jobs/', verbose_name='Файл pdf')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Начало выполнения')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Окончание выполнения')),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='conversion_jobs', to='documents.document', verbose_name='Документ')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='conversion_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Автор задания')),
+                ('template', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='conversion_jobs', to='documents.template', verbose_name='Шаблон (предпросмотр)')),
+            ],
+            options={
+                'verbose_name': 'Задание на формирование pdf',
+                'verbose_name_plural': 'Задания на формирование pdf',
+                'ordering': ('created',),
+                'default_related_name': 'conversion_jobs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='conversionjob',
+            index=models.Index(fields=['status', 'created'], name='conversionjob_queue'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_conversionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='template',
+            name='draft_docx',
+            field=models.FileField(blank=True, help_text='Формируется автоматически для версии шаблона', upload_to='templates/drafts/', verbose_name='Черновик шаблона docx'),
+        ),
+        migrations.AddField(
+            model_name='template',
+            name='draft_pdf',
+            field=models.FileField(blank=True, help_text='Формируется автоматически для версии шаблона', upload_to='templates/drafts/', verbose_name='Черновик шаблона pdf'),
+        ),
+        migrations.AddField(
+            model_name='template',
+            name='draft_version',
+            field=models.CharField(blank=True, help_text='Версия шаблона и полей, для которой сформированы черновики', max_length=64, verbose_name='Версия черновиков'),
+        ),
+    ]
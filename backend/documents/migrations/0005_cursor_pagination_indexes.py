@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_template_drafts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['owner', 'created', 'id'], name='document_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='template',
+            index=models.Index(fields=['name', 'id'], name='template_name_id_idx'),
+        ),
+    ]
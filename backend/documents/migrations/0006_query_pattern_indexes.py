@@ -0,0 +1,29 @@
+# Generated by Django 3.2 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['owner', 'completed', 'created', 'id'], name='document_owner_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documentfield',
+            index=models.Index(fields=['document', 'field'], name='documentfield_document_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='template',
+            index=models.Index(condition=models.Q(deleted=False), fields=['name', 'id'], name='template_active_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='templatefield',
+            index=models.Index(fields=['template', 'group'], name='templatefield_group_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2 on 2026-10-18 20:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+from documents.search import PostgreSQLAddIndex, update_template_search_vectors
+
+
+def fill_search_vectors(apps, schema_editor):
+    update_template_search_vectors(
+        apps.get_model('documents', 'Template').objects.all(),
+        apps.get_model('documents', 'TemplateField'),
+        apps.get_model('documents', 'Category'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_query_pattern_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='template',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, help_text='Обновляется автоматически (только PostgreSQL)', null=True, verbose_name='Вектор поиска'),
+        ),
+        PostgreSQLAddIndex(
+            model_name='template',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='template_search_idx'),
+        ),
+        PostgreSQLAddIndex(
+            model_name='template',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='template_name_trgm_idx', opclasses=('gin_trgm_ops',)),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+    ]
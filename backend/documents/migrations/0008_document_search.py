@@ -0,0 +1,24 @@
+# Generated by Django 3.2 on 2026-10-18 20:14
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+from documents.search import PostgreSQLAddIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_template_search'),
+    ]
+
+    operations = [
+        PostgreSQLAddIndex(
+            model_name='document',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['description'], name='document_description_trgm_idx', opclasses=('gin_trgm_ops',)),
+        ),
+        PostgreSQLAddIndex(
+            model_name='documentfield',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['value'], name='documentfield_value_trgm_idx', opclasses=('gin_trgm_ops',)),
+        ),
+    ]
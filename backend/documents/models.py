@@ -1,19 +1,45 @@
 """Модели документов."""
-from typing import List, Tuple
+import datetime
+import logging
+import os
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
 from django.db import models
+from django.utils import timezone
 
 from core.constants import Messages
-from core.template_render import DocumentTemplate
+from core.render_cache import make_key
+from documents.search import (
+    search_documents,
+    search_templates,
+    update_template_search_vectors,
+)
+from core.template_render import (
+    CompiledTemplate,
+    DocumentTemplate,
+    RenderMode,
+    TemplateCache,
+    prepare_template,
+)
 # from base_objects.models import (
 #     BaseObject,
 #     BaseObjectField,
 # )
 
+logger = logging.getLogger(__name__)
+
 User = get_user_model()
 
+# Кэш разобранных шаблонов docx (в пределах процесса)
+template_cache = TemplateCache(maxsize=settings.TEMPLATE_CACHE_SIZE)
+
 
 class Category(models.Model):
     """Категории шаблона."""
@@ -33,6 +59,53 @@ class Category(models.Model):
         return self.name
 
 
+def favorited_annotation(favorites: models.QuerySet, user, field: str):
+    """Признак наличия объекта в избранном пользователя (подзапрос)."""
+    if not user.is_authenticated:
+        return models.Value(False, output_field=models.BooleanField())
+    return models.Exists(
+        favorites.filter(user=user, **{field: models.OuterRef("pk")})
+    )
+
+
+class TemplateQuerySet(models.QuerySet):
+    def with_is_favorited(self, user) -> "TemplateQuerySet":
+        """Аннотация is_favorited - шаблон в избранном у пользователя."""
+        return self.annotate(
+            is_favorited=favorited_annotation(
+                FavTemplate.objects.all(), user, "template"
+            )
+        )
+
+    def with_fields(self) -> "TemplateQuerySet":
+        """
+        Предзагрузка полей шаблона (fields) и групп с их полями
+        (field_groups) вместе с типами полей. Группы и поля упорядочены
+        по id.
+        """
+        fields = TemplateField.objects.select_related("type").order_by("id")
+        return self.prefetch_related(
+            models.Prefetch("fields", queryset=fields),
+            models.Prefetch(
+                "field_groups",
+                queryset=TemplateFieldGroup.objects.order_by(
+                    "id"
+                ).prefetch_related(models.Prefetch("fields", queryset=fields)),
+            ),
+        )
+
+    def search(self, text: str) -> "TemplateQuerySet":
+        """
+        Поиск по наименованию, описанию, категории, наименованиям и
+        подсказкам полей; аннотация rank - релевантность.
+        """
+        return search_templates(self, text)
+
+    def update_search_vector(self) -> int:
+        """Обновление вектора поиска шаблонов (только PostgreSQL)."""
+        return update_template_search_vectors(self, TemplateField, Category)
+
+
 class Template(models.Model):
     """Шаблоны документа."""
 
@@ -53,6 +126,36 @@ class Template(models.Model):
     template = models.FileField(
         upload_to="templates/", verbose_name="Файл шаблона"
     )
+    prepared_template = models.FileField(
+        upload_to="templates/prepared/",
+        blank=True,
+        verbose_name="Подготовленный файл шаблона",
+        help_text="Формируется автоматически при загрузке файла шаблона",
+    )
+    tags = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name="Тэги шаблона",
+        help_text="Формируются автоматически при загрузке файла шаблона",
+    )
+    draft_docx = models.FileField(
+        upload_to="templates/drafts/",
+        blank=True,
+        verbose_name="Черновик шаблона docx",
+        help_text="Формируется автоматически для версии шаблона",
+    )
+    draft_pdf = models.FileField(
+        upload_to="templates/drafts/",
+        blank=True,
+        verbose_name="Черновик шаблона pdf",
+        help_text="Формируется автоматически для версии шаблона",
+    )
+    draft_version = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name="Версия черновиков",
+        help_text="Версия шаблона и полей, для которой сформированы черновики",
+    )
     name = models.CharField(
         max_length=255, verbose_name="Наименование шаблона"
     )
@@ -67,28 +170,167 @@ class Template(models.Model):
         null=True,
         blank=True,
     )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name="Вектор поиска",
+        help_text="Обновляется автоматически (только PostgreSQL)",
+    )
+
+    objects = TemplateQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Шаблон"
         verbose_name_plural = "Шаблоны"
         default_related_name = "templates"
         ordering = ("name",)
+        indexes = (
+            # постраничная выдача каталога (OptInCursorPagination)
+            models.Index(fields=("name", "id"), name="template_name_id_idx"),
+            # каталог для пользователей - только неудаленные шаблоны
+            models.Index(
+                fields=("name", "id"),
+                condition=models.Q(deleted=False),
+                name="template_active_name_idx",
+            ),
+            # поиск по каталогу (documents.search)
+            GinIndex(fields=("search_vector",), name="template_search_idx"),
+            GinIndex(
+                fields=("name",),
+                opclasses=("gin_trgm_ops",),
+                name="template_name_trgm_idx",
+            ),
+        )
 
     def __str__(self):
         """Отображение - название."""
         return self.name
 
     def save(self, *args, **kwargs):
-        """Удаление старого файла шаблона при сохранении."""
+        """
+        Удаление старого файла шаблона при сохранении и подготовка нового.
+        """
+        file_changed = bool(self.template)
         if self.pk is not None:
             old_self = Template.objects.get(pk=self.pk)
-            if old_self.template and self.template != old_self.template:
+            file_changed = self.template != old_self.template
+            if old_self.template and file_changed:
                 # удаление старого файла шаблона
                 try:
                     old_self.template.delete(False)
                 except Exception as e:
                     print(e)
-        return super().save(*args, **kwargs)
+                template_cache.invalidate(self.pk)
+        if file_changed:
+            # подготовка прежнего файла к новому файлу не относится: при
+            # ошибке подготовки рендеринг выполняется по самому файлу
+            self.discard_preparation()
+        result = super().save(*args, **kwargs)
+        if file_changed and self.template:
+            try:
+                self.prepare()
+            except Exception:
+                logger.exception(f"Template {self.pk} preparation failed")
+        return result
+
+    def discard_preparation(self):
+        """Удаление подготовленного файла и тэгов (поля не сохраняются)."""
+        if self.prepared_template:
+            try:
+                self.prepared_template.delete(False)
+            except Exception as e:
+                print(e)
+        self.prepared_template = ""
+        self.tags = None
+
+    def prepare(self):
+        """
+        Подготовка файла шаблона к рендерингу.
+
+        Объединяет прогоны с тэгами и извлекает список тэгов, результат
+        сохраняется в prepared_template и tags, чтобы не выполнять эту
+        работу при каждой генерации документа.
+        """
+        content, tags = prepare_template(self.template)
+        self.discard_preparation()
+        self.prepared_template.save(
+            os.path.basename(self.template.name),
+            ContentFile(content),
+            save=False,
+        )
+        self.tags = tags
+        self.updated = timezone.now()
+        Template.objects.filter(pk=self.pk).update(
+            prepared_template=self.prepared_template.name,
+            tags=self.tags,
+            updated=self.updated,
+        )
+        template_cache.invalidate(self.pk)
+
+    def get_tags(self) -> Set[str]:
+        """
+        Возвращает множество тэгов файла шаблона.
+
+        Тэги хранятся в поле tags и вычисляются один раз для каждой версии
+        файла (при загрузке), для неподготовленного шаблона выполняется
+        подготовка.
+        """
+        if self.tags is None and self.template:
+            self.prepare()
+        return set(self.tags or ())
+
+    @property
+    def fingerprint(self) -> Tuple:
+        """Отпечаток версии файла шаблона для кэширования."""
+        return (self.template.name, self.prepared_template.name, self.updated)
+
+    @property
+    def version(self) -> str:
+        """Версия шаблона для ключей кэша сформированных файлов."""
+        return f"{self.pk}:{self.fingerprint}"
+
+    def get_draft_context(self) -> Dict[str, str]:
+        """Контекст черновика: тэги заменяются названиями полей."""
+        return {field.tag: field.name for field in self.fields.all()}
+
+    def get_draft_version(self, context: Dict[str, str]) -> str:
+        """Версия черновика: меняется с файлом шаблона и полями."""
+        return make_key(self.version, RenderMode.DRAFT, context)
+
+    def delete_drafts(self):
+        """Удаление файлов черновиков (поля модели не сохраняются)."""
+        for draft in (self.draft_docx, self.draft_pdf):
+            if draft:
+                try:
+                    draft.delete(False)
+                except Exception as e:
+                    print(e)
+        self.draft_version = ""
+
+    def get_compiled_template(self) -> CompiledTemplate:
+        """Возвращает разобранный шаблон из кэша."""
+        if self.prepared_template:
+            return template_cache.get(
+                self.pk,
+                self.fingerprint,
+                lambda: CompiledTemplate(
+                    self.prepared_template,
+                    prepared=True,
+                    tags=self.tags,
+                    fast=settings.FAST_RENDER,
+                ),
+            )
+        return template_cache.get(
+            self.pk,
+            self.fingerprint,
+            lambda: CompiledTemplate(
+                self.template, tags=self.tags, fast=settings.FAST_RENDER
+            ),
+        )
+
+    def get_document_template(self) -> DocumentTemplate:
+        """Возвращает генератор документов на основе кэшированного шаблона."""
+        return DocumentTemplate(self.template, self.get_compiled_template())
 
     def get_inconsistent_tags(self) -> Tuple[Tuple, Tuple]:
         """
@@ -101,8 +343,7 @@ class Template(models.Model):
         docx_tags, field_tags = set(), set()
         if self.template:
             try:
-                doc = DocumentTemplate(self.template)
-                docx_tags = set(doc.get_tags())
+                docx_tags = self.get_tags()
             except Exception as e:
                 print(e)  # TODO: add logging
 
@@ -235,6 +476,13 @@ class TemplateField(models.Model):
         verbose_name_plural = "Поля шаблона"
         default_related_name = "fields"
         ordering = ("template", "name")
+        indexes = (
+            # поля шаблона без группы и поля группы
+            models.Index(
+                fields=("template", "group"),
+                name="templatefield_group_idx",
+            ),
+        )
 
     def __str__(self):
         """Отображение - название поля (шаблон)."""
@@ -246,6 +494,20 @@ class TemplateField(models.Model):
             raise ValidationError(Messages.WRONG_FIELD_AND_GROUP_TEMPLATES)
 
 
+class DocumentQuerySet(models.QuerySet):
+    def with_is_favorited(self, user) -> "DocumentQuerySet":
+        """Аннотация is_favorited - документ в избранном у пользователя."""
+        return self.annotate(
+            is_favorited=favorited_annotation(
+                FavDocument.objects.all(), user, "document"
+            )
+        )
+
+    def search(self, text: str) -> "DocumentQuerySet":
+        """Поиск по описанию, наименованию шаблона и значениям полей."""
+        return search_documents(self, text, DocumentField)
+
+
 class Document(models.Model):
     """Документ."""
 
@@ -270,32 +532,86 @@ class Document(models.Model):
     )
     description = models.TextField(verbose_name="Описание документа")
 
+    objects = DocumentQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Документ"
         verbose_name_plural = "Документы"
         ordering = ("created",)
         default_related_name = "documents"
+        indexes = (
+            # документы пользователя (OptInCursorPagination)
+            models.Index(
+                fields=("owner", "created", "id"),
+                name="document_owner_created_idx",
+            ),
+            # черновики и история документов пользователя
+            models.Index(
+                fields=("owner", "completed", "created", "id"),
+                name="document_owner_completed_idx",
+            ),
+            # поиск по документам (documents.search)
+            GinIndex(
+                fields=("description",),
+                opclasses=("gin_trgm_ops",),
+                name="document_description_trgm_idx",
+            ),
+        )
 
     def __str__(self):
         """Автор документа и название шаблона."""
         return f"{self.owner} {self.template}"
 
+    def get_fields_values(self, fields_data) -> Dict[int, str]:
+        """
+        Значения из fields_data по id полей. Принадлежность полей шаблону
+        документа проверяется сериализатором, здесь такие поля
+        пропускаются.
+        """
+        return {
+            field_data["field"].id: field_data["value"]
+            for field_data in fields_data
+            if field_data["field"].template_id == self.template_id
+        }
+
     def create_document_fields(self, fields_data):
         """Создание полей для данного документа по данным из fields_data"""
-        document_fields = []
-        for field_data in fields_data:
-            template_field = field_data["field"]
-            template = TemplateField.objects.get(id=template_field.id).template
-            if self.template == template:
-                # Проверяется, принадлежит ли поле шаблону документа
-                document_fields.append(
-                    DocumentField(
-                        field=template_field,
-                        value=field_data["value"],
-                        document=self,
-                    )
-                )
-        DocumentField.objects.bulk_create(document_fields)
+        DocumentField.objects.bulk_create(
+            DocumentField(field_id=field_id, value=value, document=self)
+            for field_id, value in self.get_fields_values(fields_data).items()
+        )
+
+    def update_document_fields(self, fields_data):
+        """
+        Замена полей документа данными из fields_data: добавляются новые
+        значения, изменяются измененные и удаляются отсутствующие,
+        неизмененные поля не записываются.
+        """
+        values = self.get_fields_values(fields_data)
+        existing = {
+            document_field.field_id: document_field
+            for document_field in self.document_fields.all()
+        }
+        changed = []
+        for field_id, value in values.items():
+            document_field = existing.get(field_id)
+            if document_field is not None and document_field.value != value:
+                document_field.value = value
+                changed.append(document_field)
+        removed = [
+            document_field.id
+            for field_id, document_field in existing.items()
+            if field_id not in values
+        ]
+        if removed:
+            DocumentField.objects.filter(id__in=removed).delete()
+        if changed:
+            DocumentField.objects.bulk_update(changed, ("value",))
+        DocumentField.objects.bulk_create(
+            DocumentField(field_id=field_id, value=value, document=self)
+            for field_id, value in values.items()
+            if field_id not in existing
+        )
 
 
 class DocumentField(models.Model):
@@ -319,6 +635,19 @@ class DocumentField(models.Model):
         verbose_name = "Поле документа"
         verbose_name_plural = "Поля документа"
         ordering = ("field__template", "field")
+        indexes = (
+            # значения полей документа
+            models.Index(
+                fields=("document", "field"),
+                name="documentfield_document_idx",
+            ),
+            # поиск по документам (documents.search)
+            GinIndex(
+                fields=("value",),
+                opclasses=("gin_trgm_ops",),
+                name="documentfield_value_trgm_idx",
+            ),
+        )
 
     def __str__(self):
         """Отображение - шаблон поле."""
@@ -383,3 +712,140 @@ class FavDocument(models.Model):
     def __str__(self):
         """Строковое отображение."""
         return f"{self.document} в избранном у {self.user}"
+
+
+class ConversionJob(models.Model):
+    """Задание на формирование pdf-файла (команда run_pdf_jobs)."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "В очереди"),
+        (RUNNING, "Выполняется"),
+        (DONE, "Готово"),
+        (FAILED, "Ошибка"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="Автор задания",
+        null=True,
+        blank=True,
+    )
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        verbose_name="Документ",
+        null=True,
+        blank=True,
+    )
+    template = models.ForeignKey(
+        Template,
+        on_delete=models.CASCADE,
+        verbose_name="Шаблон (предпросмотр)",
+        null=True,
+        blank=True,
+    )
+    context = models.JSONField(
+        verbose_name="Значения полей (предпросмотр)", null=True, blank=True
+    )
+    context_default = models.JSONField(
+        verbose_name="Значения полей по умолчанию (предпросмотр)",
+        null=True,
+        blank=True,
+    )
+    filename = models.CharField(max_length=255, verbose_name="Имя файла")
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        verbose_name="Статус",
+    )
+    result = models.FileField(
+        upload_to="jobs/", blank=True, verbose_name="Файл pdf"
+    )
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created = models.DateTimeField(
+        auto_now_add=True, verbose_name="Дата создания"
+    )
+    started = models.DateTimeField(
+        null=True, blank=True, verbose_name="Начало выполнения"
+    )
+    finished = models.DateTimeField(
+        null=True, blank=True, verbose_name="Окончание выполнения"
+    )
+
+    class Meta:
+        verbose_name = "Задание на формирование pdf"
+        verbose_name_plural = "Задания на формирование pdf"
+        ordering = ("created",)
+        indexes = (
+            models.Index(
+                fields=("status", "created"), name="conversionjob_queue"
+            ),
+        )
+        default_related_name = "conversion_jobs"
+
+    def __str__(self):
+        """Идентификатор и статус задания."""
+        return f"{self.id} ({self.status})"
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED)
+
+    @classmethod
+    def claim_next(
+        cls, stale_after: datetime.timedelta
+    ) -> Optional["ConversionJob"]:
+        """
+        Захват следующего задания очереди. Задание, выполнение которого
+        не завершилось за stale_after (обработчик упал), выполняется заново.
+        Захват - условное обновление статуса, поэтому одно задание не
+        достанется двум обработчикам.
+        """
+        now = timezone.now()
+        available = models.Q(status=cls.PENDING) | models.Q(
+            status=cls.RUNNING, started__lt=now - stale_after
+        )
+        queue = cls.objects.filter(available).order_by("created")
+        for job_id in queue.values_list("id", flat=True)[:10]:
+            claimed = cls.objects.filter(available, id=job_id).update(
+                status=cls.RUNNING, started=now
+            )
+            if claimed:
+                return cls.objects.select_related(
+                    "document", "template"
+                ).get(id=job_id)
+        return None
+
+    def complete(self, content: bytes):
+        """Сохранение результата выполнения задания."""
+        self.result.save(f"{self.id}.pdf", ContentFile(content), save=False)
+        self.status = self.DONE
+        self.finished = timezone.now()
+        self.save(update_fields=("result", "status", "finished"))
+
+    def fail(self, error: str):
+        self.status = self.FAILED
+        self.error = error
+        self.finished = timezone.now()
+        self.save(update_fields=("status", "error", "finished"))
+
+    @classmethod
+    def delete_expired(cls, ttl: datetime.timedelta) -> int:
+        """Удаление завершённых заданий старше ttl вместе с файлами."""
+        expired = cls.objects.filter(
+            status__in=(cls.DONE, cls.FAILED),
+            finished__lt=timezone.now() - ttl,
+        )
+        count = 0
+        for job in expired:
+            # файл удаляется обработчиком сигнала pre_delete
+            job.delete()
+            count += 1
+        return count
@@ -0,0 +1,205 @@
+"""
+Поиск по каталогу шаблонов и документам пользователя.
+
+В PostgreSQL используется полнотекстовый поиск (конфигурация russian,
+со стеммингом) по вектору Template.search_vector и поиск по сходству
+триграмм запроса со словами наименования (опечатки, оператор <%);
+оба индексированы GIN. Вектор
+обновляется при изменении шаблона, его полей и категории (см.
+documents.signals). В других СУБД (SQLite при разработке) выполняется
+поиск подстрок без учета регистра.
+
+Документы ищутся по подстрокам без учета регистра: в PostgreSQL -
+ILIKE, который использует GIN-индексы триграмм описания документа,
+значений полей и наименования шаблона, в других СУБД - регулярное
+выражение.
+"""
+import re
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connections, migrations, models
+from django.db.models.functions import Concat
+from django.db.models.lookups import PostgresOperatorLookup
+
+# Конфигурация полнотекстового поиска PostgreSQL
+SEARCH_CONFIG = "russian"
+
+
+def is_postgresql(queryset: models.QuerySet) -> bool:
+    return connections[queryset.db].vendor == "postgresql"
+
+
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """
+    Сходство триграмм значения с одним из слов поля: field %> value
+    (value <% field), поддерживается индексом gin_trgm_ops.
+    """
+
+    lookup_name = "trigram_word_similar"
+    postgres_operator = "%%>"
+
+
+class TrigramWordSimilarity(models.Func):
+    """Наибольшее сходство триграмм строки со словами выражения."""
+
+    function = "WORD_SIMILARITY"
+    output_field = models.FloatField()
+
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, "resolve_expression"):
+            string = models.Value(string)
+        super().__init__(string, expression, **extra)
+
+
+class ILikeContains(PostgresOperatorLookup):
+    """
+    Подстрока без учета регистра: field ILIKE '%value%'. В отличие от
+    icontains (UPPER(field::text) LIKE UPPER(...)) поддерживается индексом
+    gin_trgm_ops по полю.
+    """
+
+    lookup_name = "ilike_contains"
+    postgres_operator = "ILIKE"
+
+    def process_rhs(self, compiler, connection):
+        rhs, params = super().process_rhs(compiler, connection)
+        if self.rhs_is_direct_value() and params:
+            params[0] = "%%%s%%" % connection.ops.prep_for_like_query(
+                params[0]
+            )
+        return rhs, params
+
+
+def register_lookups():
+    """Регистрация поисковых lookup (вызывается из DocumentsConfig.ready)."""
+    for field_class in (models.CharField, models.TextField):
+        field_class.register_lookup(TrigramWordSimilar)
+        field_class.register_lookup(ILikeContains)
+
+
+class PostgreSQLAddIndex(migrations.AddIndex):
+    """Операция миграции: индекс создается только в PostgreSQL (GIN)."""
+
+    def database_forwards(self, app_label, schema_editor, *args):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_forwards(app_label, schema_editor, *args)
+
+    def database_backwards(self, app_label, schema_editor, *args):
+        if schema_editor.connection.vendor == "postgresql":
+            super().database_backwards(app_label, schema_editor, *args)
+
+
+def template_search_vector(field_model, category_model) -> SearchVector:
+    """
+    Вектор поиска шаблона: наименование (вес A), категория и описание (B),
+    наименования и подсказки полей (C).
+    """
+    fields_text = (
+        field_model.objects.filter(template=models.OuterRef("pk"))
+        .order_by()
+        .values("template")
+        .annotate(
+            text=StringAgg(
+                Concat("name", models.Value(" "), "hint"), delimiter=" "
+            )
+        )
+        .values("text")
+    )
+    category_name = category_model.objects.filter(
+        pk=models.OuterRef("category_id")
+    ).values("name")
+    return (
+        SearchVector("name", weight="A", config=SEARCH_CONFIG)
+        + SearchVector(
+            models.Subquery(category_name),
+            "description",
+            weight="B",
+            config=SEARCH_CONFIG,
+        )
+        + SearchVector(
+            models.Subquery(fields_text), weight="C", config=SEARCH_CONFIG
+        )
+    )
+
+
+def update_template_search_vectors(
+    queryset: models.QuerySet, field_model, category_model
+) -> int:
+    """Обновление векторов поиска шаблонов (только PostgreSQL)."""
+    if not is_postgresql(queryset):
+        return 0
+    return queryset.update(
+        search_vector=template_search_vector(field_model, category_model)
+    )
+
+
+def search_templates(queryset: models.QuerySet, text: str) -> models.QuerySet:
+    """Шаблоны, найденные по тексту, в порядке релевантности."""
+    if is_postgresql(queryset):
+        query = SearchQuery(
+            text, config=SEARCH_CONFIG, search_type="websearch"
+        )
+        return (
+            queryset.annotate(
+                rank=SearchRank(models.F("search_vector"), query),
+                similarity=TrigramWordSimilarity(text, "name"),
+            )
+            .filter(
+                models.Q(search_vector=query)
+                | models.Q(name__trigram_word_similar=text)
+            )
+            .order_by("-rank", "-similarity", "name", "id")
+        )
+    # каждое слово - в наименовании, описании, категории или полях шаблона;
+    # regex в SQLite выполняется python и не зависит от регистра кириллицы
+    matched = queryset.model.objects.all()
+    for word in text.split():
+        pattern = re.escape(word)
+        matched = matched.filter(
+            models.Q(name__iregex=pattern)
+            | models.Q(description__iregex=pattern)
+            | models.Q(category__name__iregex=pattern)
+            | models.Q(fields__name__iregex=pattern)
+            | models.Q(fields__hint__iregex=pattern)
+        )
+    return (
+        queryset.filter(pk__in=matched.values("pk"))
+        .annotate(
+            rank=models.Case(
+                models.When(name__iregex=re.escape(text), then=1.0),
+                default=0.0,
+                output_field=models.FloatField(),
+            )
+        )
+        .order_by("-rank", "name", "id")
+    )
+
+
+def search_documents(
+    queryset: models.QuerySet, text: str, field_model
+) -> models.QuerySet:
+    """
+    Документы, в описании, наименовании шаблона или значениях полей
+    которых есть каждое слово текста.
+    """
+    # regex в SQLite выполняется python и не зависит от регистра кириллицы
+    if is_postgresql(queryset):
+        lookup, prepare = "ilike_contains", str
+    else:
+        lookup, prepare = "iregex", re.escape
+    for word in text.split():
+        pattern = prepare(word)
+        values = field_model.objects.filter(
+            document=models.OuterRef("pk"), **{f"value__{lookup}": pattern}
+        )
+        queryset = queryset.filter(
+            models.Q(**{f"description__{lookup}": pattern})
+            | models.Q(**{f"template__name__{lookup}": pattern})
+            | models.Q(models.Exists(values))
+        )
+    return queryset
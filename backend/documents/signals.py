@@ -1,12 +1,69 @@
-from django.db.models.signals import pre_delete
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch.dispatcher import receiver
-from .models import Template
+from django.utils import timezone
+from .models import (
+    Category,
+    ConversionJob,
+    Template,
+    TemplateField,
+    TemplateFieldGroup,
+    TemplateFieldType,
+)
+
+
+@receiver(post_save, sender=Template)
+def template_model_save(sender, instance, **kwargs):
+    Template.objects.filter(pk=instance.pk).update_search_vector()
+
+
+@receiver(post_save, sender=TemplateField)
+@receiver(post_delete, sender=TemplateField)
+def template_field_model_change(sender, instance, **kwargs):
+    templates = Template.objects.filter(pk=instance.template_id)
+    # дата изменения шаблона - валидатор условных запросов (api.v2)
+    templates.update(updated=timezone.now())
+    templates.update_search_vector()
+
+
+@receiver(post_save, sender=TemplateFieldGroup)
+@receiver(post_delete, sender=TemplateFieldGroup)
+def template_field_group_model_change(sender, instance, **kwargs):
+    Template.objects.filter(pk=instance.template_id).update(
+        updated=timezone.now()
+    )
+
+
+@receiver(post_save, sender=TemplateFieldType)
+def template_field_type_model_save(sender, instance, **kwargs):
+    Template.objects.filter(fields__type=instance).update(
+        updated=timezone.now()
+    )
+
+
+@receiver(post_save, sender=Category)
+def category_model_save(sender, instance, **kwargs):
+    Template.objects.filter(category=instance).update_search_vector()
 
 
 @receiver(pre_delete, sender=Template)
 def template_model_delete(sender, instance, **kwargs):
-    if instance.template:
+    for file in (
+        instance.template,
+        instance.prepared_template,
+        instance.draft_docx,
+        instance.draft_pdf,
+    ):
+        if file:
+            try:
+                file.delete(False)
+            except Exception as e:
+                print(e)
+
+
+@receiver(pre_delete, sender=ConversionJob)
+def conversion_job_delete(sender, instance, **kwargs):
+    if instance.result:
         try:
-            instance.template.delete(False)
+            instance.result.delete(False)
         except Exception as e:
             print(e)
@@ -1,3 +1,527 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from api.v2.templates.serializers import TemplateFileUploadSerializer
+from api.v2.utils import (
+    create_document_pdf_for_export,
+    get_template_draft,
+    render_cache,
+)
+from core.constants import Messages
+from core.management.commands.run_pdf_jobs import process_jobs
+from core.render_cache import make_key
+from core.template_render import RenderMode
+from documents.models import (
+    ConversionJob,
+    Document,
+    Template,
+    TemplateField,
+)
+
+User = get_user_model()
+
+TEMPLATE_FIXTURE = (
+    settings.INITIAL_DATA_DIR / "детский_сад" / "заявление_детсад_tpl.docx"
+)
+
+
+class TempMediaRootMixin:
+    """Файлы тестов класса сохраняются в собственный временный MEDIA_ROOT."""
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_root_settings = override_settings(MEDIA_ROOT=media_root)
+        media_root_settings.enable()
+        cls.addClassCleanup(media_root_settings.disable)
+        super().setUpClass()
+
+
+class TemplatePreparationTest(TempMediaRootMixin, TestCase):
+    def create_template(self) -> Template:
+        template = Template.objects.create(
+            name="Тестовый шаблон", deleted=False, description="Тест"
+        )
+        with open(TEMPLATE_FIXTURE, "rb") as f:
+            template.template.save("tpl.docx", File(f))
+        return template
+
+    def test_template_is_prepared_on_upload(self):
+        """Проверка, что при загрузке файла шаблон подготавливается"""
+        template = self.create_template()
+        template.refresh_from_db()
+        self.assertTrue(template.prepared_template)
+        self.assertTrue(template.tags)
+        self.assertEqual(
+            set(template.tags),
+            template.get_document_template().get_tags(),
+        )
+
+    def test_prepared_template_is_replaced_on_upload(self):
+        """Проверка, что повторная загрузка файла обновляет подготовку"""
+        template = self.create_template()
+        prepared_name = template.prepared_template.name
+        with open(TEMPLATE_FIXTURE, "rb") as f:
+            template.template.save("tpl.docx", File(f))
+        template.refresh_from_db()
+        self.assertTrue(template.prepared_template)
+        self.assertNotEqual(template.prepared_template.name, prepared_name)
+
+    def test_invalid_file_discards_previous_preparation(self):
+        """Проверка, что подготовка прежнего файла не используется"""
+        template = self.create_template()
+        template.template.save(
+            "broken.docx", SimpleUploadedFile("broken.docx", b"not a docx")
+        )
+        template.refresh_from_db()
+        self.assertFalse(template.prepared_template)
+        self.assertIsNone(template.tags)
+
+    def test_invalid_file_upload_is_rejected(self):
+        """Проверка, что файл, который не подготавливается, не загружается"""
+        template = self.create_template()
+        serializer = TemplateFileUploadSerializer(
+            template,
+            data={
+                "template": SimpleUploadedFile("broken.docx", b"not a docx")
+            },
+        )
+        self.assertFalse(serializer.is_valid())
+        self.assertIn("template", serializer.errors)
+        template.refresh_from_db()
+        self.assertTrue(template.prepared_template)
+
+    def test_prepare_command_skips_prepared_templates(self):
+        """Проверка, что команда не подготавливает шаблоны повторно"""
+        template = self.create_template()
+        Template.objects.filter(pk=template.pk).update(
+            tags=None, prepared_template=""
+        )
+        self.create_template()
+        for options, count in (({}, 1), ({}, 0), ({"all": True}, 2)):
+            with self.subTest(options=options):
+                stdout = io.StringIO()
+                call_command(
+                    "prepare_templates",
+                    no_drafts=True,
+                    stdout=stdout,
+                    **options,
+                )
+                self.assertIn(
+                    Messages.TEMPLATE_PREPARE_FINISHED.format(count),
+                    stdout.getvalue(),
+                )
+
+    def test_consistency_check_uses_stored_tags(self):
+        """Проверка, что согласованность проверяется по сохраненным тэгам"""
+        template = self.create_template()
+        Template.objects.filter(pk=template.pk).update(tags=["тэг"])
+        template.refresh_from_db()
+        excess_tags, excess_fields = template.get_inconsistent_tags()
+        self.assertEqual(excess_tags, ("тэг",))
+        self.assertEqual(excess_fields, ())
+
+    def test_tags_are_computed_for_unprepared_template(self):
+        """Проверка, что для неподготовленного шаблона тэги вычисляются"""
+        template = self.create_template()
+        Template.objects.filter(pk=template.pk).update(
+            tags=None, prepared_template=""
+        )
+        template.refresh_from_db()
+        self.assertTrue(template.get_tags())
+        template.refresh_from_db()
+        self.assertIsNotNone(template.tags)
+
+    def test_draft_is_stored_once_per_version(self):
+        """Проверка, что черновик формируется один раз для версии"""
+        template = self.create_template()
+        draft = get_template_draft(template)
+        template.refresh_from_db()
+        self.assertEqual(template.draft_docx.name, draft.name)
+        self.assertEqual(get_template_draft(template).name, draft.name)
+
+        TemplateField.objects.create(template=template, tag="x", name="Икс")
+        new_draft = get_template_draft(template)
+        self.assertNotEqual(new_draft.name, draft.name)
+        self.assertFalse(draft.storage.exists(draft.name))
+
+    def test_missing_draft_is_regenerated(self):
+        """Проверка, что удаленный файл черновика формируется заново"""
+        template = self.create_template()
+        draft = get_template_draft(template)
+        draft.storage.delete(draft.name)
+        response = APIClient().get(
+            f"/api/v2/templates/{template.id}/download_draft/"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(b"".join(response.streaming_content))
+        template.refresh_from_db()
+        self.assertTrue(draft.storage.exists(template.draft_docx.name))
+
+
+class ConversionJobTest(TempMediaRootMixin, TestCase):
+    stale_after = datetime.timedelta(minutes=10)
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password"
+        )
+        self.template = Template.objects.create(
+            name="Тестовый шаблон", deleted=False, description="Тест"
+        )
+        self.document = Document.objects.create(
+            template=self.template, owner=self.user, description="Тест"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_job(self, **kwargs) -> ConversionJob:
+        return ConversionJob.objects.create(
+            owner=self.user, document=self.document, filename="t.pdf", **kwargs
+        )
+
+    def test_jobs_are_claimed_once_in_order(self):
+        """Проверка, что задания выдаются обработчикам по одному разу"""
+        first = self.create_job()
+        second = self.create_job()
+        self.assertEqual(ConversionJob.claim_next(self.stale_after), first)
+        self.assertEqual(ConversionJob.claim_next(self.stale_after), second)
+        self.assertIsNone(ConversionJob.claim_next(self.stale_after))
+        first.refresh_from_db()
+        self.assertEqual(first.status, ConversionJob.RUNNING)
+
+    def test_stale_job_is_claimed_again(self):
+        """Проверка, что задание упавшего обработчика выполняется заново"""
+        job = self.create_job(
+            status=ConversionJob.RUNNING,
+            started=timezone.now() - 2 * self.stale_after,
+        )
+        self.assertEqual(ConversionJob.claim_next(self.stale_after), job)
+
+    def test_failed_job_stores_error(self):
+        """Проверка, что ошибка формирования сохраняется в задании"""
+        job = ConversionJob.objects.create(
+            template=self.template, context={}, filename="t.pdf"
+        )
+        process_jobs(poll_interval=0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ConversionJob.FAILED)
+        self.assertTrue(job.error)
+
+    def test_pdf_job_api(self):
+        """Проверка постановки задания, статуса и скачивания результата"""
+        response = self.client.post(
+            f"/api/v2/documents/{self.document.id}/pdf_job/"
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], ConversionJob.PENDING)
+        job_url = f"/api/v2/pdf_jobs/{response.data['id']}/"
+        response = self.client.get(f"{job_url}download/")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        ConversionJob.objects.get().complete(b"%PDF-1.4")
+        response = self.client.get(job_url, {"wait": 5})
+        self.assertEqual(response.data["status"], ConversionJob.DONE)
+        self.assertTrue(response.data["download_url"].endswith("download/"))
+        response = self.client.get(f"{job_url}download/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4")
+
+        self.client.logout()
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(PDF_JOB_MAX_WAIT=0)
+    def test_pdf_job_wait_is_capped(self):
+        """Проверка, что ожидание статуса ограничено PDF_JOB_MAX_WAIT"""
+        job = self.create_job()
+        response = self.client.get(f"/api/v2/pdf_jobs/{job.id}/", {"wait": 60})
+        self.assertEqual(response.data["status"], ConversionJob.PENDING)
+
+    @override_settings(ACCEL_REDIRECT_LOCATION="/protected/")
+    def test_download_offloaded_to_gateway(self):
+        """Проверка, что файл из MEDIA_ROOT отдается через X-Accel-Redirect"""
+        job = self.create_job()
+        job.complete(b"%PDF-1.4")
+        response = self.client.get(f"/api/v2/pdf_jobs/{job.id}/download/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response["X-Accel-Redirect"], f"/protected/{job.result.name}"
+        )
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertIn("attachment", response["Content-Disposition"])
+        self.assertEqual(b"".join(response.streaming_content), b"")
+
+        self.client.logout()
+        response = self.client.get(f"/api/v2/pdf_jobs/{job.id}/download/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_download_requires_owner(self):
+        """Проверка, что документ другого пользователя не выдается"""
+        self.client.force_authenticate(
+            User.objects.create_user(
+                username="other", email="other@example.com", password="pass"
+            )
+        )
+        for action in ("download_document", "download_pdf"):
+            with self.subTest(action=action):
+                response = self.client.get(
+                    f"/api/v2/documents/{self.document.id}/{action}/"
+                )
+                self.assertEqual(
+                    response.status_code, status.HTTP_404_NOT_FOUND
+                )
+
+    def test_cached_pdf_skips_rendering(self):
+        """Проверка, что закэшированный pdf выдается без генерации"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(
+            setattr, render_cache, "directory", render_cache.directory
+        )
+        render_cache.directory = directory
+        key = make_key(self.template.version, RenderMode.PARTIAL, {}, {})
+        render_cache.put(key, "pdf", b"%PDF-1.4")
+        # у шаблона нет файла: без кэша формирование завершится ошибкой
+        buffer = create_document_pdf_for_export(self.document)
+        self.assertEqual(buffer.getvalue(), b"%PDF-1.4")
+
+        response = self.client.get(
+            f"/api/v2/documents/{self.document.id}/download_pdf/"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Length"], "8")
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4")
+        response.close()
+
+
+@override_settings(BATCH_PROCESSES=2)
+class BatchDocumentsTest(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        self.template = Template.objects.create(
+            name="Заявление", deleted=False, description="Тест"
+        )
+        with open(TEMPLATE_FIXTURE, "rb") as f:
+            self.template.template.save("tpl.docx", File(f))
+        for tag in ("РебенокФИО", "РебенокГруппа"):
+            TemplateField.objects.create(
+                template=self.template, tag=tag, name=tag
+            )
+        self.url = f"/api/v2/templates/{self.template.id}/batch/"
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_user(
+                username="user", email="user@example.com", password="pass"
+            )
+        )
+
+    def read_zip(self, response) -> zipfile.ZipFile:
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b"".join(response.streaming_content)
+        return zipfile.ZipFile(io.BytesIO(content))
+
+    def test_json_records_with_errors(self):
+        """Проверка пакетного формирования с ошибкой в одной из записей"""
+        records = [
+            {"РебенокФИО": "Иванов Иван", "РебенокГруппа": "1"},
+            {"НеизвестныйТэг": "значение"},
+            {"РебенокФИО": "Петров Петр", "РебенокГруппа": ""},
+        ]
+        archive = self.read_zip(
+            self.client.post(self.url, {"records": records}, format="json")
+        )
+        self.assertEqual(
+            archive.namelist(),
+            ["1_Заявление.docx", "3_Заявление.docx", "errors.json"],
+        )
+        errors = json.loads(archive.read("errors.json"))
+        self.assertEqual(list(errors), ["2"])
+        self.assertIn("НеизвестныйТэг", errors["2"])
+        content = archive.read("1_Заявление.docx")
+        document_xml = zipfile.ZipFile(io.BytesIO(content)).read(
+            "word/document.xml"
+        )
+        self.assertIn("Иванов Иван", document_xml.decode())
+
+    def test_csv_records(self):
+        """Проверка пакетного формирования из файла CSV"""
+        rows = ("РебенокФИО;РебенокГруппа", "Иванов Иван;1", "Петров Петр;2")
+        csv_file = SimpleUploadedFile(
+            "records.csv", "\n".join(rows).encode()
+        )
+        archive = self.read_zip(
+            self.client.post(self.url, {"file": csv_file}, format="multipart")
+        )
+        self.assertEqual(
+            archive.namelist(), ["1_Заявление.docx", "2_Заявление.docx"]
+        )
+
+    def test_merged_document(self):
+        """Проверка формирования одного документа со всеми записями"""
+        records = [
+            {"РебенокФИО": "Иванов Иван", "РебенокГруппа": "1"},
+            {"РебенокФИО": "Петров Петр", "РебенокГруппа": "2"},
+        ]
+        response = self.client.post(
+            f"{self.url}?merge=1", {"records": records}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b"".join(response.streaming_content)
+        document_xml = zipfile.ZipFile(io.BytesIO(content)).read(
+            "word/document.xml"
+        ).decode()
+        self.assertLess(
+            document_xml.index("Иванов Иван"),
+            document_xml.index("Петров Петр"),
+        )
+        self.assertIn('w:type="page"', document_xml)
+
+    def test_all_records_invalid(self):
+        """Проверка, что пакет без корректных записей возвращает ошибки"""
+        response = self.client.post(
+            self.url, {"records": [{"x": "1"}]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(1, response.data["errors"])
+
+    @override_settings(BATCH_MAX_RECORDS=3, BATCH_MAX_PDF_RECORDS=1)
+    def test_too_many_records(self):
+        """Проверка ограничения количества записей (для pdf - меньшего)"""
+        record = {"РебенокФИО": "Иванов Иван"}
+        for url, records in (
+            (self.url, [record] * 4),
+            (f"{self.url}?pdf=1", [record] * 2),
+        ):
+            with self.subTest(url=url):
+                response = self.client.post(
+                    url, {"records": records}, format="json"
+                )
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+
+    def test_deleted_template(self):
+        """Проверка, что удаленный шаблон не формируется пакетом"""
+        Template.objects.filter(pk=self.template.pk).update(deleted=True)
+        response = self.client.post(
+            self.url, {"records": [{"РебенокФИО": "Иванов"}]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(BATCH_MAX_RECORDS=3, BATCH_MAX_PDF_RECORDS=1)
+    def test_merged_pdf_is_not_limited_per_file(self):
+        """Проверка, что объединенный pdf ограничен как docx"""
+        records = [{"РебенокФИО": "Иванов Иван"}] * 3
+        # объединенный документ конвертируется один раз
+        with mock.patch(
+            "api.v2.utils.convert_file_to_pdf",
+            return_value=io.BytesIO(b"%PDF"),
+        ) as convert:
+            response = self.client.post(
+                f"{self.url}?merge=1&pdf=1",
+                {"records": records},
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF")
+        convert.assert_called_once()
+
+
+@override_settings(PACKAGE_THREADS=2)
+class DocumentPackageTest(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        self.templates = []
+        for name, tags in (
+            ("Заявление", ("РебенокФИО", "РебенокГруппа")),
+            ("Согласие", ("РебенокФИО",)),
+        ):
+            template = Template.objects.create(
+                name=name, deleted=False, description="Тест"
+            )
+            with open(TEMPLATE_FIXTURE, "rb") as f:
+                template.template.save("tpl.docx", File(f))
+            for tag in tags:
+                TemplateField.objects.create(
+                    template=template, tag=tag, name=tag
+                )
+            self.templates.append(template)
+        self.url = "/api/v2/templates/package/"
+        self.client = APIClient()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(
+            setattr, render_cache, "directory", render_cache.directory
+        )
+        render_cache.directory = directory
+
+    def test_package_from_shared_context(self):
+        """Проверка формирования пакета документов с общими значениями"""
+        ids = [template.id for template in reversed(self.templates)]
+        response = self.client.post(
+            self.url,
+            {
+                "templates": ids,
+                "context": {"РебенокФИО": "Иванов Иван", "РебенокГруппа": "1"},
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        archive = zipfile.ZipFile(
+            io.BytesIO(b"".join(response.streaming_content))
+        )
+        self.assertEqual(
+            archive.namelist(), ["1_Согласие.docx", "2_Заявление.docx"]
+        )
+        for name in archive.namelist():
+            document_xml = zipfile.ZipFile(
+                io.BytesIO(archive.read(name))
+            ).read("word/document.xml")
+            self.assertIn("Иванов Иван", document_xml.decode())
+
+    def test_package_validation(self):
+        """Проверка ошибок в шаблонах и тэгах пакета"""
+        response = self.client.post(
+            self.url,
+            {"templates": [self.templates[0].id, 0]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("templates", response.data)
+        response = self.client.post(
+            self.url,
+            {
+                "templates": [self.templates[1].id],
+                "context": {"РебенокГруппа": "1"},
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("РебенокГруппа", response.data["errors"]["context"])
+
+
+class ExplainQueriesTest(TestCase):
+    def test_explain_on_seeded_data(self):
+        """Проверка, что планы запросов строятся на тестовых данных"""
+        out = io.StringIO()
+        call_command("explain_queries", seed=60, stdout=out)
+        self.assertIn("Каталог шаблонов", out.getvalue())
+        self.assertIn("Значения полей документа", out.getvalue())
+        # тестовые данные удалены
+        self.assertFalse(Document.objects.exists())
+        self.assertFalse(User.objects.exists())
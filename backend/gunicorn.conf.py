@@ -0,0 +1,35 @@
+"""Настройки gunicorn (файл загружается gunicorn автоматически)."""
+import gc
+import os
+import subprocess
+import sys
+
+# Загрузка словарей pymorphy2 в мастер-процессе: рабочие процессы
+# получают их при fork и используют совместно (copy-on-write)
+MORPH_PRELOAD = os.getenv("MORPH_PRELOAD", "False").lower() == "true"
+# Запуск пула LibreOffice (run_office_pool) вместе с gunicorn
+OFFICE_POOL_SIZE = int(os.getenv("OFFICE_POOL_SIZE", "2"))
+
+office_pool = None
+
+
+def on_starting(server):
+    global office_pool
+    if OFFICE_POOL_SIZE > 0:
+        office_pool = subprocess.Popen(
+            [sys.executable, "manage.py", "run_office_pool"]
+        )
+    if not MORPH_PRELOAD:
+        return
+    from core.template_render import get_morph
+
+    get_morph()
+    # объекты словарей не должны обходиться сборщиком мусора в рабочих
+    # процессах, иначе страницы памяти будут скопированы
+    gc.freeze()
+
+
+def on_exit(server):
+    if office_pool is not None:
+        office_pool.terminate()
+        office_pool.wait()